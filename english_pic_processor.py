@@ -1,10 +1,36 @@
 import os
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from PIL import Image, ImageTk, ImageChops, ImageDraw
-import time
+from PIL import ImageTk
 import threading
 import json
+import logging
+
+from pic_engine import (
+    LAYER_NAMES, LAYER_LABELS, PREVIEW_SIZE, IncrementalRenderer, RenderParams, Renderer, Template,
+    load_layer, make_proxy_layers, parse_bool, proxy_scale, render_card,
+)
+from pic_files import ImageList, ImageInfoCache
+from pic_metrics import Metrics
+from pic_cache import (
+    DiskImageCache, SourceImageCache, DEFAULT_CACHE_MB, DEFAULT_DISK_CACHE_MB, default_disk_cache_dir,
+)
+from pic_preview import PreviewScheduler, DEFAULT_DEBOUNCE_MS
+from pic_output import OUTPUT_FORMAT_LABELS, PNG_PRESETS, normalize_format, png_preset_name
+
+# 轮询后台处理结果的间隔（毫秒）
+PREVIEW_POLL_MS = 30
+
+# 方向键微调偏移量的步长（预览中的像素数，按住Shift时为10倍）
+NUDGE_STEP = 1
+
+# 查找文件夹中的图片时刷新数量的间隔（毫秒）
+SCAN_POLL_MS = 200
+
+# 批量导出性能统计的文件名（位于输出目录中）
+METRICS_FILENAME = "pic_metrics.jsonl"
+
+logger = logging.getLogger(__name__)
 
 class EnglishPicProcessor:
     def __init__(self, root):
@@ -24,13 +50,31 @@ class EnglishPicProcessor:
         # 添加顶层图片路径
         self.top_img_path = r"E:\Onedrive\KMS\10-英语音频\赵老师做好的\01-图片\真的只是标题.png"
         
-        # 调试标志
-        self.debug_mode = True
+        # 日志与性能统计
+        self.log_level = "INFO"  # 日志级别（DEBUG时输出每一步的处理信息）
+        self.collect_metrics = False  # 批量导出时统计各阶段耗时
         
         # 初始化变量
-        self.selected_images = []  # 选择的图片列表
+        self.selected_images = ImageList()  # 选择的图片列表（选择文件夹时在后台逐步查找）
+        self.image_info = ImageInfoCache()  # 图片尺寸和格式（只读取文件头）
+        self.scan_subfolders = tk.BooleanVar(value=True)  # 选择文件夹时包含子文件夹
         self.current_image_index = 0  # 当前预览的图片索引
-        self.original_images = {}  # 存储原始图片（调整宽度后的）
+        self.source_cache_mb = DEFAULT_CACHE_MB  # 原始图片缓存大小（MB）
+        self.disk_cache_mb = DEFAULT_DISK_CACHE_MB  # 磁盘缓存大小（MB，0表示不使用）
+        self.disk_cache_dir = ""  # 磁盘缓存目录（留空使用默认目录）
+        self.preview_debounce_ms = DEFAULT_DEBOUNCE_MS  # 预览防抖时间（毫秒）
+        self.preview_lookahead = 3  # 空闲时预先处理前后各几张图片的预览（0表示不预处理）
+        self.fast_decode = True  # 解码时直接缩小超大的图片
+        self.fused_resample = False  # 导出时适应宽度、裁剪、缩放合并为一次重采样
+        self.batch_workers = 0  # 批量导出的进程数（0表示CPU核心数，1表示单进程流水线）
+        self.templates = {}  # 预先构建的模板图层（导出用和预览用分开）
+        self.preview_layers = None  # 缩小后的模板图层（低分辨率预览用）
+        # 预览线程、100%查看的线程和界面线程都会用到上面两个缓存，由这个锁保护，只构建一次
+        self.layer_lock = threading.Lock()
+        self.preview_scale = 1.0  # 预览图层的缩小比例（图层变化时在界面线程中更新，不需要构建图层）
+        self.cached_images = {}  # 已经加载的模板图层（在后台线程中加载）
+        self.layer_requests = {}  # 图层名 -> 正在加载的请求编号（同一图层只采用最新的请求）
+        self.layer_request_count = 0
         
         # 图片处理参数
         self.scale_factor = tk.StringVar(value="100")  # 放大比例（百分比）
@@ -42,6 +86,15 @@ class EnglishPicProcessor:
         self.crop_top_percent = tk.StringVar(value="10")  # 上方裁剪比例（百分比）
         self.crop_corner_size = tk.StringVar(value="15")  # 右上角正方形裁剪大小（百分比）
         self.use_corner_crop = tk.BooleanVar(value=False)  # 是否启用右上角裁剪
+        self.overlay_alpha_blend = tk.BooleanVar(value=False)  # 背景覆盖图是否按透明度混合
+        self.skip_unchanged = tk.BooleanVar(value=True)  # 批量导出时跳过没有变化的图片
+        
+        # 导出设置
+        self.output_format = tk.StringVar(value=OUTPUT_FORMAT_LABELS[''])  # 导出格式（界面上的名称）
+        self.output_quality = tk.StringVar(value="90")  # JPEG/WebP质量
+        self.png_preset = tk.StringVar(value="默认")  # PNG压缩预设
+        self.flatten_opaque = True  # 完全不透明时保存为RGB
+        self.tiled_render = False  # 分块导出（超大画布导出PNG时节省内存）
         
         # 图层启用控制变量
         self.use_base_img = tk.BooleanVar(value=True)  # 是否使用底图
@@ -52,92 +105,130 @@ class EnglishPicProcessor:
         # 加载之前的配置
         self.load_config()
         
-        # 防抖动变量
-        self.update_pending = False  # 是否有更新等待中
+        # 原始图片缓存（调整宽度后的图片和裁剪后的图片分开缓存）
+        self.source_cache = SourceImageCache(int(self.source_cache_mb * 1024 * 1024), self.create_disk_cache())
+        
+        # 预览调度（单个后台线程，只处理最新的请求）
+        self.preview_scheduler = PreviewScheduler(self.render_preview_request, self.preview_debounce_ms,
+                                                  self.preview_lookahead * 2 + 8)
+        self.preview_polling = False  # 是否正在轮询预览结果
+        self.preview_params = None  # 最近一次提交的预览请求的参数
+        self.preview_shown = False  # 当前选择的图片是否已经开始预览
+        # 增量预览：偏移量或放大比例变化时只重新合成变化的区域（只在预览线程中使用）
+        self.preview_renderer = IncrementalRenderer(self.preview_lookahead * 2 + 2)
+        self.preview_image = None  # 正在显示的预览图像
+        self.preview_photo = None  # 正在显示的PhotoImage
+        self.nudging = False  # 是否正在用方向键微调偏移量
         
         # 创建界面
         self.create_widgets()
         
-        # 验证固定路径图片是否存在
-        self.verify_fixed_images()
+        # 输入框内容变化时自动更新预览（防抖由预览调度处理）
+        for var in (self.scale_factor, self.x_offset, self.y_offset, self.overlay_scale_factor,
+                    self.crop_bottom_percent, self.crop_right_percent, self.crop_top_percent,
+                    self.crop_corner_size):
+            var.trace_add("write", self.update_preview)
+        
+        # 方向键微调偏移量（输入框中仍然用于移动光标）
+        for key, dx, dy in (("Left", -1, 0), ("Right", 1, 0), ("Up", 0, -1), ("Down", 0, 1)):
+            self.root.bind(f"<{key}>", lambda e, dx=dx, dy=dy: self.nudge_offset(dx, dy))
+            self.root.bind(f"<Shift-{key}>", lambda e, dx=dx, dy=dy: self.nudge_offset(dx * 10, dy * 10))
         
-        # 缓存图像资源
+        # 在后台线程中加载模板图层，窗口先显示出来；路径检查等窗口显示后再提示
+        self.root.after_idle(self.verify_fixed_images)
         self.cache_resources()
         
         # 设置窗口关闭事件，用于保存配置
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
     
-    def cache_resources(self):
-        """缓存常用图像资源以提高性能"""
-        self.cached_images = {}
-        
-        # 加载底图
+    def create_disk_cache(self):
+        """创建磁盘缓存，未启用或无法创建时返回None"""
+        if self.disk_cache_mb <= 0:
+            return None
+        directory = self.disk_cache_dir or default_disk_cache_dir()
         try:
-            if os.path.exists(self.base_img_path):
-                self.cached_images['base'] = Image.open(self.base_img_path).convert("RGBA")
-                if self.debug_mode:
-                    print(f"底图加载成功: {self.base_img_path}")
-            else:
-                if self.debug_mode:
-                    print(f"底图路径不存在: {self.base_img_path}")
-        except Exception as e:
-            messagebox.showerror("缓存错误", f"加载底图时出错: {str(e)}")
-            if self.debug_mode:
-                print(f"底图加载错误: {str(e)}")
+            return DiskImageCache(directory, int(self.disk_cache_mb * 1024 * 1024))
+        except OSError as e:
+            logger.warning("无法使用磁盘缓存目录 %s: %s", directory, e)
+            return None
+    
+    def layer_wanted(self, name):
+        """图层是否需要加载（底图决定画布尺寸，总是加载；其他图层只在启用时加载）"""
+        return name == 'base' or getattr(self, f"use_{name}_img").get()
+    
+    def layers_loading(self):
+        """是否还有正在加载的模板图层"""
+        return bool(self.layer_requests)
+    
+    def cache_resources(self, names=None):
+        """在后台线程中加载模板图层，加载完成后更新预览
+        
+        names为需要（重新）加载的图层，默认为底图和全部已启用的图层；未启用的图层等到启用时再加载。
+        """
+        if names is None:
+            names = [name for name in LAYER_NAMES if self.layer_wanted(name)]
+        if not names:
+            return
+        self.layer_request_count += 1
+        request = self.layer_request_count
+        paths = {name: getattr(self, f"{name}_img_path") for name in names}
+        for name in names:
+            self.layer_requests[name] = request
+        self.layer_status_label.config(text="正在加载模板图层...")
+        
+        def load():
+            layers, errors = {}, {}
+            for name, path in paths.items():
+                try:
+                    layers[name] = load_layer(path, rgb_if_opaque=(name == 'base'))
+                except Exception as e:
+                    errors[name] = str(e)
+            return layers, errors
         
-        # 加载标题/遮挡图
-        try:
-            if os.path.exists(self.title_img_path):
-                self.cached_images['title'] = Image.open(self.title_img_path).convert("RGBA")
-                if self.debug_mode:
-                    print(f"标题图加载成功: {self.title_img_path}")
-            else:
-                if self.debug_mode:
-                    print(f"标题图路径不存在: {self.title_img_path}")
-        except Exception as e:
-            messagebox.showerror("缓存错误", f"加载标题/遮挡图时出错: {str(e)}")
-            if self.debug_mode:
-                print(f"标题图加载错误: {str(e)}")
+        self.run_in_background(load, lambda result, error: self.on_layers_loaded(request, paths, result, error))
+    
+    def on_layers_loaded(self, request, paths, result, error):
+        """在界面线程中放入加载好的图层（已经有更新的加载请求的图层直接丢弃）"""
+        layers, errors = result if result is not None else ({}, {name: error for name in paths})
+        current = [name for name in paths if self.layer_requests.get(name) == request]
+        if not current:
+            return
         
-        # 加载背景覆盖图
-        try:
-            if os.path.exists(self.overlay_img_path):
-                self.cached_images['overlay'] = Image.open(self.overlay_img_path).convert("RGBA")
-                if self.debug_mode:
-                    print(f"背景覆盖图加载成功: {self.overlay_img_path}")
+        # 换成新的字典，模板和预览图层按字典是否相同判断是否需要重建
+        cached_images = dict(self.cached_images)
+        for name in current:
+            del self.layer_requests[name]
+            label = LAYER_LABELS[name]
+            cached_images.pop(name, None)
+            if name in errors:
+                messagebox.showerror("缓存错误", f"加载{label}时出错: {errors[name]}")
+                logger.error("%s加载错误: %s", label, errors[name])
+            elif layers.get(name) is not None:
+                cached_images[name] = layers[name]
+                logger.info("%s加载成功: %s", label, paths[name])
             else:
-                if self.debug_mode:
-                    print(f"背景覆盖图路径不存在: {self.overlay_img_path}")
-        except Exception as e:
-            messagebox.showerror("缓存错误", f"加载背景覆盖图时出错: {str(e)}")
-            if self.debug_mode:
-                print(f"背景覆盖图加载错误: {str(e)}")
+                logger.info("%s路径不存在: %s", label, paths[name])
+        self.set_cached_images(cached_images)
         
-        # 加载顶层图片
-        try:
-            if os.path.exists(self.top_img_path):
-                self.cached_images['top'] = Image.open(self.top_img_path).convert("RGBA")
-                if self.debug_mode:
-                    print(f"顶层图片加载成功: {self.top_img_path}")
-            else:
-                if self.debug_mode:
-                    print(f"顶层图片路径不存在: {self.top_img_path}")
-        except Exception as e:
-            messagebox.showerror("缓存错误", f"加载顶层图片时出错: {str(e)}")
-            if self.debug_mode:
-                print(f"顶层图片加载错误: {str(e)}")
+        if not self.layers_loading():
+            self.layer_status_label.config(text="")
+        if self.selected_images:
+            self.update_preview()
+    
+    def toggle_layer(self, name):
+        """启用或停用图层；启用了还没有加载的图层时先在后台加载"""
+        if (self.layer_wanted(name) and name not in self.cached_images
+                and name not in self.layer_requests):
+            self.cache_resources([name])
+        self.update_preview()
     
     def verify_fixed_images(self):
-        """验证固定路径的图片是否存在"""
+        """验证固定路径的图片是否存在（只检查需要加载的图层）"""
         missing_files = []
-        if not os.path.exists(self.base_img_path):
-            missing_files.append(f"底图: {self.base_img_path}")
-        if not os.path.exists(self.title_img_path):
-            missing_files.append(f"标题/遮挡图: {self.title_img_path}")
-        if not os.path.exists(self.overlay_img_path):
-            missing_files.append(f"背景覆盖图: {self.overlay_img_path}")
-        if not os.path.exists(self.top_img_path):
-            missing_files.append(f"顶层图片: {self.top_img_path}")
+        for name in LAYER_NAMES:
+            path = getattr(self, f"{name}_img_path")
+            if self.layer_wanted(name) and not os.path.exists(path):
+                missing_files.append(f"{LAYER_LABELS[name]}: {path}")
         
         if missing_files:
             error_msg = "以下文件路径不存在:\n\n" + "\n".join(missing_files)
@@ -154,10 +245,13 @@ class EnglishPicProcessor:
         
         # 左侧操作区 - 显示已使用的固定路径
         ttk.Label(left_frame, text="图片路径:").grid(row=0, column=0, sticky=tk.W, pady=(0, 5))
+        self.layer_status_label = ttk.Label(left_frame, text="")  # 模板图层的加载状态
+        self.layer_status_label.grid(row=0, column=1, columnspan=2, sticky=tk.W, pady=(0, 5))
         
         # 底图路径和选择按钮
         ttk.Label(left_frame, text="底图:").grid(row=1, column=0, sticky=tk.W, pady=(0, 5), padx=(20, 0))
-        use_base_check = ttk.Checkbutton(left_frame, variable=self.use_base_img, command=self.update_preview)
+        use_base_check = ttk.Checkbutton(left_frame, variable=self.use_base_img,
+                                         command=lambda: self.toggle_layer("base"))
         use_base_check.grid(row=1, column=0, sticky=tk.E, padx=(0, 5))
         self.base_path_label = ttk.Label(left_frame, text=os.path.basename(self.base_img_path))
         self.base_path_label.grid(row=1, column=1, sticky=tk.W)
@@ -165,7 +259,8 @@ class EnglishPicProcessor:
         
         # 标题/遮挡图路径和选择按钮
         ttk.Label(left_frame, text="标题/遮挡图:").grid(row=2, column=0, sticky=tk.W, pady=(0, 5), padx=(20, 0))
-        use_title_check = ttk.Checkbutton(left_frame, variable=self.use_title_img, command=self.update_preview)
+        use_title_check = ttk.Checkbutton(left_frame, variable=self.use_title_img,
+                                         command=lambda: self.toggle_layer("title"))
         use_title_check.grid(row=2, column=0, sticky=tk.E, padx=(0, 5))
         self.title_path_label = ttk.Label(left_frame, text=os.path.basename(self.title_img_path))
         self.title_path_label.grid(row=2, column=1, sticky=tk.W)
@@ -173,7 +268,8 @@ class EnglishPicProcessor:
         
         # 背景覆盖图路径和选择按钮
         ttk.Label(left_frame, text="背景覆盖图:").grid(row=3, column=0, sticky=tk.W, pady=(0, 5), padx=(20, 0))
-        use_overlay_check = ttk.Checkbutton(left_frame, variable=self.use_overlay_img, command=self.update_preview)
+        use_overlay_check = ttk.Checkbutton(left_frame, variable=self.use_overlay_img,
+                                         command=lambda: self.toggle_layer("overlay"))
         use_overlay_check.grid(row=3, column=0, sticky=tk.E, padx=(0, 5))
         self.overlay_path_label = ttk.Label(left_frame, text=os.path.basename(self.overlay_img_path))
         self.overlay_path_label.grid(row=3, column=1, sticky=tk.W)
@@ -181,7 +277,8 @@ class EnglishPicProcessor:
         
         # 添加顶层图片路径和选择按钮
         ttk.Label(left_frame, text="顶层图片:").grid(row=4, column=0, sticky=tk.W, pady=(0, 5), padx=(20, 0))
-        use_top_check = ttk.Checkbutton(left_frame, variable=self.use_top_img, command=self.update_preview)
+        use_top_check = ttk.Checkbutton(left_frame, variable=self.use_top_img,
+                                         command=lambda: self.toggle_layer("top"))
         use_top_check.grid(row=4, column=0, sticky=tk.E, padx=(0, 5))
         self.top_path_label = ttk.Label(left_frame, text=os.path.basename(self.top_img_path))
         self.top_path_label.grid(row=4, column=1, sticky=tk.W)
@@ -191,7 +288,11 @@ class EnglishPicProcessor:
         ttk.Separator(left_frame, orient=tk.HORIZONTAL).grid(row=5, column=0, columnspan=2, sticky=tk.EW, pady=10)
         
         ttk.Label(left_frame, text="选择需要处理的图片:").grid(row=6, column=0, columnspan=2, sticky=tk.W, pady=(10, 5))
-        ttk.Button(left_frame, text="浏览...", command=self.select_images).grid(row=7, column=0, columnspan=2, sticky=tk.W)
+        select_frame = ttk.Frame(left_frame)
+        select_frame.grid(row=7, column=0, columnspan=3, sticky=tk.W)
+        ttk.Button(select_frame, text="浏览...", command=self.select_images).pack(side=tk.LEFT)
+        ttk.Button(select_frame, text="选择文件夹...", command=self.select_folder).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(select_frame, text="包含子文件夹", variable=self.scan_subfolders).pack(side=tk.LEFT, padx=5)
         
         ttk.Label(left_frame, text="选择的图片数量: 0").grid(row=8, column=0, columnspan=2, sticky=tk.W, pady=(5, 20))
         self.image_count_label = left_frame.grid_slaves(row=8, column=0)[0]
@@ -251,6 +352,8 @@ class EnglishPicProcessor:
         ttk.Label(left_frame, text="背景覆盖图放大比例(%):").grid(row=19, column=0, sticky=tk.W, pady=(10, 0), padx=(20, 0))
         overlay_entry = ttk.Entry(left_frame, textvariable=self.overlay_scale_factor, width=10)
         overlay_entry.grid(row=19, column=1, padx=5, pady=(10, 0), sticky=tk.W)
+        overlay_alpha_check = ttk.Checkbutton(left_frame, text="按透明度混合", variable=self.overlay_alpha_blend, command=self.update_preview)
+        overlay_alpha_check.grid(row=19, column=2, pady=(10, 0), sticky=tk.W)
         
         # 添加应用按钮，用于确认调整并更新预览
         ttk.Button(left_frame, text="应用调整", command=self.update_preview).grid(row=20, column=0, columnspan=2, pady=(10, 0))
@@ -263,8 +366,23 @@ class EnglishPicProcessor:
         
         ttk.Button(preview_frame, text="上一张", command=self.prev_image).pack(side=tk.LEFT, padx=5)
         ttk.Button(preview_frame, text="下一张", command=self.next_image).pack(side=tk.LEFT, padx=5)
+        ttk.Button(preview_frame, text="100%查看", command=self.show_full_size).pack(side=tk.LEFT, padx=5)
+        
+        # 导出格式
+        output_frame = ttk.Frame(left_frame)
+        output_frame.grid(row=23, column=0, columnspan=3, sticky=tk.W, pady=(20, 0))
+        
+        ttk.Label(output_frame, text="导出格式:").pack(side=tk.LEFT)
+        ttk.Combobox(output_frame, textvariable=self.output_format, values=list(OUTPUT_FORMAT_LABELS.values()),
+                     state="readonly", width=7).pack(side=tk.LEFT, padx=(5, 10))
+        ttk.Label(output_frame, text="质量:").pack(side=tk.LEFT)
+        ttk.Entry(output_frame, textvariable=self.output_quality, width=5).pack(side=tk.LEFT, padx=(5, 10))
+        ttk.Label(output_frame, text="PNG压缩:").pack(side=tk.LEFT)
+        ttk.Combobox(output_frame, textvariable=self.png_preset, values=list(PNG_PRESETS),
+                     state="readonly", width=5).pack(side=tk.LEFT, padx=5)
         
-        ttk.Button(left_frame, text="批量导出", command=self.batch_process).grid(row=23, column=0, columnspan=2, pady=(20, 0))
+        ttk.Button(left_frame, text="批量导出", command=self.batch_process).grid(row=24, column=0, columnspan=2, pady=(10, 0))
+        ttk.Checkbutton(left_frame, text="跳过未变化的图片", variable=self.skip_unchanged).grid(row=24, column=2, pady=(10, 0), sticky=tk.W)
         
         # 右侧预览区
         self.preview_label = ttk.Label(right_frame, text="预览区域 - 请选择图片")
@@ -277,11 +395,50 @@ class EnglishPicProcessor:
             filetypes=[("图片文件", "*.png;*.jpg;*.jpeg")]
         )
         if file_paths:
-            self.selected_images = list(file_paths)
-            self.image_count_label.config(text=f"选择的图片数量: {len(self.selected_images)}")
-            self.current_image_index = 0
-            self.original_images = {}  # 清空原始图片缓存
+            self.set_selected_images(ImageList(file_paths))
+    
+    def select_folder(self):
+        """选择文件夹，在后台查找其中的全部图片"""
+        directory = filedialog.askdirectory(title="选择包含图片的文件夹")
+        if directory:
+            self.set_selected_images(ImageList.from_directory(directory, self.scan_subfolders.get()))
+    
+    def set_selected_images(self, image_list):
+        """替换选择的图片列表"""
+        self.selected_images.cancel()
+        self.selected_images = image_list
+        self.current_image_index = 0
+        self.preview_shown = False
+        self.update_image_count()
+        self.update_preview()
+        if not image_list.complete:
+            self.root.after(SCAN_POLL_MS, self.poll_scan, image_list)
+    
+    def poll_scan(self, image_list):
+        """查找过程中刷新图片数量，找到第一张图片时立即预览"""
+        if image_list is not self.selected_images:
+            return
+        self.update_image_count()
+        if not self.preview_shown and len(image_list):
             self.update_preview()
+        if not image_list.complete:
+            self.root.after(SCAN_POLL_MS, self.poll_scan, image_list)
+    
+    def update_image_count(self):
+        """显示图片数量以及当前图片的尺寸和格式"""
+        total = len(self.selected_images)
+        text = f"选择的图片数量: {total}"
+        if not self.selected_images.complete:
+            text += "（正在查找...）"
+        if 0 <= self.current_image_index < total:
+            img_path = self.selected_images[self.current_image_index]
+            try:
+                info = self.image_info.get(img_path)
+                detail = f"{info['size'][0]}x{info['size'][1]} {info['format']}"
+            except Exception as e:
+                detail = f"无法读取: {e}"
+            text += f"\n当前第 {self.current_image_index + 1} 张: {os.path.basename(img_path)}（{detail}）"
+        self.image_count_label.config(text=text)
     
     def select_image_path(self, image_type):
         """选择图片路径"""
@@ -303,306 +460,265 @@ class EnglishPicProcessor:
                 self.top_img_path = file_path
                 self.top_path_label.config(text=os.path.basename(file_path))
             
-            # 清空缓存，重新加载资源
-            self.original_images = {}  # 清空原始图片缓存
-            self.cached_images = {}  # 清空缓存图像
-            self.cache_resources()  # 重新缓存资源
-            
-            # 如果有选定的图片，更新预览
-            if self.selected_images:
-                self.update_preview()
-    
-    def get_original_image(self, img_path):
-        """获取处理过的原始图片（调整宽度适应底图）"""
-        if img_path in self.original_images:
-            return self.original_images[img_path].copy()
-        
-        try:
-            # 加载原图并调整为底图宽度
-            if 'base' in self.cached_images:
-                base_width = self.cached_images['base'].width
-                img = Image.open(img_path).convert("RGBA")
-                
-                # 计算等比例缩放后的高度
-                width_percent = base_width / float(img.width)
-                new_height = int(float(img.height) * float(width_percent))
-                
-                # 调整图片大小
-                resized_img = img.resize((base_width, new_height), Image.LANCZOS)
-                
-                # 裁剪上方
-                try:
-                    crop_top_percent = float(self.crop_top_percent.get()) / 100.0
-                    if crop_top_percent > 0 and crop_top_percent < 1:
-                        # 计算要裁剪的高度
-                        crop_top_height = int(resized_img.height * crop_top_percent)
-                        # 裁剪图片 (left, top, right, bottom)
-                        resized_img = resized_img.crop((0, crop_top_height, resized_img.width, resized_img.height))
-                        if self.debug_mode:
-                            print(f"已裁剪上方 {crop_top_percent*100}% 的图片")
-                except ValueError:
-                    messagebox.showerror("参数错误", "上方裁剪比例必须是有效的数字")
-                
-                # 裁剪底部
-                try:
-                    crop_percent = float(self.crop_bottom_percent.get()) / 100.0
-                    if crop_percent > 0 and crop_percent < 1:
-                        # 计算要保留的高度
-                        crop_height = int(resized_img.height * (1 - crop_percent))
-                        # 裁剪图片 (left, top, right, bottom)
-                        resized_img = resized_img.crop((0, 0, resized_img.width, crop_height))
-                        if self.debug_mode:
-                            print(f"已裁剪底部 {crop_percent*100}% 的图片")
-                except ValueError:
-                    messagebox.showerror("参数错误", "裁剪比例必须是有效的数字")
-                
-                # 裁剪右侧
-                try:
-                    crop_right_percent = float(self.crop_right_percent.get()) / 100.0
-                    if crop_right_percent > 0 and crop_right_percent < 1:
-                        # 计算要保留的宽度
-                        crop_width = int(resized_img.width * (1 - crop_right_percent))
-                        # 裁剪图片 (left, top, right, bottom)
-                        resized_img = resized_img.crop((0, 0, crop_width, resized_img.height))
-                        if self.debug_mode:
-                            print(f"已裁剪右侧 {crop_right_percent*100}% 的图片")
-                except ValueError:
-                    messagebox.showerror("参数错误", "右侧裁剪比例必须是有效的数字")
-                
-                # 右上角正方形区域裁剪（如果启用）- 修复版本
-                if self.use_corner_crop.get():
-                    try:
-                        corner_size_percent = float(self.crop_corner_size.get()) / 100.0
-                        if corner_size_percent > 0 and corner_size_percent < 1:
-                            # 计算正方形的尺寸（基于图片宽度）
-                            square_size = int(resized_img.width * corner_size_percent)
-                            if square_size > 0:
-                                # 创建一个与图像大小相同的RGBA图像作为副本
-                                result_img = Image.new("RGBA", resized_img.size, (0, 0, 0, 0))
-                                
-                                # 将原始图像粘贴到结果图像上
-                                result_img.paste(resized_img, (0, 0), resized_img)
-                                
-                                # 创建一个绘图对象
-                                draw = ImageDraw.Draw(result_img)
-                                
-                                # 直接在右上角绘制一个完全透明的矩形
-                                draw.rectangle(
-                                    [(resized_img.width - square_size, 0), 
-                                     (resized_img.width, square_size)],
-                                    fill=(0, 0, 0, 0)  # 完全透明
-                                )
-                                
-                                # 使用修改后的图像
-                                resized_img = result_img
-                                
-                                if self.debug_mode:
-                                    print(f"已裁剪右上角 {corner_size_percent*100}% 大小的正方形区域")
-                    except ValueError:
-                        messagebox.showerror("参数错误", "右上角裁剪大小必须是有效的数字")
-                
-                # 缓存处理后的图片
-                self.original_images[img_path] = resized_img
-                return resized_img.copy()
+            # 只重新加载这个图层（原始图片缓存以底图宽度为键，无需清空），加载完成后更新预览；
+            # 未启用的图层等到启用时再加载
+            if self.layer_wanted(image_type):
+                self.cache_resources([image_type])
             else:
+                self.layer_requests.pop(image_type, None)
+                self.set_cached_images({name: layer for name, layer in self.cached_images.items()
+                                        if name != image_type})
+    
+    def get_render_params(self):
+        """读取界面上的参数，生成合成参数对象（参数无效时抛出ValueError）"""
+        return RenderParams.from_config(self.get_config())
+    
+    def set_cached_images(self, cached_images):
+        """在界面线程中替换模板图层（换成新的字典），同时更新预览的缩小比例"""
+        self.cached_images = cached_images
+        self.preview_scale = proxy_scale(cached_images, PREVIEW_SIZE)
+    
+    def get_layers(self, preview=False):
+        """获取模板图层（预览时为按预览区域大小缩小后的图层，图层变化后第一次用到时构建）"""
+        cached_images = self.cached_images
+        if not preview:
+            return cached_images, 1.0
+        
+        with self.layer_lock:
+            cached = self.preview_layers
+            if cached is None or cached[0] is not cached_images:
+                scale = proxy_scale(cached_images, PREVIEW_SIZE)
+                cached = (cached_images, make_proxy_layers(cached_images, scale), scale)
+                self.preview_layers = cached
+        return cached[1], cached[2]
+    
+    def get_template(self, params, preview=False):
+        """获取预先构建的模板图层（图层或相关参数变化时重建，同时只有一个线程构建）"""
+        layers, scale = self.get_layers(preview)
+        with self.layer_lock:
+            template = self.templates.get(preview)
+            if template is None or not template.matches(layers, params, scale):
+                template = Template(layers, params, scale)
+                self.templates[preview] = template
+        return template
+    
+    def get_original_image(self, img_path, params, preview=False):
+        """获取处理过的原始图片（调整宽度适应底图并裁剪，返回的图片由缓存持有，不能修改）"""
+        # 加载原图并调整为底图宽度（预览时直接缩放到缩小后的底图宽度）
+        layers, _ = self.get_layers(preview)
+        if 'base' not in layers:
+            return None
+        base_width = layers['base'].width
+        return self.source_cache.get(img_path, base_width, params)
+    
+    def render_snapshot(self, img_path, params, preview=False):
+        """按参数快照处理单张图片（preview为True时以预览分辨率处理）
+        
+        不访问界面上的变量和对话框，可以在后台线程中调用，出错时抛出异常。
+        原始分辨率下开启了fused_resample时与导出走同一条路径（Renderer.load，只做一次重采样），
+        结果与导出的文件一致。
+        """
+        if not preview and params.fused_resample:
+            if 'base' not in self.cached_images:
                 return None
-        except Exception as e:
-            messagebox.showerror("处理错误", f"调整图片尺寸时出错: {str(e)}")
-            if self.debug_mode:
-                import traceback
-                traceback.print_exc()
+            renderer = Renderer(params, self.cached_images, self.get_template(params))
+            return render_card(renderer.load(img_path), renderer.get_template(), params)
+        img_resized = self.get_original_image(img_path, params, preview)
+        if img_resized is None:
             return None
+        return render_card(img_resized, self.get_template(params, preview), params)
+    
+    def render_preview_request(self, request):
+        """预览线程中处理一个预览请求，返回RenderedFrame"""
+        img_path, params = request
+        try:
+            user_img = self.get_original_image(img_path, params, preview=True)
+            if user_img is None:
+                return None
+            return self.preview_renderer.render(img_path, user_img, self.get_template(params, preview=True), params)
+        except Exception:
+            logger.debug("预览处理失败: %s", img_path, exc_info=True)
+            raise
     
     def update_preview(self, *args):
-        """更新预览图像"""
-        self.update_pending = False
+        """更新预览图像
         
+        由输入框的变量跟踪触发时（args非空）参数可能还没输入完整，参数无效时不弹出提示。
+        """
         if 'base' not in self.cached_images or not self.selected_images:
             return
         
         # 获取当前预览的图片
-        if 0 <= self.current_image_index < len(self.selected_images):
-            img_path = self.selected_images[self.current_image_index]
-            
-            # 使用单独的线程处理图片
-            self.preview_label.config(text="正在处理预览...")
-            
-            def process_and_update():
-                # 处理图片
-                processed_img = self.process_image(img_path)
-                if processed_img:
-                    # 调整预览大小
-                    preview_w, preview_h = 700, 600
-                    preview_img = processed_img.copy()
-                    preview_img.thumbnail((preview_w, preview_h), Image.LANCZOS)
-                    
-                    # 使用主线程更新UI
-                    def update_ui():
-                        # 显示预览
-                        photo = ImageTk.PhotoImage(preview_img)
-                        self.preview_label.config(image=photo)
-                        self.preview_label.image = photo  # 保持引用以防止被垃圾回收
-                    
-                    self.root.after(0, update_ui)
-            
-            # 启动处理线程
-            processing_thread = threading.Thread(target=process_and_update)
-            processing_thread.daemon = True
-            processing_thread.start()
+        if not 0 <= self.current_image_index < len(self.selected_images):
+            return
+        img_path = self.selected_images[self.current_image_index]
+        self.preview_shown = True
+        self.update_image_count()
+        
+        # 在界面线程中读取参数快照，预览线程只使用快照
+        try:
+            params = self.get_render_params()
+        except ValueError as e:
+            if not args:
+                messagebox.showerror("参数错误", str(e))
+            return
+        
+        # 参数变化或图层加载完成后，预处理的结果全部作废
+        self.preview_scheduler.set_token((tuple(sorted(params.to_config().items())), id(self.cached_images)))
+        
+        # 已经预先处理过的图片直接显示
+        frame = self.preview_scheduler.lookup(img_path)
+        if frame is not None:
+            self.show_preview(frame)
+            self.prefetch_neighbours(params)
+            return
+        
+        # 方向键微调时不等待防抖时间（增量合成很快）
+        self.preview_label.config(text="正在处理预览...")
+        self.preview_scheduler.submit((img_path, params), img_path, 0 if self.nudging else None)
+        self.preview_params = params
+        
+        if not self.preview_polling:
+            self.preview_polling = True
+            self.root.after(PREVIEW_POLL_MS, self.poll_preview)
+    
+    def show_preview(self, frame):
+        """显示预览图像（在正在显示的图像上只改变了部分区域时，只更新这个区域）"""
+        if frame.base is not None and frame.base is self.preview_image and self.preview_photo is not None:
+            if frame.dirty is not None:
+                left, top = frame.dirty[:2]
+                region = ImageTk.PhotoImage(frame.image.crop(frame.dirty))
+                self.preview_photo.tk.call(str(self.preview_photo), "copy", str(region),
+                                           "-to", left, top, "-compositingrule", "set")
+        else:
+            photo = ImageTk.PhotoImage(frame.image)
+            self.preview_label.config(image=photo)
+            self.preview_label.image = photo  # 保持引用以防止被垃圾回收
+            self.preview_photo = photo
+        self.preview_image = frame.image
     
-    def process_image(self, img_path):
-        """处理单张图片"""
+    def nudge_offset(self, dx, dy):
+        """用方向键按预览中的像素微调偏移量"""
+        focus = self.root.focus_get()
+        if isinstance(focus, (tk.Entry, ttk.Entry, tk.Spinbox)):
+            return
+        if 'base' not in self.cached_images:
+            return
         try:
-            # 创建初始图像（如果不使用底图，则创建透明图像）
-            if self.use_base_img.get() and 'base' in self.cached_images:
-                result = self.cached_images['base'].copy()
-            else:
-                # 如果不使用底图，创建一个透明的画布
-                if 'base' in self.cached_images:
-                    base_size = self.cached_images['base'].size
-                else:
-                    # 如果没有底图缓存，使用默认大小
-                    base_size = (1920, 1080)
-                result = Image.new("RGBA", base_size, (0, 0, 0, 0))
-            
-            # 获取已调整宽度的图片
-            img_resized = self.get_original_image(img_path)
-            if img_resized is None:
-                return None
-            
-            # 应用用户定义的缩放（百分比转换为小数）
+            x_offset, y_offset = int(self.x_offset.get()), int(self.y_offset.get())
+        except ValueError:
+            return
+        # 预览是缩小显示的，每次至少移动预览中的一个像素
+        step = max(1, round(NUDGE_STEP / self.preview_scale))
+        self.nudging = True
+        try:
+            if dx:
+                self.x_offset.set(str(x_offset + dx * step))
+            if dy:
+                self.y_offset.set(str(y_offset + dy * step))
+        finally:
+            self.nudging = False
+        return "break"
+    
+    def prefetch_neighbours(self, params):
+        """空闲时按当前参数预先处理前后几张图片（由近到远，先下一张后上一张）"""
+        count = len(self.selected_images)
+        items = []
+        seen = {self.current_image_index}
+        for distance in range(1, self.preview_lookahead + 1):
+            for index in (self.current_image_index + distance, self.current_image_index - distance):
+                index %= count
+                if index not in seen:
+                    seen.add(index)
+                    img_path = self.selected_images[index]
+                    items.append((img_path, (img_path, params)))
+        self.preview_scheduler.prefetch(items)
+    
+    def poll_preview(self):
+        """在界面线程中取出预览结果并显示"""
+        # 先判断是否空闲再取结果，保证空闲时结果已经就绪
+        idle = self.preview_scheduler.is_idle()
+        result = self.preview_scheduler.poll()
+        if result is not None:
+            generation, frame, error = result
+            if error is not None:
+                messagebox.showerror("处理错误", f"处理图片时出错: {error}")
+            elif frame is not None:
+                self.show_preview(frame)
+                self.prefetch_neighbours(self.preview_params)
+        
+        if idle:
+            self.preview_polling = False
+        else:
+            self.root.after(PREVIEW_POLL_MS, self.poll_preview)
+    
+    def run_in_background(self, func, on_done):
+        """在后台线程中执行func，完成后在界面线程中调用 on_done(结果, 错误信息)"""
+        outcome = {}
+        
+        def worker():
             try:
-                scale_percent = float(self.scale_factor.get()) / 100.0
-                x_offset = int(self.x_offset.get())
-                y_offset = int(self.y_offset.get())  # 获取垂直偏移
-            except ValueError:
-                messagebox.showerror("参数错误", "请输入有效的数字")
-                return None
-            
-            if scale_percent <= 0:
-                messagebox.showerror("参数错误", "放大比例必须大于0")
-                return None
-            
-            # 应用缩放
-            if scale_percent != 1.0:
-                new_width = int(img_resized.width * scale_percent)
-                new_height = int(img_resized.height * scale_percent)
-                img_resized = img_resized.resize((new_width, new_height), Image.LANCZOS)
-            
-            # 计算图片位置 (居中 + x偏移 + y偏移)
-            x = (result.width - img_resized.width) // 2 + x_offset
-            y = (result.height - img_resized.height) // 2 + y_offset  # 添加y偏移
-            
-            # 创建一个与结果大小相同的透明图像来粘贴用户图片
-            user_img_layer = Image.new("RGBA", result.size, (0, 0, 0, 0))
-            user_img_layer.paste(img_resized, (x, y), img_resized)
-            
-            # 合并底图和用户图片
-            result = Image.alpha_composite(result, user_img_layer)
-            
-            # 添加标题/遮挡图 - 先添加标题/遮挡图（仅当启用时）
-            if self.use_title_img.get() and 'title' in self.cached_images:
-                title_img = self.cached_images['title'].copy()
-                if self.debug_mode:
-                    print("正在添加标题/遮挡图")
-                    print(f"标题图尺寸: {title_img.width}x{title_img.height}")
-                    print(f"结果图尺寸: {result.width}x{result.height}")
-                
-                # 创建标题图层并粘贴
-                title_layer = Image.new("RGBA", result.size, (0, 0, 0, 0))
-                title_layer.paste(title_img, (0, 0), title_img)
-                
-                # 使用alpha合成添加标题图
-                result = Image.alpha_composite(result, title_layer)
-            elif self.debug_mode and self.use_title_img.get():
-                print("标题/遮挡图未在缓存中找到")
-            
-            # 添加背景覆盖图（使用自定义混合模式）- 最后添加，放在最顶层（仅当启用时）
-            if self.use_overlay_img.get() and 'overlay' in self.cached_images:
-                overlay_img = self.cached_images['overlay'].copy()
-                
-                # 应用背景覆盖图缩放（百分比转换为小数）
-                try:
-                    overlay_scale_percent = float(self.overlay_scale_factor.get()) / 100.0
-                except ValueError:
-                    messagebox.showerror("参数错误", "请输入有效的数字")
-                    return None
-                
-                if overlay_scale_percent <= 0:
-                    messagebox.showerror("参数错误", "背景覆盖图放大比例必须大于0")
-                    return None
-                
-                # 调整覆盖图大小
-                overlay_w = int(overlay_img.width * overlay_scale_percent)
-                overlay_h = int(overlay_img.height * overlay_scale_percent)
-                overlay_resized = overlay_img.resize((overlay_w, overlay_h), Image.LANCZOS)
-                
-                # 计算覆盖图位置（居中）
-                overlay_x = (result.width - overlay_w) // 2
-                overlay_y = (result.height - overlay_h) // 2
-                
-                # 创建一个覆盖图层
-                overlay_layer = Image.new("RGBA", result.size, (0, 0, 0, 0))
-                overlay_layer.paste(overlay_resized, (overlay_x, overlay_y), overlay_resized)
-                
-                # 提取覆盖图的RGB和透明度通道
-                r, g, b, a = overlay_layer.split()
-                
-                # 提取结果图像的RGB和透明度通道
-                r2, g2, b2, a2 = result.split()
-                
-                # 手动进行自定义的混合（正片叠底，但保持适当的透明度）
-                # 对于每个颜色通道应用正片叠底效果，但调整透明度处理方式
-                r3 = ImageChops.multiply(r, r2)
-                g3 = ImageChops.multiply(g, g2)
-                b3 = ImageChops.multiply(b, b2)
-                
-                # 透明度通道使用原始图像的透明度 
-                # 这确保了没有黑边
-                
-                # 根据覆盖图的透明度权重来应用混合
-                # 创建一个新的蒙版，表示应该应用正片叠底效果的地方
-                # 255 表示完全应用，0 表示不应用
-                blend_mask = Image.new("L", result.size, 0)
-                blend_mask.paste(a, (0, 0), a)  # 使用覆盖图自身的alpha作为混合蒙版
-                
-                # 创建最终的RGB通道
-                r_final = Image.blend(r2, r3, 0.7)  # 使用0.7作为系数可以减轻效果
-                g_final = Image.blend(g2, g3, 0.7)
-                b_final = Image.blend(b2, b3, 0.7)
-                
-                # 合并通道
-                final_result = Image.merge("RGBA", (r_final, g_final, b_final, a2))
-                
-                if self.debug_mode:
-                    print("使用自定义混合模式应用背景覆盖图")
-                
-                result = final_result
-            
-            # 添加顶层图片（放在最后，处于最顶层）
-            if self.use_top_img.get() and 'top' in self.cached_images:
-                top_img = self.cached_images['top'].copy()
-                if self.debug_mode:
-                    print("正在添加顶层图片")
-                    print(f"顶层图片尺寸: {top_img.width}x{top_img.height}")
-                
-                # 创建顶层图层并粘贴
-                top_layer = Image.new("RGBA", result.size, (0, 0, 0, 0))
-                top_layer.paste(top_img, (0, 0), top_img)
-                
-                # 使用alpha合成添加顶层图片
-                result = Image.alpha_composite(result, top_layer)
-            elif self.debug_mode and self.use_top_img.get():
-                print("顶层图片未在缓存中找到")
-            
-            return result
+                outcome['result'] = func()
+            except Exception as e:
+                outcome['error'] = str(e)
+            outcome['done'] = True
+        
+        def poll():
+            if 'done' in outcome:
+                on_done(outcome.get('result'), outcome.get('error'))
+            else:
+                self.root.after(PREVIEW_POLL_MS, poll)
         
-        except Exception as e:
-            messagebox.showerror("处理错误", f"处理图片时出错: {str(e)}")
-            if self.debug_mode:
-                import traceback
-                traceback.print_exc()
-            return None
+        processing_thread = threading.Thread(target=worker)
+        processing_thread.daemon = True
+        processing_thread.start()
+        self.root.after(PREVIEW_POLL_MS, poll)
+    
+    def show_full_size(self):
+        """在新窗口中以100%比例查看当前图片的导出效果"""
+        if 'base' not in self.cached_images or not self.selected_images:
+            return
+        if self.layers_loading():
+            messagebox.showinfo("提示", "正在加载模板图层，请稍后再查看")
+            return
+        
+        try:
+            params = self.get_render_params()
+        except ValueError as e:
+            messagebox.showerror("参数错误", str(e))
+            return
+        
+        img_path = self.selected_images[self.current_image_index]
+        
+        zoom_window = tk.Toplevel(self.root)
+        zoom_window.title(f"100% - {os.path.basename(img_path)}")
+        zoom_window.geometry("1000x700")
+        
+        canvas = tk.Canvas(zoom_window)
+        x_scroll = ttk.Scrollbar(zoom_window, orient=tk.HORIZONTAL, command=canvas.xview)
+        y_scroll = ttk.Scrollbar(zoom_window, orient=tk.VERTICAL, command=canvas.yview)
+        canvas.configure(xscrollcommand=x_scroll.set, yscrollcommand=y_scroll.set)
+        x_scroll.pack(side=tk.BOTTOM, fill=tk.X)
+        y_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        canvas.create_text(20, 20, text="正在处理...", anchor=tk.NW)
+        
+        def show(processed_img, error):
+            if not zoom_window.winfo_exists():
+                return
+            if error is not None:
+                zoom_window.destroy()
+                messagebox.showerror("处理错误", f"处理图片时出错: {error}")
+                return
+            if processed_img is None:
+                return
+            photo = ImageTk.PhotoImage(processed_img)
+            canvas.delete("all")
+            canvas.create_image(0, 0, image=photo, anchor=tk.NW)
+            canvas.configure(scrollregion=(0, 0, processed_img.width, processed_img.height))
+            canvas.image = photo  # 保持引用以防止被垃圾回收
+        
+        self.run_in_background(lambda: self.render_snapshot(img_path, params), show)
     
     def prev_image(self):
         """预览上一张图片"""
@@ -617,20 +733,38 @@ class EnglishPicProcessor:
             self.update_preview()
     
     def batch_process(self):
-        """批量处理并导出图片"""
+        """批量处理并导出图片（多进程并行，界面不阻塞）"""
         if 'base' not in self.cached_images or not self.selected_images:
             messagebox.showwarning("警告", "请先选择需要处理的图片")
             return
+        if self.layers_loading():
+            messagebox.showinfo("提示", "正在加载模板图层，请在加载完成后再导出")
+            return
+        if not self.selected_images.complete:
+            messagebox.showinfo("提示", f"正在查找图片（已找到 {len(self.selected_images)} 张），请在查找完成后再导出")
+            return
+        
+        try:
+            params = self.get_render_params()
+        except ValueError as e:
+            messagebox.showerror("参数错误", str(e))
+            return
         
         output_dir = filedialog.askdirectory(title="选择保存目录")
         if not output_dir:
             return
         
+        # 保存目录在选择的文件夹中时，不再处理之前导出的结果
+        img_paths = self.selected_images.without_outputs(output_dir)
+        if not img_paths:
+            messagebox.showwarning("警告", "选择的文件夹中只有之前导出的图片")
+            return
+        
         try:
             # 创建进度窗口
             progress_window = tk.Toplevel(self.root)
             progress_window.title("处理进度")
-            progress_window.geometry("300x100")
+            progress_window.geometry("300x140")
             
             progress_label = ttk.Label(progress_window, text="正在处理图片...")
             progress_label.pack(pady=10)
@@ -638,26 +772,63 @@ class EnglishPicProcessor:
             progress_bar = ttk.Progressbar(progress_window, orient=tk.HORIZONTAL, length=250, mode='determinate')
             progress_bar.pack(pady=10)
             
-            total_images = len(self.selected_images)
+            total_images = len(img_paths)
             progress_bar['maximum'] = total_images
             
-            for i, img_path in enumerate(self.selected_images):
-                # 更新进度条
-                progress_bar['value'] = i + 1
-                progress_label.config(text=f"正在处理: {i+1}/{total_images}")
-                progress_window.update()
-                
-                # 处理图片
-                processed_img = self.process_image(img_path)
-                
-                # 保存图片
-                if processed_img:
-                    filename = os.path.basename(img_path)
-                    output_path = os.path.join(output_dir, f"processed_{filename}")
-                    processed_img.save(output_path)
+            # 多进程相关的模块只在导出时才导入，加快启动
+            from pic_batch import BatchJob
+            
+            metrics = None
+            if self.collect_metrics:
+                metrics = Metrics(os.path.join(output_dir, METRICS_FILENAME))
+            job = BatchJob(params, self.cached_images, img_paths, output_dir,
+                           self.batch_workers, self.skip_unchanged.get(), metrics,
+                           self.selected_images.root)
+            
+            def cancel():
+                job.cancel()
+                cancel_button.config(state=tk.DISABLED)
+                progress_label.config(text="正在取消，等待处理中的图片完成...")
+            
+            cancel_button = ttk.Button(progress_window, text="取消", command=cancel)
+            cancel_button.pack()
+            progress_window.protocol("WM_DELETE_WINDOW", cancel)
+            
+            def poll():
+                for event in job.poll():
+                    if event[0] == 'progress':
+                        _, finished, total, img_path, error = event
+                        # 跳过的图片不计入总数
+                        progress_bar['maximum'] = total
+                        progress_bar['value'] = finished
+                        if not job.cancel_event.is_set():
+                            progress_label.config(text=f"正在处理: {finished}/{total}")
+                        if error:
+                            logger.warning("处理失败: %s: %s", img_path, error)
+                    elif event[0] == 'finished':
+                        _, succeeded, failed, cancelled, skipped = event
+                        progress_window.destroy()
+                        if metrics is not None:
+                            logger.info("批量导出性能统计:\n%s", metrics.format_table())
+                        message = f"已成功处理并保存 {succeeded} 张图片到 {output_dir}"
+                        if cancelled:
+                            message = "已取消，" + message
+                        if skipped:
+                            message += f"\n跳过 {len(skipped)} 张没有变化的图片"
+                        if failed:
+                            failed_names = "\n".join(os.path.basename(path) for path, _ in failed[:10])
+                            messagebox.showwarning("完成", f"{message}\n\n{len(failed)} 张处理失败:\n{failed_names}")
+                        else:
+                            messagebox.showinfo("完成", message)
+                        return
+                    elif event[0] == 'error':
+                        progress_window.destroy()
+                        messagebox.showerror("错误", f"批量处理时出错: {event[1]}")
+                        return
+                self.root.after(100, poll)
             
-            progress_window.destroy()
-            messagebox.showinfo("完成", f"已成功处理并保存 {total_images} 张图片到 {output_dir}")
+            job.start()
+            self.root.after(100, poll)
         
         except Exception as e:
             messagebox.showerror("错误", f"批量处理时出错: {str(e)}")
@@ -698,6 +869,8 @@ class EnglishPicProcessor:
                     self.crop_corner_size.set(config['crop_corner_size'])
                 if 'use_corner_crop' in config:
                     self.use_corner_crop.set(config['use_corner_crop'])
+                if 'overlay_alpha_blend' in config:
+                    self.overlay_alpha_blend.set(config['overlay_alpha_blend'])
                 
                 # 加载图层启用状态
                 if 'use_base_img' in config:
@@ -709,57 +882,132 @@ class EnglishPicProcessor:
                 if 'use_top_img' in config:
                     self.use_top_img.set(config['use_top_img'])
                 
-                if self.debug_mode:
-                    print("成功加载配置文件")
+                # 加载缓存、预览与导出设置
+                if 'source_cache_mb' in config:
+                    self.source_cache_mb = float(config['source_cache_mb'])
+                if 'disk_cache_mb' in config:
+                    self.disk_cache_mb = float(config['disk_cache_mb'])
+                if 'disk_cache_dir' in config:
+                    self.disk_cache_dir = config['disk_cache_dir']
+                if 'preview_debounce_ms' in config:
+                    self.preview_debounce_ms = float(config['preview_debounce_ms'])
+                if 'preview_lookahead' in config:
+                    self.preview_lookahead = int(config['preview_lookahead'])
+                if 'batch_workers' in config:
+                    self.batch_workers = int(config['batch_workers'])
+                if 'skip_unchanged' in config:
+                    self.skip_unchanged.set(config['skip_unchanged'])
+                
+                # 加载导出设置
+                if 'output_format' in config:
+                    self.output_format.set(OUTPUT_FORMAT_LABELS[normalize_format(config['output_format'])])
+                if 'output_quality' in config:
+                    self.output_quality.set(config['output_quality'])
+                if 'png_compress_level' in config or 'png_optimize' in config:
+                    self.png_preset.set(png_preset_name(int(config.get('png_compress_level', 6)),
+                                                        parse_bool(config.get('png_optimize', False))))
+                if 'flatten_opaque' in config:
+                    self.flatten_opaque = parse_bool(config['flatten_opaque'])
+                if 'tiled_render' in config:
+                    self.tiled_render = parse_bool(config['tiled_render'])
+                if 'fast_decode' in config:
+                    self.fast_decode = parse_bool(config['fast_decode'])
+                if 'fused_resample' in config:
+                    self.fused_resample = parse_bool(config['fused_resample'])
+                
+                # 加载日志与性能统计设置
+                if 'log_level' in config:
+                    self.log_level = str(config['log_level']).upper()
+                    logging.getLogger().setLevel(self.log_level)
+                if 'collect_metrics' in config:
+                    self.collect_metrics = parse_bool(config['collect_metrics'])
+                
+                logger.info("成功加载配置文件")
         
         except Exception as e:
-            if self.debug_mode:
-                print(f"加载配置文件时出错: {str(e)}")
+            logger.error("加载配置文件时出错: %s", e)
+    
+    def get_output_format(self):
+        """界面上选择的导出格式对应的配置值"""
+        label = self.output_format.get()
+        for fmt, fmt_label in OUTPUT_FORMAT_LABELS.items():
+            if fmt_label == label:
+                return fmt
+        return ''
+    
+    def get_config(self):
+        """收集当前的配置"""
+        return {
+            # 图片路径
+            'base_img_path': self.base_img_path,
+            'title_img_path': self.title_img_path,
+            'overlay_img_path': self.overlay_img_path,
+            'top_img_path': self.top_img_path,
+            
+            # 参数
+            'scale_factor': self.scale_factor.get(),
+            'x_offset': self.x_offset.get(),
+            'y_offset': self.y_offset.get(),
+            'overlay_scale_factor': self.overlay_scale_factor.get(),
+            'crop_bottom_percent': self.crop_bottom_percent.get(),
+            'crop_right_percent': self.crop_right_percent.get(),
+            'crop_top_percent': self.crop_top_percent.get(),
+            'crop_corner_size': self.crop_corner_size.get(),
+            'use_corner_crop': self.use_corner_crop.get(),
+            'overlay_alpha_blend': self.overlay_alpha_blend.get(),
+            'fast_decode': self.fast_decode,
+            'fused_resample': self.fused_resample,
+            
+            # 导出设置
+            'output_format': self.get_output_format(),
+            'output_quality': self.output_quality.get(),
+            'png_compress_level': PNG_PRESETS[self.png_preset.get()][0],
+            'png_optimize': PNG_PRESETS[self.png_preset.get()][1],
+            'flatten_opaque': self.flatten_opaque,
+            'tiled_render': self.tiled_render,
+            
+            # 图层启用状态
+            'use_base_img': self.use_base_img.get(),
+            'use_title_img': self.use_title_img.get(),
+            'use_overlay_img': self.use_overlay_img.get(),
+            'use_top_img': self.use_top_img.get(),
+            
+            # 缓存、预览与导出设置
+            'source_cache_mb': self.source_cache_mb,
+            'disk_cache_mb': self.disk_cache_mb,
+            'disk_cache_dir': self.disk_cache_dir,
+            'preview_debounce_ms': self.preview_debounce_ms,
+            'preview_lookahead': self.preview_lookahead,
+            'batch_workers': self.batch_workers,
+            'skip_unchanged': self.skip_unchanged.get(),
+            
+            # 日志与性能统计
+            'log_level': self.log_level,
+            'collect_metrics': self.collect_metrics,
+        }
     
     def save_config(self):
         """保存配置到文件"""
         try:
-            config = {
-                # 图片路径
-                'base_img_path': self.base_img_path,
-                'title_img_path': self.title_img_path,
-                'overlay_img_path': self.overlay_img_path,
-                'top_img_path': self.top_img_path,
-                
-                # 参数
-                'scale_factor': self.scale_factor.get(),
-                'x_offset': self.x_offset.get(),
-                'y_offset': self.y_offset.get(),
-                'overlay_scale_factor': self.overlay_scale_factor.get(),
-                'crop_bottom_percent': self.crop_bottom_percent.get(),
-                'crop_right_percent': self.crop_right_percent.get(),
-                'crop_top_percent': self.crop_top_percent.get(),
-                'crop_corner_size': self.crop_corner_size.get(),
-                'use_corner_crop': self.use_corner_crop.get(),
-                
-                # 图层启用状态
-                'use_base_img': self.use_base_img.get(),
-                'use_title_img': self.use_title_img.get(),
-                'use_overlay_img': self.use_overlay_img.get(),
-                'use_top_img': self.use_top_img.get(),
-            }
+            config = self.get_config()
             
             with open(self.config_file, 'w', encoding='utf-8') as f:
                 json.dump(config, f, ensure_ascii=False, indent=4)
             
-            if self.debug_mode:
-                print("成功保存配置文件")
+            logger.info("成功保存配置文件")
         
         except Exception as e:
-            if self.debug_mode:
-                print(f"保存配置文件时出错: {str(e)}")
+            logger.error("保存配置文件时出错: %s", e)
     
     def on_closing(self):
         """窗口关闭时的处理"""
         self.save_config()
+        self.preview_scheduler.close()
         self.root.destroy()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    logging.getLogger("PIL").setLevel(logging.INFO)  # Pillow的调试日志过多
     root = tk.Tk()
     app = EnglishPicProcessor(root)
     root.mainloop() 
\ No newline at end of file
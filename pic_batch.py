@@ -0,0 +1,353 @@
+"""批量导出
+
+两种方式：
+    多进程（run_parallel）：模板在主进程中构建一次，模板图层和模板中画布大小的数据写入共享的临时文件，
+        工作进程通过mmap零拷贝引用（见pic_shared），不再各自构建模板；之后每个任务只传图片路径，
+        合成与编码都在工作进程中完成，结果（输出路径或错误信息）按完成顺序返回。
+    单进程流水线（run_pipeline）：读取线程提前解码后面的图片，当前线程合成，
+        写入线程池负责编码和保存，各阶段之间的队列有长度上限，内存占用与图片数量无关。
+
+run_batch根据进程数选择其中一种，并可以使用输出目录中的导出清单跳过没有变化的图片。
+"""
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import pic_metrics
+from pic_engine import RenderParams, Renderer, check_output_names
+from pic_manifest import ExportManifest, settings_fingerprint
+from pic_shared import SharedLayers, attach_layers
+
+logger = logging.getLogger(__name__)
+
+# 流水线默认提前解码的图片数量和写入线程数
+DEFAULT_PREFETCH = 4
+DEFAULT_WRITERS = 2
+
+# 工作进程中的渲染器（由_init_worker创建）
+_worker_renderer = None
+_worker_output_dir = None
+_worker_root = None
+_worker_mapping = None  # 共享图层文件的映射，需要在进程的整个生命周期内保留
+
+# 共享文件中模板数据名称的前缀（与模板图层区分）
+TEMPLATE_PREFIX = 'template.'
+
+
+def _share_template(params, layers):
+    """在主进程中构建模板，与模板图层一起写入共享文件
+
+    返回 (SharedLayers, 不含大块数据的模板)。模板本身在这里构建完就释放，主进程只多占用一次构建的内存。
+    """
+    template = Renderer(params, layers).get_template()
+    shared = dict(layers)
+    for name, value in template.shared_buffers().items():
+        shared[TEMPLATE_PREFIX + name] = value
+    return SharedLayers(shared), template.with_buffers({}, {})
+
+
+def _init_worker(layers_handle, template, config, output_dir, root, log_level, collect_metrics):
+    """工作进程初始化：映射共享的模板图层和模板数据，按主进程的设置配置日志和性能统计"""
+    global _worker_renderer, _worker_output_dir, _worker_root, _worker_mapping
+    logging.basicConfig(level=log_level)
+    if collect_metrics:
+        pic_metrics.enable()
+    shared, _worker_mapping = attach_layers(layers_handle)
+    layers = {name: value for name, value in shared.items() if not name.startswith(TEMPLATE_PREFIX)}
+    buffers = {name[len(TEMPLATE_PREFIX):]: value for name, value in shared.items()
+               if name.startswith(TEMPLATE_PREFIX)}
+    _worker_renderer = Renderer(RenderParams.from_config(config), layers, template.with_buffers(layers, buffers))
+    _worker_output_dir = output_dir
+    _worker_root = root
+
+
+def _render_task(img_path):
+    """工作进程中处理单张图片，返回 (图片路径, 输出路径, 错误信息, 性能统计)"""
+    try:
+        output_path = _worker_renderer.render_to_dir(img_path, _worker_output_dir, _worker_root)
+    except Exception as e:
+        output_path, error = None, str(e)
+    else:
+        error = None
+    metrics = pic_metrics.active()
+    return img_path, output_path, error, metrics.drain() if metrics is not None else None
+
+
+def default_workers():
+    """默认工作进程数（CPU核心数）"""
+    return os.cpu_count() or 1
+
+
+def run_parallel(params, layers, img_paths, output_dir, workers=None,
+                 on_result=None, cancel_event=None, root=None):
+    """用进程池批量处理图片
+
+    root为选择的文件夹，输出目录中保留图片在其中的子文件夹（见output_filename）。
+    每完成一张调用 on_result(已完成数, 总数, 图片路径, 输出路径, 错误信息)。
+    cancel_event被设置后不再提交新任务，等待正在处理的图片完成后返回。
+    主进程启用了性能统计时，工作进程的统计随结果传回并合并。
+    返回 (成功数, 失败列表[(图片路径, 错误信息)], 是否被取消)。
+    """
+    workers = workers or default_workers()
+    total = len(img_paths)
+    succeeded = 0
+    failed = []
+    finished = 0
+
+    metrics = pic_metrics.active()
+    shared, template = _share_template(params, layers)
+    # 工作进程全部退出之后再删除共享文件
+    with shared, ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker,
+            initargs=(shared.handle(), template, params.to_config(), output_dir, root,
+                      logging.getLogger().getEffectiveLevel(), metrics is not None)) as executor:
+        pending = set()
+        remaining = iter(img_paths)
+        # 同时在途的任务数量有限，便于及时响应取消
+        max_in_flight = workers * 2
+
+        while True:
+            cancelled = cancel_event is not None and cancel_event.is_set()
+            while not cancelled and len(pending) < max_in_flight:
+                img_path = next(remaining, None)
+                if img_path is None:
+                    break
+                pending.add(executor.submit(_render_task, img_path))
+
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                img_path, output_path, error, worker_metrics = future.result()
+                if metrics is not None and worker_metrics is not None:
+                    metrics.merge(worker_metrics)
+                finished += 1
+                if error is None:
+                    succeeded += 1
+                else:
+                    failed.append((img_path, error))
+                if on_result is not None:
+                    on_result(finished, total, img_path, output_path, error)
+
+    cancelled = cancel_event is not None and cancel_event.is_set() and finished < total
+    return succeeded, failed, cancelled
+
+
+class _Progress:
+    """线程安全的进度统计"""
+
+    def __init__(self, total, on_result):
+        self.total = total
+        self.on_result = on_result
+        self.finished = 0
+        self.succeeded = 0
+        self.failed = []
+        self.lock = threading.Lock()
+
+    def report(self, img_path, output_path, error):
+        with self.lock:
+            self.finished += 1
+            if error is None:
+                self.succeeded += 1
+            else:
+                self.failed.append((img_path, error))
+            if self.on_result is not None:
+                self.on_result(self.finished, self.total, img_path, output_path, error)
+
+
+def run_pipeline(params, layers, img_paths, output_dir, on_result=None, cancel_event=None,
+                 prefetch=DEFAULT_PREFETCH, writers=DEFAULT_WRITERS, root=None):
+    """单进程流水线批量处理：读取解码、合成、编码保存三个阶段同时进行
+
+    参数和返回值与run_parallel相同。读取线程最多提前prefetch张，
+    等待写入的合成结果最多writers*2张，读盘、合成、写盘互相掩盖等待时间。
+    """
+    renderer = Renderer(params, layers)
+    progress = _Progress(len(img_paths), on_result)
+    decoded = queue.Queue(maxsize=max(1, prefetch))
+    write_slots = threading.BoundedSemaphore(max(1, writers) * 2)
+    stop = threading.Event()
+    end = object()
+
+    def cancelled():
+        return stop.is_set() or (cancel_event is not None and cancel_event.is_set())
+
+    def put(item):
+        """放入队列，队列满时等待，取消后放弃"""
+        while not cancelled():
+            try:
+                decoded.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def reader():
+        for img_path in img_paths:
+            if cancelled():
+                break
+            try:
+                put((img_path, renderer.load(img_path), None))
+            except Exception as e:
+                put((img_path, None, str(e)))
+        put(end)
+
+    def write(processed_img, img_path):
+        try:
+            output_path = renderer.save(processed_img, img_path, output_dir, root)
+        except Exception as e:
+            progress.report(img_path, None, str(e))
+        else:
+            progress.report(img_path, output_path, None)
+        finally:
+            write_slots.release()
+
+    reader_thread = threading.Thread(target=reader)
+    reader_thread.daemon = True
+    reader_thread.start()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, writers)) as executor:
+            while not cancelled():
+                try:
+                    item = decoded.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is end:
+                    break
+                img_path, user_img, error = item
+                if error is None:
+                    try:
+                        processed_img = renderer.compose(user_img)
+                    except Exception as e:
+                        error = str(e)
+                if error is not None:
+                    progress.report(img_path, None, error)
+                    continue
+                del user_img, item
+                # 等待写入的结果数量有上限，写盘跟不上时合成阶段暂停
+                write_slots.acquire()
+                executor.submit(write, processed_img, img_path)
+                del processed_img
+    finally:
+        stop.set()
+        reader_thread.join()
+
+    was_cancelled = cancel_event is not None and cancel_event.is_set() and progress.finished < progress.total
+    return progress.succeeded, progress.failed, was_cancelled
+
+
+def run_batch(params, layers, img_paths, output_dir, workers=None, on_result=None,
+              cancel_event=None, incremental=False, prefetch=DEFAULT_PREFETCH,
+              writers=DEFAULT_WRITERS, root=None):
+    """批量导出：workers为1时使用单进程流水线，否则使用多进程（默认为CPU核心数）
+
+    incremental为True时，源文件和设置都与上次导出相同的图片直接跳过，
+    on_result中的总数只包括需要导出的图片。
+    root为选择的文件夹，输出目录中保留图片在其中的子文件夹（见output_filename）；
+    仍有多张图片导出为同一个文件时，不导出任何图片，直接抛出ValueError。
+    返回 (成功数, 失败列表, 是否被取消, 跳过的图片列表)。
+    """
+    check_output_names(img_paths, params.output_format, root)
+    manifest = None
+    skipped = []
+    if incremental:
+        manifest = ExportManifest(output_dir, settings_fingerprint(params, layers), params.output_format, root)
+        img_paths, skipped = manifest.plan(img_paths)
+        pic_metrics.count('images_skipped', len(skipped))
+        if skipped:
+            logger.info("跳过 %d 张没有变化的图片", len(skipped))
+
+        def report(finished, total, img_path, output_path, error):
+            if error is None:
+                manifest.mark_done(img_path)
+            if on_result is not None:
+                on_result(finished, total, img_path, output_path, error)
+    else:
+        report = on_result
+
+    # 全部跳过时不必启动工作进程
+    if not img_paths:
+        return 0, [], False, skipped
+
+    try:
+        if (workers or default_workers()) == 1:
+            succeeded, failed, cancelled = run_pipeline(
+                params, layers, img_paths, output_dir, report, cancel_event,
+                prefetch, writers, root)
+        else:
+            succeeded, failed, cancelled = run_parallel(
+                params, layers, img_paths, output_dir, workers, report, cancel_event, root)
+    finally:
+        # 出错或取消时也保存已完成的部分
+        if manifest is not None:
+            manifest.save()
+    return succeeded, failed, cancelled, skipped
+
+
+class BatchJob:
+    """在后台线程中运行批量导出，供GUI轮询进度而不阻塞界面
+
+    workers为1时使用单进程流水线，否则使用多进程（默认为CPU核心数）。
+    incremental为True时跳过没有变化的图片，root为选择的文件夹（见run_batch）。
+    提供了metrics（pic_metrics.Metrics）时，导出期间启用性能统计，结束后写入汇总。
+
+    进度事件通过poll()取出：
+        ('progress', 已完成数, 总数, 图片路径, 错误信息)
+        ('finished', 成功数, 失败列表, 是否被取消, 跳过的图片列表)
+        ('error', 错误信息)
+    """
+
+    def __init__(self, params, layers, img_paths, output_dir, workers=None, incremental=False,
+                 metrics=None, root=None):
+        self.params = params
+        self.layers = layers
+        self.img_paths = list(img_paths)
+        self.output_dir = output_dir
+        self.workers = workers
+        self.incremental = incremental
+        self.metrics = metrics
+        self.root = root
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def cancel(self):
+        """请求取消（正在处理的图片会处理完）"""
+        self.cancel_event.set()
+
+    def poll(self):
+        """取出目前为止的所有事件"""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def _on_result(self, finished, total, img_path, output_path, error):
+        self.events.put(('progress', finished, total, img_path, error))
+
+    def _run(self):
+        if self.metrics is not None:
+            pic_metrics.enable(self.metrics)
+        try:
+            succeeded, failed, cancelled, skipped = run_batch(
+                self.params, self.layers, self.img_paths, self.output_dir,
+                self.workers, self._on_result, self.cancel_event, self.incremental,
+                root=self.root)
+        except Exception as e:
+            self.events.put(('error', str(e)))
+            return
+        finally:
+            if self.metrics is not None:
+                pic_metrics.disable()
+                self.metrics.close()
+        self.events.put(('finished', succeeded, failed, cancelled, skipped))
@@ -0,0 +1,294 @@
+"""合成流程的性能基准测试
+
+生成合成用的模板图层（底图/标题/覆盖图/顶层）和输入图片，用Renderer逐张导出，
+各阶段的耗时来自引擎自身的性能统计（pic_metrics），与实际导出的处理流程完全相同：
+    解码、调整宽度、上下右裁剪、右上角裁剪、用户缩放（或一次重采样）、各图层合成、正片叠底、编码
+输出各阶段的中位数耗时以及端到端的吞吐量（张/秒），结果可以写入JSON文件，用于比较不同版本。
+
+用法示例:
+    python pic_bench.py --count 20 --size 4000x3000 -o bench.json
+    python pic_bench.py --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+import PIL
+
+import pic_metrics
+from pic_engine import RenderParams, Renderer, Template
+from pic_batch import run_batch, default_workers
+from pic_blend import load_numpy
+
+BENCH_VERSION = 3
+
+# 显示的阶段名称（按处理顺序，与引擎中stage()的名称相同；没有经过的阶段不显示）
+STAGES = (
+    'decode', 'fit_resize', 'crops', 'corner_crop', 'fused_resample', 'scale_resize',
+    'composite_user', 'composite_title', 'overlay_blend', 'composite_top', 'encode', 'tiled_encode',
+)
+
+
+def parse_size(text):
+    """解析 宽x高 形式的尺寸"""
+    try:
+        width, height = (int(v) for v in text.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的尺寸: {text}（格式为 宽x高）") from None
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError(f"无效的尺寸: {text}")
+    return width, height
+
+
+def seeded_noise(size, sigma, rng):
+    """用固定种子的随机数生成噪点（标准差约为sigma，以128为中心）
+
+    Image.effect_noise每次调用的结果都不同，不能用于可重复的基准测试。
+    """
+    count = size[0] * size[1]
+    data = rng.getrandbits(count * 8).to_bytes(count, 'little')
+    # 0~255的均匀分布标准差约为74，按比例缩小到sigma
+    factor = sigma / 74.0
+    return Image.frombytes('L', size, data).point(lambda v: int(128 + (v - 128) * factor))
+
+
+def photo_like(size, seed):
+    """生成类似照片的图片（渐变 + 噪点，压缩难度接近真实照片，相同的seed结果相同）"""
+    width, height = size
+    rng = random.Random(seed)
+    gradient = Image.linear_gradient('L')
+    channels = []
+    for i in range(3):
+        channel = gradient.rotate((seed * 37 + i * 120) % 360).resize(size, Image.BILINEAR)
+        noise = seeded_noise(size, 24 + 8 * i, rng)
+        channels.append(Image.blend(channel, noise, 0.35))
+    img = Image.merge('RGB', channels)
+    # 加几个色块，避免整张图过于平滑
+    draw = ImageDraw.Draw(img)
+    for i in range(6):
+        x = (seed * 131 + i * 997) % width
+        y = (seed * 71 + i * 613) % height
+        color = ((seed * 53 + i * 89) % 256, (i * 47) % 256, (seed * 29) % 256)
+        draw.ellipse([x, y, x + width // 8, y + height // 8], fill=color)
+    return img
+
+
+def make_layers(canvas, directory):
+    """生成四个模板图层并保存，返回对应的配置"""
+    width, height = canvas
+
+    base = photo_like(canvas, 1000).convert('RGBA')
+
+    # 标题：上方一条半透明的横幅
+    title = Image.new('RGBA', canvas, (0, 0, 0, 0))
+    ImageDraw.Draw(title).rectangle([0, 0, width, height // 8], fill=(30, 30, 120, 230))
+
+    # 背景覆盖图：居中的纹理，边缘透明
+    overlay = photo_like((width * 3 // 4, height * 3 // 4), 2000).convert('RGBA')
+    mask = Image.new('L', overlay.size, 0)
+    ImageDraw.Draw(mask).ellipse([0, 0, overlay.width, overlay.height], fill=255)
+    overlay.putalpha(mask)
+
+    # 顶层：右下角的小标志
+    top = Image.new('RGBA', canvas, (0, 0, 0, 0))
+    ImageDraw.Draw(top).rectangle([width * 7 // 8, height * 7 // 8, width - 10, height - 10],
+                                  fill=(255, 255, 255, 255))
+
+    config = {}
+    for name, img in (('base', base), ('title', title), ('overlay', overlay), ('top', top)):
+        path = os.path.join(directory, f'{name}.png')
+        img.save(path, compress_level=1)
+        config[f'{name}_img_path'] = path
+    return config
+
+
+def make_inputs(size, count, input_format, directory):
+    """生成输入图片，返回路径列表"""
+    ext = 'jpg' if input_format == 'jpeg' else input_format
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f'input_{i:04d}.{ext}')
+        img = photo_like(size, i)
+        if input_format == 'jpeg':
+            img.save(path, quality=92)
+        else:
+            img.save(path, compress_level=1)
+        paths.append(path)
+    return paths
+
+
+def environment():
+    """运行环境信息"""
+    np = load_numpy()
+    return {
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'numpy': np.__version__ if np is not None else None,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run_benchmark(args):
+    """生成测试数据并运行基准测试，返回结果字典"""
+    with tempfile.TemporaryDirectory(prefix='pic_bench_') as work_dir:
+        input_dir = os.path.join(work_dir, 'inputs')
+        output_dir = os.path.join(work_dir, 'outputs')
+        os.makedirs(input_dir)
+        os.makedirs(output_dir)
+
+        config = make_layers(args.canvas, work_dir)
+        config.update({
+            'scale_factor': args.scale_factor,
+            'use_corner_crop': True,
+            'overlay_alpha_blend': args.overlay_alpha_blend,
+            'fast_decode': not args.no_fast_decode,
+            'fused_resample': args.fused_resample,
+            'output_format': args.output_format,
+            'png_compress_level': args.png_compress_level,
+        })
+        params = RenderParams.from_config(config)
+        img_paths = make_inputs(args.size, args.count, args.input_format, input_dir)
+
+        renderer = Renderer(params)
+        start = time.perf_counter()
+        renderer.template = Template(renderer.layers, params)
+        template_ms = (time.perf_counter() - start) * 1000
+
+        # 逐阶段计时：启用引擎的性能统计，按实际导出的路径处理
+        metrics = pic_metrics.enable(pic_metrics.Metrics())
+        try:
+            for _ in range(args.repeat):
+                for img_path in img_paths:
+                    renderer.render_to_dir(img_path, output_dir)
+        finally:
+            pic_metrics.disable()
+        timings = metrics.summary()['stages']
+
+        # 端到端吞吐量（单线程，不启用统计）
+        start = time.perf_counter()
+        for img_path in img_paths:
+            renderer.render_to_dir(img_path, output_dir)
+        sequential = len(img_paths) / (time.perf_counter() - start)
+
+        # 批量导出的吞吐量（同时指定时两种方式都测试）
+        batch = []
+        runs = []
+        if args.pipeline:
+            runs.append(1)
+        if args.jobs != 1:
+            runs.append(args.jobs or default_workers())
+        for jobs in runs:
+            start = time.perf_counter()
+            succeeded, failed, _, _ = run_batch(params, renderer.layers, img_paths, output_dir, jobs)
+            elapsed = time.perf_counter() - start
+            if failed:
+                raise RuntimeError(f"批量导出失败: {failed[0][1]}")
+            batch.append({'mode': 'pipeline' if jobs == 1 else 'parallel', 'workers': jobs,
+                          'images_per_second': round(succeeded / elapsed, 3)})
+
+    stages = {name: timings[name] for name in STAGES if name in timings}
+    stage_total = sum(s['median_ms'] for s in stages.values())
+    return {
+        'version': BENCH_VERSION,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': environment(),
+        'settings': {
+            'count': args.count,
+            'repeat': args.repeat,
+            'size': list(args.size),
+            'canvas': list(args.canvas),
+            'input_format': args.input_format,
+            'output_format': args.output_format,
+            'png_compress_level': args.png_compress_level,
+            'scale_factor': args.scale_factor,
+            'overlay_alpha_blend': args.overlay_alpha_blend,
+            'fast_decode': not args.no_fast_decode,
+            'fused_resample': args.fused_resample,
+        },
+        'template_ms': round(template_ms, 3),
+        'stages': stages,
+        'stage_total_ms': round(stage_total, 3),
+        'throughput': {
+            'sequential_images_per_second': round(sequential, 3),
+            'batch': batch,
+        },
+    }
+
+
+def print_results(results, baseline=None):
+    """打印各阶段的中位数耗时（提供了基准结果时同时显示变化）"""
+    base_stages = baseline['stages'] if baseline else {}
+    print(f"{'阶段':<16}{'中位数(ms)':>12}" + (f"{'基准(ms)':>12}{'变化':>9}" if baseline else ""))
+    rows = [(name, results['stages'].get(name), base_stages.get(name)) for name in STAGES]
+    rows.append(('total', {'median_ms': results['stage_total_ms']},
+                 {'median_ms': baseline['stage_total_ms']} if baseline else None))
+    for name, stat, base in rows:
+        if stat is None:
+            continue
+        line = f"{name:<16}{stat['median_ms']:>12.2f}"
+        if base:
+            change = (stat['median_ms'] / base['median_ms'] - 1) * 100 if base['median_ms'] else 0.0
+            line += f"{base['median_ms']:>12.2f}{change:>+8.1f}%"
+        print(line)
+
+    throughput = results['throughput']
+    print(f"模板构建: {results['template_ms']:.1f} ms")
+    line = f"单线程吞吐量: {throughput['sequential_images_per_second']:.2f} 张/秒"
+    if baseline:
+        line += f"（基准 {baseline['throughput']['sequential_images_per_second']:.2f}）"
+    print(line)
+    for batch in throughput['batch'] or ():
+        mode = "单进程流水线" if batch['mode'] == 'pipeline' else f"{batch['workers']} 进程"
+        print(f"批量导出吞吐量（{mode}）: {batch['images_per_second']:.2f} 张/秒")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="图片合成流程的性能基准测试")
+    parser.add_argument('--count', type=int, default=10, help="输入图片数量")
+    parser.add_argument('--repeat', type=int, default=3, help="逐阶段计时的重复次数")
+    parser.add_argument('--size', type=parse_size, default=(3000, 2000), help="输入图片尺寸（宽x高）")
+    parser.add_argument('--canvas', type=parse_size, default=(1920, 1080), help="模板画布尺寸（宽x高）")
+    parser.add_argument('--input-format', choices=('jpeg', 'png'), default='jpeg', help="输入图片格式")
+    parser.add_argument('--output-format', default='png', help="导出格式（png/jpeg/webp）")
+    parser.add_argument('--png-compress-level', type=int, default=6, help="PNG压缩级别")
+    parser.add_argument('--scale-factor', type=float, default=110.0, help="用户图片放大比例（%%）")
+    parser.add_argument('--overlay-alpha-blend', action='store_true', help="背景覆盖图按透明度混合")
+    parser.add_argument('--no-fast-decode', action='store_true', help="关闭超大图片的快速解码")
+    parser.add_argument('--fused-resample', action='store_true', help="只做一次重采样（与导出设置相同）")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="同时测试批量导出的进程数（0为CPU核心数，默认只测单线程）")
+    parser.add_argument('--pipeline', action='store_true', help="同时测试单进程流水线的吞吐量（可以与-j同时使用）")
+    parser.add_argument('-o', '--output', help="结果写入的JSON文件")
+    parser.add_argument('--compare', help="与之前保存的JSON结果比较")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.count <= 0 or args.repeat <= 0:
+        print("图片数量和重复次数必须大于0", file=sys.stderr)
+        return 2
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    results = run_benchmark(args)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""背景覆盖图的正片叠底混合
+
+每个颜色通道先做正片叠底，再以0.7的系数与原图混合：
+    out = base + 0.7 * (overlay * base / 255 - base)
+
+有两种模式：
+    兼容模式：与旧版本逐像素一致（覆盖图先按自身透明度粘贴到黑色透明图层上，
+             覆盖图以外的区域同样会被压暗）
+    透明度模式：按覆盖图的透明度混合，透明区域保持不变
+
+安装了NumPy时直接在RGBA数组上做整数运算（不拆分通道，不创建中间Image），
+按行分块处理，使临时缓冲区始终留在CPU缓存中；否则使用PIL的逐通道实现。
+底图完全不透明时画布为RGB，混合数据按RGB准备，不再处理透明度通道。
+"""
+import copy
+
+from PIL import Image, ImageChops
+
+np = None  # NumPy是可选依赖，导入较慢，第一次用到时才导入（不影响程序启动）
+_numpy_loaded = False
+
+
+def load_numpy():
+    """导入NumPy（只导入一次），没有安装时返回None"""
+    global np, _numpy_loaded
+    if not _numpy_loaded:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        np = numpy
+        _numpy_loaded = True
+    return np
+
+# 混合系数（用于PIL实现；NumPy实现中以整数 7/10 计算，结果与PIL完全一致）
+BLEND_STRENGTH = 0.7
+
+# 每块临时缓冲区的目标大小（字节）
+CHUNK_BYTES = 256 * 1024
+
+# 原地处理时每次从图像中取出的横条大小（字节）
+STRIP_BYTES = 1024 * 1024
+
+
+def multiply_blend_array(region, overlay, alpha=None):
+    """在RGB或RGBA的uint8数组上原地应用正片叠底混合
+
+    overlay为与region同尺寸的覆盖值（兼容模式为uint16，透明度通道对应值为255；
+    透明度模式为uint32），alpha为透明度模式下的权重（uint32，透明度通道对应值为0），
+    为None时使用兼容模式。
+    """
+    dtype = overlay.dtype
+    row_bytes = region.shape[1] * region.shape[2] * dtype.itemsize
+    rows = max(1, CHUNK_BYTES // row_bytes)
+    base_buf = np.empty((rows,) + region.shape[1:], dtype)
+    mix_buf = np.empty_like(base_buf)
+
+    for top in range(0, region.shape[0], rows):
+        chunk = region[top:top + rows]
+        n = chunk.shape[0]
+        base = base_buf[:n]
+        mix = mix_buf[:n]
+        np.copyto(base, chunk)
+        np.multiply(overlay[top:top + n], base, out=mix)
+        mix //= 255
+        np.subtract(base, mix, out=mix)
+        # 与PIL一致：mult = floor(o*b/255)，blend = floor(b + 0.7*(mult - b)) = b - ceil(0.7*(b - mult))
+        mix *= 7
+        mix += 9
+        mix //= 10
+        if alpha is None:
+            base -= mix
+        else:
+            # 与PIL的composite一致：out = DIV255(b*(255-a) + blend*a) = DIV255(255*b - a*(b - blend))，
+            # DIV255(x) = (t + (t >> 8)) >> 8，t = x + 128
+            mix *= alpha[top:top + n]
+            base *= 255
+            base -= mix
+            base += 128
+            np.right_shift(base, 8, out=mix)
+            base += mix
+            base >>= 8
+        np.copyto(chunk, base, casting='unsafe')
+
+
+class OverlayBlend:
+    """预先准备好的背景覆盖图混合数据（模板构建时创建一次，对每张图片复用）"""
+
+    def __init__(self, overlay_layer, alpha_mode, use_numpy=True, mode='RGBA'):
+        """overlay_layer为画布大小的RGBA图层，mode为画布的模式（RGB或RGBA）
+
+        兼容模式下应为按自身透明度粘贴得到的图层，透明度模式下应为直接粘贴（未预乘）的图层。
+        """
+        self.alpha_mode = alpha_mode
+        self.mode = mode
+        self.use_numpy = use_numpy and load_numpy() is not None
+        self.size = overlay_layer.size
+
+        # 透明度模式只需要处理覆盖图不透明的区域
+        if alpha_mode:
+            self.box = overlay_layer.getchannel('A').getbbox()
+        else:
+            self.box = (0, 0) + overlay_layer.size
+
+        if self.use_numpy:
+            data = np.asarray(overlay_layer)
+            if self.box is not None:
+                x0, y0, x1, y1 = self.box
+                data = data[y0:y1, x0:x1]
+            # RGBA画布运算时连同透明度通道一起处理（比只取RGB的跨步视图快），
+            # 透明度通道对应的系数设为不改变原值：兼容模式下覆盖值为255，透明度模式下权重为0；
+            # RGB画布只取颜色通道
+            channels = len(mode)
+            if alpha_mode:
+                self.rgb = data[..., :channels].astype(np.uint32)
+                self.alpha = np.repeat(data[..., 3:4], channels, axis=2).astype(np.uint32)
+                if channels == 4:
+                    self.alpha[..., 3] = 0
+            else:
+                self.rgb = data[..., :channels].astype(np.uint16)
+                if channels == 4:
+                    self.rgb[..., 3] = 255
+                self.alpha = None
+        else:
+            r, g, b, a = overlay_layer.split()
+            self.channels = (r, g, b)
+            self.alpha = a if alpha_mode else None
+
+    def shared_buffers(self):
+        """画布大小的混合数据 {名称: NumPy数组或图像}（多进程导出时放入共享文件）"""
+        if self.use_numpy:
+            buffers = {'rgb': self.rgb, 'alpha': self.alpha}
+        else:
+            buffers = dict(zip('rgb', self.channels), alpha=self.alpha)
+        return {name: value for name, value in buffers.items() if value is not None}
+
+    def with_buffers(self, buffers):
+        """返回使用给定数据（例如共享文件中的只读映射）的副本，没有的数据为None"""
+        blend = copy.copy(self)
+        if self.use_numpy:
+            load_numpy()  # 在工作进程中得到的副本没有经过__init__
+            blend.rgb = buffers.get('rgb')
+        else:
+            blend.channels = tuple(buffers.get(name) for name in 'rgb')
+        blend.alpha = buffers.get('alpha')
+        return blend
+
+    def apply_inplace(self, result, offset=(0, 0)):
+        """对画布模式的图像原地应用混合（透明度通道保持不变）
+
+        按横条分段取出、混合、写回，额外占用的内存只有一个横条的大小。
+        result也可以只是画布的一部分区域，offset为它的左上角在画布中的位置。
+        """
+        if self.box is None:
+            return
+        x0, y0, x1, y1 = self.box
+        left, right = max(x0, offset[0]), min(x1, offset[0] + result.width)
+        start, end = max(y0, offset[1]), min(y1, offset[1] + result.height)
+        if right <= left:
+            return
+        rows = max(1, STRIP_BYTES // ((right - left) * len(self.mode)))
+        for top in range(start, end, rows):
+            bottom = min(top + rows, end)
+            box = (left, top, right, bottom)
+            local_box = (left - offset[0], top - offset[1], right - offset[0], bottom - offset[1])
+            strip = result.crop(local_box)
+            if self.use_numpy:
+                strip = self._apply_numpy(strip, box)
+            else:
+                strip = self._apply_pil(strip, box)
+            result.paste(strip, local_box[:2])
+
+    def _apply_numpy(self, strip, box):
+        """box为横条在画布中的位置"""
+        x0, y0 = self.box[:2]
+        rows = slice(box[1] - y0, box[3] - y0)
+        cols = slice(box[0] - x0, box[2] - x0)
+        data = np.array(strip)
+        alpha = self.alpha[rows, cols] if self.alpha_mode else None
+        multiply_blend_array(data, self.rgb[rows, cols], alpha)
+        return Image.fromarray(data)
+
+    def _apply_pil(self, strip, box):
+        r, g, b = (channel.crop(box) for channel in self.channels)
+        bands = strip.split()
+        r2, g2, b2 = bands[:3]
+
+        # 对每个颜色通道应用正片叠底，再以0.7的系数与原图混合以减轻效果
+        r_final = Image.blend(r2, ImageChops.multiply(r, r2), BLEND_STRENGTH)
+        g_final = Image.blend(g2, ImageChops.multiply(g, g2), BLEND_STRENGTH)
+        b_final = Image.blend(b2, ImageChops.multiply(b, b2), BLEND_STRENGTH)
+
+        # 透明度通道使用原始图像的透明度，这确保了没有黑边（RGB画布没有透明度通道）
+        blended = Image.merge(strip.mode, (r_final, g_final, b_final) + bands[3:])
+        if self.alpha_mode:
+            return Image.composite(blended, strip, self.alpha.crop(box))
+        return blended
@@ -0,0 +1,303 @@
+"""图片缓存
+
+用户图片的处理分为两个阶段分别缓存：
+    1. 解码并调整为底图宽度（键：文件路径、修改时间、大小、底图宽度、是否快速解码）
+    2. 按裁剪参数裁剪（键：第1阶段的键 + 全部裁剪参数）
+只修改裁剪参数时只需要重新裁剪，不需要重新解码和缩放。
+
+第1阶段的结果还可以保存到磁盘缓存（DiskImageCache），程序重新启动后不需要重新解码和缩放。
+裁剪只需要几毫秒，不保存到磁盘。
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from pic_engine import decode_and_fit, apply_crops
+from pic_metrics import count, stage
+
+logger = logging.getLogger(__name__)
+
+# 默认缓存大小（MB）
+DEFAULT_CACHE_MB = 512
+DEFAULT_DISK_CACHE_MB = 0  # 默认不使用磁盘缓存，在config.json中设置disk_cache_mb启用
+
+# 创建磁盘缓存时没有指定容量使用的大小（MB）
+DISK_CACHE_MB = 2048
+
+# 磁盘缓存的格式版本（解码或缩放方式变化时修改，旧的缓存自动失效）
+DISK_CACHE_VERSION = 1
+
+# 磁盘缓存文件的扩展名
+DISK_CACHE_SUFFIX = ".raw"
+
+
+def image_nbytes(img):
+    """图片占用的内存字节数"""
+    return img.width * img.height * len(img.getbands())
+
+
+def file_identity(path):
+    """文件标识（路径 + 修改时间 + 大小），文件被修改后缓存自动失效"""
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_mtime_ns, st.st_size
+
+
+def crop_key(params):
+    """影响裁剪结果的参数"""
+    return (
+        params.crop_top_percent,
+        params.crop_bottom_percent,
+        params.crop_right_percent,
+        params.use_corner_crop,
+        params.crop_corner_size if params.use_corner_crop else None,
+    )
+
+
+def has_crops(params):
+    """参数是否会裁剪图片（裁剪比例都不在0~100%之间时，裁剪后与调整宽度后的图片相同）"""
+    percents = [params.crop_top_percent, params.crop_bottom_percent, params.crop_right_percent]
+    if params.use_corner_crop:
+        percents.append(params.crop_corner_size)
+    return any(0 < percent < 100 for percent in percents)
+
+
+class LRUCache:
+    """按字节数限制大小的LRU缓存（线程安全）"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()  # key -> (value, size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        """取出缓存的值，不存在时返回None"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                count('cache_misses')
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            count('cache_hits')
+            return item[0]
+
+    def put(self, key, value, size):
+        """放入缓存，超出容量时淘汰最久未使用的项"""
+        with self._lock:
+            if key in self._items:
+                self.current_bytes -= self._items.pop(key)[1]
+            # 单项超过整个容量时不缓存
+            if size > self.max_bytes:
+                return
+            self._items[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """缓存统计信息"""
+        with self._lock:
+            return {
+                'entries': len(self._items),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def default_disk_cache_dir():
+    """默认的磁盘缓存目录（Windows为LOCALAPPDATA，其他系统为~/.cache）"""
+    root = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(root, 'pic_processor', 'source_cache')
+
+
+class DiskImageCache:
+    """按字节数限制大小的磁盘图片缓存（LRU，以文件的修改时间作为最近使用时间）
+
+    每个图片保存为一个文件：第一行是JSON格式的模式和尺寸，之后是未压缩的像素数据，
+    读取时不需要解码。文件先写入临时文件再替换，写到一半的文件不会被读到。
+    """
+
+    def __init__(self, directory, max_bytes=DISK_CACHE_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._files = {}  # 文件名 -> (最近使用时间, 大小)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        """统计已有的缓存文件，清理上次中断时留下的临时文件"""
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                if entry.name.endswith(DISK_CACHE_SUFFIX):
+                    st = entry.stat()
+                    self._files[entry.name] = (st.st_mtime_ns, st.st_size)
+                    self.current_bytes += st.st_size
+                elif entry.name.endswith('.tmp'):
+                    self._remove(entry.name)
+        self._evict()
+
+    @staticmethod
+    def filename(key):
+        """缓存键对应的文件名"""
+        text = repr((DISK_CACHE_VERSION, key))
+        return hashlib.sha1(text.encode('utf-8')).hexdigest() + DISK_CACHE_SUFFIX
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def _evict(self):
+        """超出容量时删除最久未使用的文件（调用方持有锁）"""
+        if self.current_bytes <= self.max_bytes:
+            return
+        for name in sorted(self._files, key=lambda n: self._files[n][0]):
+            if self.current_bytes <= self.max_bytes:
+                break
+            self.current_bytes -= self._files.pop(name)[1]
+            self._remove(name)
+            count('disk_cache_evictions')
+
+    def get(self, key):
+        """读取缓存的图片（只读），不存在或文件损坏时返回None"""
+        name = self.filename(key)
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            if name not in self._files:
+                count('disk_cache_misses')
+                return None
+        try:
+            with stage('disk_cache_read'):
+                with open(path, 'rb') as f:
+                    header = json.loads(f.readline())
+                    data = f.read()
+                mode, size = header['mode'], tuple(header['size'])
+                img = Image.frombuffer(mode, size, data, 'raw', mode, 0, 1)
+            os.utime(path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("磁盘缓存文件损坏，已删除: %s (%s)", path, e)
+            with self._lock:
+                if name in self._files:
+                    self.current_bytes -= self._files.pop(name)[1]
+            self._remove(name)
+            count('disk_cache_misses')
+            return None
+        with self._lock:
+            if name in self._files:
+                self._files[name] = (os.stat(path).st_mtime_ns, self._files[name][1])
+        count('disk_cache_hits')
+        return img
+
+    def put(self, key, img):
+        """保存图片，超出容量时淘汰最久未使用的文件"""
+        name = self.filename(key)
+        path = os.path.join(self.directory, name)
+        header = json.dumps({'mode': img.mode, 'size': list(img.size)}).encode('ascii') + b"\n"
+        size = len(header) + image_nbytes(img)
+        if size > self.max_bytes:
+            return
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with stage('disk_cache_write'):
+                with open(tmp_path, 'wb') as f:
+                    f.write(header)
+                    f.write(img.tobytes())
+                os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("无法写入磁盘缓存 %s: %s", path, e)
+            self._remove(os.path.basename(tmp_path))
+            return
+        with self._lock:
+            if name in self._files:
+                self.current_bytes -= self._files[name][1]
+            self._files[name] = (os.stat(path).st_mtime_ns, size)
+            self.current_bytes += size
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            for name in list(self._files):
+                self._remove(name)
+            self._files.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._files), 'bytes': self.current_bytes, 'max_bytes': self.max_bytes}
+
+
+class SourceImageCache:
+    """用户图片缓存（调整宽度后的图片与裁剪后的图片分开缓存）
+
+    提供了disk_cache（DiskImageCache）时，调整宽度后的图片同时保存到磁盘。
+    返回的图片由缓存持有，调用方不能修改。
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_MB * 1024 * 1024, disk_cache=None):
+        self.cache = LRUCache(max_bytes)
+        self.disk_cache = disk_cache
+
+    def get_fitted(self, img_path, base_width, fast_decode=False, identity=None):
+        """获取解码并调整为底图宽度的图片"""
+        identity = identity or file_identity(img_path)
+        key = ('fitted', identity, base_width, fast_decode)
+        img = self.cache.get(key)
+        if img is None:
+            if self.disk_cache is not None:
+                img = self.disk_cache.get(key)
+            if img is None:
+                img = decode_and_fit(img_path, base_width, fast_decode)
+                if self.disk_cache is not None:
+                    self.disk_cache.put(key, img)
+            self.cache.put(key, img, image_nbytes(img))
+        return img
+
+    def get(self, img_path, base_width, params):
+        """获取调整宽度并裁剪后的图片"""
+        identity = file_identity(img_path)
+        if not has_crops(params):
+            # 没有任何裁剪时直接使用第1阶段的图片（只查找一次，不会每次都多记一次未命中）
+            return self.get_fitted(img_path, base_width, params.fast_decode, identity)
+        key = ('cropped', identity, base_width, params.fast_decode, crop_key(params))
+        img = self.cache.get(key)
+        if img is None:
+            fitted = self.get_fitted(img_path, base_width, params.fast_decode, identity)
+            img = apply_crops(fitted, params)
+            # 右上角的正方形小于1像素时与第1阶段是同一张图片，不重复占用容量
+            if img is not fitted:
+                self.cache.put(key, img, image_nbytes(img))
+        return img
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        return self.cache.stats()
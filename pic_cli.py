@@ -0,0 +1,279 @@
+"""命令行批处理入口（不需要图形界面）
+
+用法示例:
+    python pic_cli.py render -c config.json -o output "cards/*.png"
+    python pic_cli.py render -o output "cards/*.jpg" --scale-factor 120 --use-title-img false
+    python pic_cli.py watch -c config.json -o output incoming
+    python pic_cli.py serve -c config.json --port 8765
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+
+import pic_metrics
+from pic_engine import RenderParams, Renderer, LAYER_LABELS, parse_bool as engine_parse_bool
+from pic_files import exclude_outputs, scan_images
+from pic_watch import FolderWatcher, DEFAULT_INTERVAL, DEFAULT_SETTLE
+from pic_batch import run_batch, default_workers, DEFAULT_PREFETCH, DEFAULT_WRITERS
+from pic_cache import DEFAULT_CACHE_MB
+from pic_server import RenderServer, RenderService, DEFAULT_HOST, DEFAULT_PORT, DEFAULT_MAX_QUEUE, METRICS_SAMPLES
+
+# 默认配置文件与GUI共用
+DEFAULT_CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+
+
+def parse_bool(value):
+    """解析命令行中的布尔值"""
+    try:
+        return engine_parse_bool(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from None
+
+
+def glob_root(pattern):
+    """通配符中不含通配符的上级文件夹，例如 cards/**/*.png 为 cards"""
+    root = pattern
+    while glob.has_magic(root):
+        root = os.path.dirname(root)
+    return root or os.curdir
+
+
+def expand_inputs(patterns, output_dir=None):
+    """展开输入的通配符（Windows的命令行不会自动展开），文件夹展开为其中（包括子文件夹）的全部图片
+
+    指定了output_dir时，跳过放在输入文件夹中的输出目录里之前导出的结果。
+    返回 (图片路径列表, 根文件夹)。根文件夹是全部输入（文件夹、通配符的上级文件夹、图片所在的文件夹）
+    共同的上级文件夹，导出时在输出目录中保留图片相对于它的子文件夹；没有共同的上级文件夹时为None。
+    """
+    paths = []
+    seen = set()
+    roots = set()
+    for pattern in patterns:
+        magic = glob.has_magic(pattern)
+        matches = sorted(glob.glob(pattern, recursive=True)) if magic else [pattern]
+        for match in matches:
+            if os.path.isdir(match):
+                found = scan_images(match, output_dir=output_dir)
+                root = match
+            else:
+                found = [match]
+                root = os.path.dirname(match)
+                if magic:
+                    found = exclude_outputs(found, glob_root(pattern), output_dir)
+            roots.add(os.path.abspath(glob_root(pattern) if magic else root or os.curdir))
+            for path in found:
+                if os.path.isfile(path) and path not in seen:
+                    seen.add(path)
+                    paths.append(path)
+    try:
+        root = os.path.commonpath(sorted(roots)) if roots else None
+    except ValueError:
+        root = None  # Windows上不在同一个驱动器
+    return paths, root
+
+
+def load_config_file(path):
+    """读取config.json，文件不存在时返回空配置"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def add_param_arguments(parser):
+    """为每个配置字段添加对应的命令行参数（覆盖config.json中的值）"""
+    group = parser.add_argument_group("参数覆盖（字段与config.json相同）")
+    for name, default in RenderParams.DEFAULTS.items():
+        option = "--" + name.replace('_', '-')
+        if isinstance(default, bool):
+            group.add_argument(option, dest=name, type=parse_bool, metavar="BOOL")
+        elif isinstance(default, str):
+            group.add_argument(option, dest=name, metavar="PATH" if name.endswith('_path') else "TEXT")
+        else:
+            group.add_argument(option, dest=name, type=type(default), metavar="N")
+
+
+def build_params(args):
+    """合并配置文件与命令行参数"""
+    config = load_config_file(args.config)
+    for name in RenderParams.DEFAULTS:
+        value = getattr(args, name)
+        if value is not None:
+            config[name] = value
+    return RenderParams.from_config(config)
+
+
+def cmd_render(args):
+    """批量合成并导出图片"""
+    try:
+        params = build_params(args)
+    except ValueError as e:
+        print(f"参数错误: {e}", file=sys.stderr)
+        return 2
+
+    inputs, root = expand_inputs(args.inputs, args.output_dir)
+    if not inputs:
+        print("没有找到需要处理的图片", file=sys.stderr)
+        return 2
+
+    renderer = Renderer(params)
+    if 'base' not in renderer.layers:
+        print(f"{LAYER_LABELS['base']}不存在: {params.base_img_path}", file=sys.stderr)
+        return 2
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    start = time.time()
+    jobs = args.jobs or default_workers()
+
+    def report(finished, total, img_path, output_path, error):
+        if error is not None:
+            print(f"处理失败: {img_path}: {error}", file=sys.stderr)
+        elif not args.quiet:
+            print(f"[{finished}/{total}] {img_path}")
+
+    metrics = None
+    if args.metrics or args.metrics_jsonl:
+        metrics = pic_metrics.enable(pic_metrics.Metrics(args.metrics_jsonl))
+    try:
+        succeeded, failed, _, skipped = run_batch(params, renderer.layers, inputs, args.output_dir,
+                                                  jobs, report, incremental=not args.force,
+                                                  prefetch=args.prefetch, writers=args.writers, root=root)
+    except ValueError as e:
+        print(f"无法导出: {e}", file=sys.stderr)
+        return 2
+    finally:
+        if metrics is not None:
+            pic_metrics.disable()
+            metrics.close()
+
+    elapsed = time.time() - start
+    print(f"已处理 {succeeded}/{len(inputs) - len(skipped)} 张图片到 {args.output_dir}，用时 {elapsed:.1f} 秒")
+    if skipped:
+        print(f"跳过 {len(skipped)} 张没有变化的图片（使用 --force 全部重新导出）")
+        if args.verbose:
+            for img_path in skipped:
+                print(f"  跳过: {img_path}")
+    if args.metrics:
+        print(metrics.format_table(), file=sys.stderr)
+    return 1 if failed else 0
+
+
+def cmd_watch(args):
+    """监视文件夹，自动处理新加入或被修改的图片"""
+    if not os.path.isdir(args.input_dir):
+        print(f"输入文件夹不存在: {args.input_dir}", file=sys.stderr)
+        return 2
+
+    def report(img_path, output_path, error):
+        if error is not None:
+            print(f"处理失败: {img_path}: {error}", file=sys.stderr)
+        elif output_path is not None and not args.quiet:
+            print(f"{img_path} -> {output_path}")
+
+    try:
+        watcher = FolderWatcher(args.input_dir, args.output_dir, lambda: build_params(args),
+                                recursive=not args.no_recursive, interval=args.interval,
+                                settle=args.settle, config_path=args.config, on_result=report)
+    except ValueError as e:
+        print(f"参数错误: {e}", file=sys.stderr)
+        return 2
+
+    print(f"正在监视 {args.input_dir}，输出到 {args.output_dir}（按Ctrl+C停止）")
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def cmd_serve(args):
+    """启动本地合成服务"""
+    metrics = pic_metrics.Metrics(max_samples=METRICS_SAMPLES)
+    try:
+        service = RenderService(build_params(args), args.jobs or None, args.max_queue, args.cache_mb, metrics)
+    except ValueError as e:
+        print(f"参数错误: {e}", file=sys.stderr)
+        return 2
+    try:
+        server = RenderServer(service, args.host, args.port)
+    except OSError as e:
+        print(f"无法监听 {args.host}:{args.port}: {e}", file=sys.stderr)
+        service.close()
+        return 2
+
+    # 服务启动之后才启用全局统计，启动失败时不留下启用的统计
+    pic_metrics.enable(metrics)
+    host, port = server.server_address[:2]
+    print(f"合成服务已启动: http://{host}:{port}（{service.workers} 个线程，按Ctrl+C停止）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        pic_metrics.disable()
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="图片批量处理工具（命令行）")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    render = subparsers.add_parser('render', help="批量合成并导出图片")
+    render.add_argument('inputs', nargs='+', help="输入图片路径、文件夹或通配符（支持**递归）")
+    render.add_argument('-o', '--output-dir', required=True, help="输出目录")
+    render.add_argument('-c', '--config', default=DEFAULT_CONFIG_FILE, help="配置文件路径（默认与GUI共用config.json）")
+    render.add_argument('-j', '--jobs', type=int, default=0, help="并行进程数（默认为CPU核心数，1表示单进程流水线）")
+    render.add_argument('--prefetch', type=int, default=DEFAULT_PREFETCH, help="单进程流水线提前解码的图片数量")
+    render.add_argument('--writers', type=int, default=DEFAULT_WRITERS, help="单进程流水线的写入线程数")
+    render.add_argument('-f', '--force', action='store_true', help="全部重新导出（默认跳过源文件和设置都没有变化的图片）")
+    render.add_argument('-q', '--quiet', action='store_true', help="不输出每张图片的进度")
+    render.add_argument('-v', '--verbose', action='store_true', help="输出调试信息")
+    render.add_argument('--metrics', action='store_true', help="结束后输出各阶段耗时与计数的汇总表")
+    render.add_argument('--metrics-jsonl', metavar="PATH", help="把每次计时逐行写入JSON Lines文件（最后一行为汇总）")
+    add_param_arguments(render)
+    render.set_defaults(func=cmd_render)
+
+    watch = subparsers.add_parser('watch', help="监视文件夹，自动处理新加入或被修改的图片")
+    watch.add_argument('input_dir', help="输入文件夹")
+    watch.add_argument('-o', '--output-dir', required=True, help="输出目录")
+    watch.add_argument('-c', '--config', default=DEFAULT_CONFIG_FILE, help="配置文件路径（文件被修改后自动重新加载）")
+    watch.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help="扫描间隔（秒）")
+    watch.add_argument('--settle', type=float, default=DEFAULT_SETTLE, help="文件大小和修改时间保持不变多久后才处理（秒）")
+    watch.add_argument('--no-recursive', action='store_true', help="不监视子文件夹")
+    watch.add_argument('-q', '--quiet', action='store_true', help="不输出每张图片的处理结果")
+    watch.add_argument('-v', '--verbose', action='store_true', help="输出调试信息")
+    add_param_arguments(watch)
+    watch.set_defaults(func=cmd_watch)
+
+    serve = subparsers.add_parser('serve', help="启动本地合成服务（HTTP），模板和源图片缓存常驻内存")
+    serve.add_argument('-c', '--config', default=DEFAULT_CONFIG_FILE, help="配置文件路径（提供默认参数）")
+    serve.add_argument('--host', default=DEFAULT_HOST, help="监听地址（默认只允许本机访问）")
+    serve.add_argument('--port', type=int, default=DEFAULT_PORT, help="监听端口（0表示自动选择）")
+    serve.add_argument('-j', '--jobs', type=int, default=0, help="合成线程数（默认为CPU核心数）")
+    serve.add_argument('--max-queue', type=int, default=DEFAULT_MAX_QUEUE, help="等待处理的请求数量上限，超过时返回503")
+    serve.add_argument('--cache-mb', type=float, default=DEFAULT_CACHE_MB, help="源图片内存缓存大小（MB）")
+    serve.add_argument('-v', '--verbose', action='store_true', help="输出调试信息（包括每个请求）")
+    add_param_arguments(serve)
+    serve.set_defaults(func=cmd_serve)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if getattr(args, 'verbose', False) else logging.WARNING,
+                        format="%(levelname)s %(name)s: %(message)s")
+    logging.getLogger("PIL").setLevel(logging.INFO)  # Pillow的调试日志过多
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
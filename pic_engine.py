@@ -0,0 +1,871 @@
+"""图片合成引擎
+
+不依赖Tk，GUI、命令行批处理都通过这里完成实际的图片合成。
+"""
+import copy
+import logging
+import os
+from collections import OrderedDict
+from PIL import Image, ImageDraw
+
+from pic_blend import OverlayBlend
+from pic_files import OUTPUT_PREFIX, is_output_filename
+from pic_geometry import GeometryPlan, corner_square_size, edge_crop_box, fitted_size
+from pic_metrics import stage, count, count_image
+from pic_output import normalize_format, output_extension, save_image, save_strips, is_opaque
+
+logger = logging.getLogger(__name__)
+
+# 模板图层名称（按合成顺序）
+LAYER_NAMES = ('base', 'title', 'overlay', 'top')
+
+# 图层的中文名称，用于提示信息
+LAYER_LABELS = {
+    'base': '底图',
+    'title': '标题/遮挡图',
+    'overlay': '背景覆盖图',
+    'top': '顶层图片',
+}
+
+# 没有底图时使用的画布大小
+DEFAULT_CANVAS_SIZE = (1920, 1080)
+
+# 预览区域大小
+PREVIEW_SIZE = (700, 600)
+
+# 快速解码时保留的余量：先缩小到不小于目标尺寸的这个倍数，再用LANCZOS缩放到目标尺寸
+REDUCING_GAP = 1.5
+
+# 分块导出时每个横条的目标大小（字节）
+TILE_BYTES = 4 * 1024 * 1024
+
+
+# 配置文件、命令行和服务请求中可以使用的布尔值写法
+TRUE_STRINGS = ('1', 'true', 'yes', 'on')
+FALSE_STRINGS = ('0', 'false', 'no', 'off')
+
+
+def parse_bool(value):
+    """解析布尔值（支持true/false、yes/no、on/off、1/0），无法识别时抛出ValueError"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    text = str(value).strip().lower()
+    if text in TRUE_STRINGS:
+        return True
+    if text in FALSE_STRINGS:
+        return False
+    raise ValueError(f"无效的布尔值: {value}")
+
+
+class RenderParams:
+    """合成参数（纯数据对象，字段与config.json保持一致）"""
+
+    # 字段名: 默认值
+    DEFAULTS = {
+        # 图片路径
+        'base_img_path': '',
+        'title_img_path': '',
+        'overlay_img_path': '',
+        'top_img_path': '',
+
+        # 参数
+        'scale_factor': 100.0,
+        'x_offset': 0,
+        'y_offset': 0,
+        'overlay_scale_factor': 100.0,
+        'crop_bottom_percent': 10.0,
+        'crop_right_percent': 10.0,
+        'crop_top_percent': 10.0,
+        'crop_corner_size': 15.0,
+        'use_corner_crop': False,
+        'overlay_alpha_blend': False,  # 背景覆盖图按自身透明度混合（关闭时与旧版本输出一致）
+        'fast_decode': True,  # 解码时直接缩小超大的图片（JPEG按比例解码，其他格式先整数倍缩小）
+        # 适应宽度、裁剪、缩放合并为一次重采样（关闭时与旧版本输出一致）。开启后结果与旧版本略有不同：
+        # 放大比例为100%时只有取整误差（每个通道最多差几个值）；平滑的照片缩放后平均差异在0.1以内；
+        # 逐像素随机的内容缩放后平均差异约为每通道4，个别像素可达80左右（见tests/test_fused.py）
+        'fused_resample': False,
+
+        # 图层启用状态
+        'use_base_img': True,
+        'use_title_img': True,
+        'use_overlay_img': True,
+        'use_top_img': True,
+
+        # 导出设置
+        'output_format': '',  # png / jpeg / webp，留空表示与原图相同
+        'png_compress_level': 6,  # 0-9，越小编码越快
+        'png_optimize': False,
+        'output_quality': 90,  # JPEG/WebP质量 1-100
+        'flatten_opaque': True,  # 完全不透明时保存为RGB
+        'tiled_render': False,  # 分块导出：按横条合成和编码（只有PNG能逐条写入，内存占用与画布大小无关）
+    }
+
+    # 数值字段解析失败时的提示信息
+    NUMBER_ERRORS = {
+        'scale_factor': "请输入有效的数字",
+        'x_offset': "请输入有效的数字",
+        'y_offset': "请输入有效的数字",
+        'overlay_scale_factor': "请输入有效的数字",
+        'crop_bottom_percent': "裁剪比例必须是有效的数字",
+        'crop_right_percent': "右侧裁剪比例必须是有效的数字",
+        'crop_top_percent': "上方裁剪比例必须是有效的数字",
+        'crop_corner_size': "右上角裁剪大小必须是有效的数字",
+        'png_compress_level': "PNG压缩级别必须是0到9的整数",
+        'output_quality': "导出质量必须是1到100的整数",
+    }
+
+    def __init__(self, **kwargs):
+        unknown = set(kwargs) - set(self.DEFAULTS)
+        if unknown:
+            raise TypeError(f"未知的参数: {', '.join(sorted(unknown))}")
+
+        for name, default in self.DEFAULTS.items():
+            value = kwargs.get(name, default)
+            if name in self.NUMBER_ERRORS:
+                value = self._parse_number(name, value, type(default))
+            elif isinstance(default, bool):
+                try:
+                    value = parse_bool(value)
+                except ValueError:
+                    raise ValueError(f"参数 {name} 必须是布尔值（true/false）: {value}") from None
+            setattr(self, name, value)
+
+        if self.scale_factor <= 0:
+            raise ValueError("放大比例必须大于0")
+        if self.overlay_scale_factor <= 0:
+            raise ValueError("背景覆盖图放大比例必须大于0")
+        if not 0 <= self.png_compress_level <= 9:
+            raise ValueError(self.NUMBER_ERRORS['png_compress_level'])
+        if not 1 <= self.output_quality <= 100:
+            raise ValueError(self.NUMBER_ERRORS['output_quality'])
+        self.output_format = normalize_format(self.output_format)
+
+    def _parse_number(self, name, value, number_type):
+        """把配置中的字符串/数字转换为数值"""
+        try:
+            return number_type(value)
+        except (TypeError, ValueError):
+            raise ValueError(self.NUMBER_ERRORS[name]) from None
+
+    @classmethod
+    def from_config(cls, config):
+        """从config.json格式的字典创建参数（忽略无关字段）"""
+        return cls(**{k: v for k, v in config.items() if k in cls.DEFAULTS})
+
+    def to_config(self):
+        """转换为config.json格式的字典"""
+        return {name: getattr(self, name) for name in self.DEFAULTS}
+
+    def replace(self, **changes):
+        """返回修改了部分字段的新参数对象"""
+        config = self.to_config()
+        config.update(changes)
+        return RenderParams(**config)
+
+    def layer_path(self, name):
+        """获取图层文件路径"""
+        return getattr(self, f"{name}_img_path")
+
+    def layer_enabled(self, name):
+        """图层是否启用"""
+        return getattr(self, f"use_{name}_img")
+
+
+def load_layer(path, rgb_if_opaque=False):
+    """加载单个模板图层，路径不存在时返回None
+
+    rgb_if_opaque用于底图：完全不透明时加载为RGB，模板在RGB画布上合成时直接使用这一份数据，
+    不再为每个模板转换一次。
+    """
+    if not path or not os.path.exists(path):
+        return None
+    with Image.open(path) as img:
+        if rgb_if_opaque and working_mode(img) == "RGB":
+            return img.convert("RGB")
+        layer = img.convert("RGBA")
+    if rgb_if_opaque and is_opaque(layer):
+        layer = layer.convert("RGB")
+    return layer
+
+
+def load_layers(params, on_error=None):
+    """加载全部模板图层
+
+    返回 {图层名: 图像}（底图完全不透明时为RGB，其他为RGBA），不存在的图层不会出现在结果中。
+    加载出错时调用 on_error(图层名, 异常)，未提供时直接抛出异常。
+    """
+    layers = {}
+    for name in LAYER_NAMES:
+        try:
+            layer = load_layer(params.layer_path(name), rgb_if_opaque=(name == 'base'))
+        except Exception as e:
+            if on_error is None:
+                raise
+            on_error(name, e)
+            continue
+        if layer is not None:
+            layers[name] = layer
+    return layers
+
+
+def working_mode(img):
+    """用户图片处理时使用的模式：有透明度的为RGBA，否则为RGB（少处理一个通道，像素不变）"""
+    has_alpha = 'A' in img.getbands() or 'transparency' in img.info
+    return "RGBA" if has_alpha else "RGB"
+
+
+def fit_to_width(img, base_width):
+    """等比例缩放图片，使宽度与底图一致"""
+    return img.resize(fitted_size(img.size, base_width), Image.LANCZOS)
+
+
+def apply_crops(img, params):
+    """按参数裁剪上方、底部、右侧以及右上角区域"""
+    with stage('crops'):
+        img = _crop_edges(img, params)
+    # 右上角正方形区域裁剪（如果启用）
+    if params.use_corner_crop:
+        with stage('corner_crop'):
+            img = _crop_corner(img, params)
+    return img
+
+
+def _crop_edges(img, params):
+    """裁剪上方、底部、右侧"""
+    box = edge_crop_box(img.size, params)
+    if box != (0, 0) + img.size:
+        img = img.crop(box)
+        logger.debug("已裁剪上方 %s%%、底部 %s%%、右侧 %s%% 的图片",
+                     params.crop_top_percent, params.crop_bottom_percent, params.crop_right_percent)
+    return img
+
+
+def _crop_corner(img, params):
+    """右上角正方形区域裁剪"""
+    # 计算正方形的尺寸（基于图片宽度）
+    square_size = corner_square_size(img.width, params)
+    if square_size > 0:
+        if img.mode == "RGBA":
+            result_img = Image.new("RGBA", img.size, (0, 0, 0, 0))
+            result_img.paste(img, (0, 0), img)
+        else:
+            # 没有透明度的图片按自身粘贴到透明图层上与直接转换相同
+            result_img = img.convert("RGBA")
+
+        # 直接在右上角绘制一个完全透明的矩形
+        draw = ImageDraw.Draw(result_img)
+        draw.rectangle(
+            [(img.width - square_size, 0),
+             (img.width, square_size)],
+            fill=(0, 0, 0, 0)
+        )
+        img = result_img
+        count_image(img)
+        logger.debug("已裁剪右上角 %s%% 大小的正方形区域", params.crop_corner_size)
+
+    return img
+
+
+def reduce_on_load(img, target_size):
+    """在转换为RGB/RGBA之前尽量缩小超大的图片
+
+    JPEG使用draft按1/2、1/4、1/8的比例直接解码；其他格式解码后先做整数倍的reduce。
+    两种方式都保证结果不小于目标尺寸的REDUCING_GAP倍，最后仍由LANCZOS缩放到目标尺寸。
+    """
+    gap_size = (int(target_size[0] * REDUCING_GAP), int(target_size[1] * REDUCING_GAP))
+    img.draft(None, gap_size)  # 非JPEG图片不起作用
+
+    factor = int(min(img.width / gap_size[0], img.height / max(gap_size[1], 1)))
+    if factor >= 2:
+        try:
+            img = img.reduce(factor)
+        except ValueError:  # 不支持reduce的模式（如调色板图片）
+            pass
+    return img
+
+
+def decode_and_fit(img_path, base_width, fast_decode=False):
+    """解码用户图片并调整为底图宽度"""
+    with stage('decode'):
+        with Image.open(img_path) as img:
+            size = fitted_size(img.size, base_width)
+            if fast_decode:
+                img = reduce_on_load(img, size)
+            img = img.convert(working_mode(img))
+        count_image(img)
+    with stage('fit_resize'):
+        img = img.resize(size, Image.LANCZOS)
+        count_image(img)
+    return img
+
+
+def load_source_image(img_path, base_width, params):
+    """加载用户图片，调整为底图宽度并裁剪"""
+    return apply_crops(decode_and_fit(img_path, base_width, params.fast_decode), params)
+
+
+class PlacedImage:
+    """已经按最终尺寸缩放并放好位置的用户图片，只包含画布内可见的部分（完全不可见时image为None）"""
+
+    def __init__(self, image, position):
+        self.image = image
+        self.position = position
+
+
+def load_placed_image(img_path, base_width, canvas, params):
+    """按GeometryPlan只做一次重采样，直接得到画布上可见部分的用户图片（fused_resample）"""
+    with stage('decode'):
+        with Image.open(img_path) as img:
+            plan = GeometryPlan(img.size, base_width, params, canvas)
+            if plan.visible is None:
+                return PlacedImage(None, plan.position)
+            if params.fast_decode:
+                img = reduce_on_load(img, plan.decode_target())
+            img = img.convert(working_mode(img))
+        count_image(img)
+
+    with stage('fused_resample'):
+        box = plan.source_box(img.size)
+        size = plan.output_size
+        if all(v == int(v) for v in box) and (box[2] - box[0], box[3] - box[1]) == size:
+            # 不需要缩放，直接裁剪
+            img = img.crop(tuple(int(v) for v in box))
+        else:
+            img = img.resize(size, Image.LANCZOS, box=box)
+        if plan.corner_crop and img.mode == "RGBA":
+            # 与旧流程（_crop_corner）相同：按自身透明度粘贴到透明图层上，半透明区域的颜色和透明度
+            # 都再乘一次透明度
+            squared = Image.new("RGBA", img.size, (0, 0, 0, 0))
+            squared.paste(img, (0, 0), img)
+            img = squared
+        if plan.corner is not None:
+            if img.mode != "RGBA":
+                img = img.convert("RGBA")
+            left, top, right, bottom = plan.corner
+            ImageDraw.Draw(img).rectangle([(left, top), (right - 1, bottom - 1)], fill=(0, 0, 0, 0))
+        count_image(img)
+    return PlacedImage(img, plan.visible_position)
+
+
+def canvas_size(layers):
+    """合成画布大小（与底图一致）"""
+    if 'base' in layers:
+        return layers['base'].size
+    return DEFAULT_CANVAS_SIZE
+
+
+def masked_region(img, position, size):
+    """按带蒙版粘贴的效果，得到图片与画布相交部分的图层
+
+    相当于把img以自身为蒙版粘贴到size大小的透明图层的position处，但只生成相交区域，
+    返回 (区域图层, 区域左上角坐标)；与画布不相交时返回None。
+    没有透明度的图片（RGB）粘贴后不变，直接返回相交的部分。
+    """
+    x, y = position
+    left, top = max(x, 0), max(y, 0)
+    right, bottom = min(x + img.width, size[0]), min(y + img.height, size[1])
+    if right <= left or bottom <= top:
+        return None
+    if (left, top, right, bottom) != (x, y, x + img.width, y + img.height):
+        img = img.crop((left - x, top - y, right - x, bottom - y))
+    if img.mode != "RGBA":
+        return img, (left, top)
+    region = Image.new("RGBA", img.size, (0, 0, 0, 0))
+    region.paste(img, (0, 0), img)
+    return region, (left, top)
+
+
+def composite_layer(canvas, layer, dest=(0, 0), source=None):
+    """把图层（或图层中source区域）合成到画布的dest处
+
+    RGBA画布使用alpha_composite。RGB画布（底图完全不透明）直接以图层的透明度为蒙版粘贴，
+    结果与在RGBA画布上合成后去掉透明度通道逐像素相同；没有透明度的图层直接粘贴。
+    """
+    if source is not None:
+        layer = layer.crop(source)
+    if layer.mode != "RGBA":
+        canvas.paste(layer, dest)
+    elif canvas.mode == "RGBA":
+        canvas.alpha_composite(layer, dest)
+    else:
+        canvas.paste(layer, dest, layer)
+
+
+def proxy_scale(layers, max_size=PREVIEW_SIZE):
+    """让画布刚好放进max_size的缩小比例（不放大）"""
+    width, height = canvas_size(layers)
+    return min(max_size[0] / width, max_size[1] / height, 1.0)
+
+
+def make_proxy_layers(layers, scale):
+    """把全部模板图层按同一比例缩小，用于低分辨率预览"""
+    if scale >= 1.0:
+        return dict(layers)
+    proxies = {}
+    for name, img in layers.items():
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        proxies[name] = img.resize(size, Image.LANCZOS)
+    return proxies
+
+
+class Template:
+    """预先构建好的画布大小的静态图层
+
+    底图、标题图层、缩放并居中后的背景覆盖图、顶层图片对每张图片都相同，
+    只在图层文件、启用状态或覆盖图缩放比例变化时重新构建。
+    使用缩小后的图层（make_proxy_layers）构建时，scale为缩小比例，偏移量会按比例换算。
+
+    底图完全不透明时（且flatten_opaque），合成结果一定不透明，整个合成过程都在RGB画布上进行
+    （mode为'RGB'）：其他图层的透明度只作为粘贴的蒙版，导出时也不需要再转换。
+    """
+
+    def __init__(self, layers, params, scale=1.0):
+        with stage('template'):
+            self._build(layers, params, scale)
+
+    def _build(self, layers, params, scale):
+        self.layers = layers
+        self.scale = scale
+        self.key = self.make_key(params)
+        self.size = canvas_size(layers)
+
+        # 初始画布（如果不使用底图，则为透明画布）
+        self.opaque = False
+        if params.use_base_img and 'base' in layers:
+            self.base = layers['base']
+            self.opaque = is_opaque(self.base)
+        else:
+            self.base = Image.new("RGBA", self.size, (0, 0, 0, 0))
+        self.mode = "RGB" if self.opaque and params.flatten_opaque else "RGBA"
+        if self.base.mode != self.mode:
+            # 不透明的底图加载时已经是RGB（load_layer），通常直接使用；只有关闭flatten_opaque
+            # 或传入的底图是RGBA时才需要转换
+            self.base = self.base.convert(self.mode)
+
+        # 标题/遮挡图层（只保留不透明的区域）
+        self.title_region = None
+        if params.use_title_img and 'title' in layers:
+            self.title_region = self._layer_region(layers['title'], (0, 0))
+        elif params.use_title_img:
+            logger.debug("标题/遮挡图未在缓存中找到")
+
+        # 背景覆盖图层（缩放后居中），预先准备好正片叠底所需的数据
+        self.overlay_blend = None
+        if params.use_overlay_img and 'overlay' in layers:
+            overlay_img = layers['overlay']
+            overlay_scale_percent = params.overlay_scale_factor / 100.0
+            overlay_w = int(overlay_img.width * overlay_scale_percent)
+            overlay_h = int(overlay_img.height * overlay_scale_percent)
+            overlay_resized = overlay_img.resize((overlay_w, overlay_h), Image.LANCZOS)
+
+            overlay_x = (self.size[0] - overlay_w) // 2
+            overlay_y = (self.size[1] - overlay_h) // 2
+            if params.overlay_alpha_blend:
+                # 直接粘贴，保留覆盖图原本的颜色和透明度
+                overlay_layer = Image.new("RGBA", self.size, (0, 0, 0, 0))
+                overlay_layer.paste(overlay_resized, (overlay_x, overlay_y))
+            else:
+                overlay_layer = self._full_canvas_layer(overlay_resized, (overlay_x, overlay_y))
+            self.overlay_blend = OverlayBlend(overlay_layer, params.overlay_alpha_blend, mode=self.mode)
+
+        # 顶层图层（只保留不透明的区域）
+        self.top_region = None
+        if params.use_top_img and 'top' in layers:
+            self.top_region = self._layer_region(layers['top'], (0, 0))
+        elif params.use_top_img:
+            logger.debug("顶层图片未在缓存中找到")
+
+        logger.debug("模板图层已构建，画布尺寸: %dx%d，模式: %s", self.size[0], self.size[1], self.mode)
+
+    def _full_canvas_layer(self, img, position):
+        """把图片粘贴到画布大小的透明图层上"""
+        layer = Image.new("RGBA", self.size, (0, 0, 0, 0))
+        layer.paste(img, position, img)
+        return layer
+
+    def _layer_region(self, img, position):
+        """把图片粘贴到画布上后不透明部分的区域图层，返回 (区域图层, 坐标)，完全透明时返回None"""
+        region = masked_region(img, position, self.size)
+        if region is None:
+            return None
+        layer, (left, top) = region
+        bbox = layer.getchannel('A').getbbox()
+        if bbox is None:
+            return None
+        if bbox != (0, 0) + layer.size:
+            layer = layer.crop(bbox)
+        return layer, (left + bbox[0], top + bbox[1])
+
+    def is_opaque(self):
+        """合成结果是否一定完全不透明（底图完全不透明时，后续图层都不会降低透明度）"""
+        return self.opaque
+
+    def new_canvas(self, box=None):
+        """复制底图（或其中box区域）作为合成用的画布
+
+        共享文件中映射的RGB底图模式为RGBX（见pic_shared），在这次复制时转换为RGB，不另外复制。
+        """
+        canvas = self.base if box is None else self.base.crop(box)
+        if canvas.mode != self.mode:
+            return canvas.convert(self.mode)
+        return canvas.copy() if box is None else canvas
+
+    def shared_buffers(self):
+        """模板中画布大小的数据 {名称: 图像或NumPy数组}（多进程导出时放入共享文件，见pic_shared）"""
+        buffers = {'base': self.base}
+        if self.title_region is not None:
+            buffers['title'] = self.title_region[0]
+        if self.top_region is not None:
+            buffers['top'] = self.top_region[0]
+        if self.overlay_blend is not None:
+            for name, value in self.overlay_blend.shared_buffers().items():
+                buffers['overlay_' + name] = value
+        return buffers
+
+    def with_buffers(self, layers, buffers):
+        """返回使用给定图层和数据（例如共享文件中的只读映射）的模板副本，其余属性不变
+
+        buffers为shared_buffers()格式的字典，没有的数据为None：传入空字典时得到不含大块数据、
+        可以直接pickle传给工作进程的模板。
+        """
+        template = copy.copy(self)
+        template.layers = layers
+        template.base = buffers.get('base')
+        if self.title_region is not None:
+            template.title_region = (buffers.get('title'), self.title_region[1])
+        if self.top_region is not None:
+            template.top_region = (buffers.get('top'), self.top_region[1])
+        if self.overlay_blend is not None:
+            template.overlay_blend = self.overlay_blend.with_buffers(
+                {name[len('overlay_'):]: value for name, value in buffers.items() if name.startswith('overlay_')})
+        return template
+
+    @staticmethod
+    def make_key(params):
+        """影响模板图层的参数"""
+        return (
+            tuple(params.layer_path(name) for name in LAYER_NAMES),
+            tuple(params.layer_enabled(name) for name in LAYER_NAMES),
+            params.overlay_scale_factor,
+            params.overlay_alpha_blend,
+            params.flatten_opaque,
+        )
+
+    def matches(self, layers, params, scale=1.0):
+        """模板是否仍然适用于给定的图层、参数和缩小比例"""
+        return self.layers is layers and self.scale == scale and self.key == self.make_key(params)
+
+
+def place_user_image(user_img, template, params):
+    """按缩放比例和偏移量放置用户图片，返回 (缩放后的图片, 左上角在画布中的坐标)
+
+    user_img为PlacedImage时已经放置好，直接返回（图片完全不可见时为None）。
+    """
+    if isinstance(user_img, PlacedImage):
+        return user_img.image, user_img.position
+    img_resized = scale_user_image(user_img, params)
+    return img_resized, user_position(img_resized.size, template, params)
+
+
+def scale_user_image(user_img, params):
+    """按用户定义的放大比例缩放图片"""
+    # 应用用户定义的缩放（百分比转换为小数）
+    scale_percent = params.scale_factor / 100.0
+    img_resized = user_img
+    if scale_percent != 1.0:
+        with stage('scale_resize'):
+            new_width = int(img_resized.width * scale_percent)
+            new_height = int(img_resized.height * scale_percent)
+            img_resized = img_resized.resize((new_width, new_height), Image.LANCZOS)
+            count_image(img_resized)
+    return img_resized
+
+
+def user_position(size, template, params):
+    """缩放后的用户图片左上角在画布中的坐标"""
+    # 计算图片位置 (居中 + x偏移 + y偏移，低分辨率预览时偏移量按比例换算)
+    x_offset, y_offset = params.x_offset, params.y_offset
+    if template.scale != 1.0:
+        x_offset = round(x_offset * template.scale)
+        y_offset = round(y_offset * template.scale)
+    x = (template.size[0] - size[0]) // 2 + x_offset
+    y = (template.size[1] - size[1]) // 2 + y_offset
+    return x, y
+
+
+def render_card(user_img, template, params):
+    """把已调整宽度的用户图片与模板图层合成为一张图片
+
+    每个图层只在自身不透明的区域内合成到同一张画布上，不再创建画布大小的临时图层。
+    """
+    result = template.new_canvas()
+    count_image(result)
+
+    img_resized, position = place_user_image(user_img, template, params)
+
+    # 合成用户图片（只处理与画布相交的区域）
+    with stage('composite_user'):
+        user_region = masked_region(img_resized, position, result.size) if img_resized is not None else None
+        if user_region is not None:
+            composite_layer(result, *user_region)
+
+    # 添加标题/遮挡图
+    if template.title_region is not None:
+        with stage('composite_title'):
+            composite_layer(result, *template.title_region)
+
+    # 添加背景覆盖图（正片叠底，原地分段处理）
+    if template.overlay_blend is not None:
+        with stage('overlay_blend'):
+            template.overlay_blend.apply_inplace(result)
+
+    # 添加顶层图片（放在最后，处于最顶层）
+    if template.top_region is not None:
+        with stage('composite_top'):
+            composite_layer(result, *template.top_region)
+
+    count('images_rendered')
+    return result
+
+
+def _composite_clipped(canvas, region, origin):
+    """把区域图层落在canvas（画布中左上角为origin的一块区域）内的部分合成到canvas上"""
+    layer, (layer_left, layer_top) = region
+    left, top = max(layer_left, origin[0]), max(layer_top, origin[1])
+    right = min(layer_left + layer.width, origin[0] + canvas.width)
+    bottom = min(layer_top + layer.height, origin[1] + canvas.height)
+    if right > left and bottom > top:
+        composite_layer(canvas, layer, (left - origin[0], top - origin[1]),
+                        (left - layer_left, top - layer_top, right - layer_left, bottom - layer_top))
+
+
+def render_box(img_resized, position, template, box):
+    """只合成画布中box区域，img_resized和position为place_user_image的结果
+
+    每一步都是逐像素的运算，结果与整张合成后裁剪出这个区域完全相同。
+    """
+    left, top = box[:2]
+    region = template.new_canvas(box)
+    if img_resized is not None:
+        user_region = masked_region(img_resized, (position[0] - left, position[1] - top), region.size)
+        if user_region is not None:
+            composite_layer(region, *user_region)
+    if template.title_region is not None:
+        _composite_clipped(region, template.title_region, (left, top))
+    if template.overlay_blend is not None:
+        template.overlay_blend.apply_inplace(region, (left, top))
+    if template.top_region is not None:
+        _composite_clipped(region, template.top_region, (left, top))
+    return region
+
+
+def render_strips(user_img, template, params, rows=None):
+    """按从上到下的横条逐条合成，依次生成每个横条（与render_card的结果逐像素一致）
+
+    只有缩放用户图片（放大比例不是100%时）需要整张进行，以保证重采样结果不变。
+    """
+    width, height = template.size
+    if rows is None:
+        rows = max(1, TILE_BYTES // (width * 4))
+    img_resized, position = place_user_image(user_img, template, params)
+
+    for top in range(0, height, rows):
+        yield render_box(img_resized, position, template, (0, top, width, min(top + rows, height)))
+
+    count('images_rendered')
+
+
+def _user_rect(img, position, size):
+    """用户图片在画布内的区域，不可见时返回None"""
+    left, top = max(position[0], 0), max(position[1], 0)
+    right, bottom = min(position[0] + img.width, size[0]), min(position[1] + img.height, size[1])
+    if right <= left or bottom <= top:
+        return None
+    return left, top, right, bottom
+
+
+def union_rect(a, b):
+    """两个区域的外接矩形（None表示空区域）"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+
+class RenderedFrame:
+    """增量合成的结果
+
+    image为合成结果（之后不会再被修改）；base不为None时，image只在dirty区域与base不同
+    （dirty为None表示完全相同），正在显示base的地方只需要更新这个区域。
+    """
+
+    def __init__(self, image, base=None, dirty=None):
+        self.image = image
+        self.base = base
+        self.dirty = dirty
+
+
+class IncrementalRenderer:
+    """保留每张图片上一次的合成结果，只有位置或放大比例变化时只重新合成变化的区域
+
+    模板和用户图片都没有变化（是同一个对象）时，只有新旧两个用户图片区域的外接矩形需要重新合成，
+    其中的标题、覆盖图、顶层图层也一并重新合成。更新时先复制上一次的结果，返回的图片不会再被修改。
+    只能在一个线程中使用。
+    """
+
+    def __init__(self, max_entries=4):
+        self.max_entries = max_entries
+        # 键 -> (模板, 用户图片, 合成结果, 用户图片区域, 位置与尺寸, 放大比例, 缩放后的图片)
+        self._states = OrderedDict()
+
+    def render(self, key, user_img, template, params):
+        """合成一张图片（key区分不同的图片，例如图片路径），返回RenderedFrame"""
+        state = self._states.get(key)
+        if state is not None and (state[0] is not template or state[1] is not user_img):
+            state = None
+
+        # 只有偏移量变化时沿用上一次缩放好的图片
+        if state is not None and state[5] == params.scale_factor:
+            img_resized = state[6]
+        else:
+            img_resized = scale_user_image(user_img, params)
+        position = user_position(img_resized.size, template, params)
+        rect = _user_rect(img_resized, position, template.size)
+        placement = (position, img_resized.size)
+
+        if state is None:
+            frame = RenderedFrame(render_card(PlacedImage(img_resized, position), template, params))
+        else:
+            previous, previous_rect, previous_placement = state[2:5]
+            dirty = union_rect(previous_rect, rect)
+            if placement == previous_placement or dirty is None:
+                # 位置和尺寸都没有变化，或者前后都不可见
+                frame = RenderedFrame(previous, previous)
+            else:
+                with stage('incremental'):
+                    image = previous.copy()
+                    image.paste(render_box(img_resized, position, template, dirty), dirty[:2])
+                frame = RenderedFrame(image, previous, dirty)
+
+        self._states[key] = (template, user_img, frame.image, rect, placement, params.scale_factor, img_resized)
+        self._states.move_to_end(key)
+        while len(self._states) > self.max_entries:
+            self._states.popitem(last=False)
+        return frame
+
+
+class TiledCard:
+    """分块导出时compose()的结果：保存时才逐条合成并编码，不生成整张画布"""
+
+    def __init__(self, user_img, template, params):
+        self.user_img = user_img
+        self.template = template
+        self.params = params
+        self.size = template.size
+
+    def strips(self):
+        return render_strips(self.user_img, self.template, self.params)
+
+
+def output_filename(img_path, output_format='', root=None):
+    """导出文件名（指定了导出格式时替换扩展名）
+
+    指定了root（选择的文件夹）时保留图片在其中的子文件夹，例如 unit1/processed_01.jpg，
+    不同子文件夹中的同名图片不会互相覆盖。返回的名称用/分隔，同时用作导出清单的键。
+    """
+    name = os.path.splitext(os.path.basename(img_path))[0]
+    filename = f"{OUTPUT_PREFIX}{name}{output_extension(img_path, output_format)}"
+    if root is None:
+        return filename
+    try:
+        subdir = os.path.relpath(os.path.dirname(os.path.abspath(img_path)), os.path.abspath(root))
+    except ValueError:
+        return filename  # Windows上不在同一个驱动器
+    # 不在root中的图片直接放在输出目录中
+    if subdir == os.curdir or subdir == os.pardir or subdir.startswith(os.pardir + os.sep):
+        return filename
+    return '/'.join(subdir.split(os.sep) + [filename])
+
+
+def output_file_path(output_dir, img_path, output_format='', root=None):
+    """导出文件的完整路径（见output_filename）"""
+    return os.path.join(output_dir, *output_filename(img_path, output_format, root).split('/'))
+
+
+def check_output_names(img_paths, output_format='', root=None):
+    """检查是否有多张图片会导出为同一个文件（例如指定导出格式后的a.png和a.jpg），有时抛出ValueError"""
+    seen = {}
+    conflicts = []
+    for img_path in img_paths:
+        key = os.path.normcase(output_filename(img_path, output_format, root))
+        other = seen.setdefault(key, img_path)
+        if other != img_path:
+            conflicts.append((other, img_path))
+    if conflicts:
+        details = "\n".join(f"{a} 与 {b}" for a, b in conflicts[:10])
+        raise ValueError(f"有 {len(conflicts)} 张图片与其他图片的导出文件名相同，导出时会互相覆盖:\n{details}")
+
+
+class Renderer:
+    """持有模板图层和参数，逐张合成图片"""
+
+    def __init__(self, params, layers=None, template=None):
+        """template为已经构建好的模板（例如工作进程中共享的模板），与图层和参数不符时重建"""
+        self.params = params
+        self.layers = load_layers(params) if layers is None else layers
+        self.template = template
+
+    def get_template(self):
+        """获取模板（参数变化后自动重建）"""
+        if self.template is None or not self.template.matches(self.layers, self.params):
+            self.template = Template(self.layers, self.params)
+        return self.template
+
+    def require_base(self):
+        """没有底图（无法确定画布和图片宽度）时抛出ValueError"""
+        if 'base' not in self.layers:
+            raise ValueError(f"{LAYER_LABELS['base']}不存在: {self.params.base_img_path}")
+
+    def load(self, img_path):
+        """读取用户图片，调整为底图宽度并裁剪（fused_resample时直接得到放置好的PlacedImage）"""
+        self.require_base()
+        base_width = self.layers['base'].width
+        if self.params.fused_resample:
+            return load_placed_image(img_path, base_width, canvas_size(self.layers), self.params)
+        return load_source_image(img_path, base_width, self.params)
+
+    def compose(self, user_img):
+        """把已读取的用户图片与模板合成（分块导出时返回TiledCard，保存时才合成）"""
+        if self.params.tiled_render:
+            return TiledCard(user_img, self.get_template(), self.params)
+        return render_card(user_img, self.get_template(), self.params)
+
+    def save(self, processed_img, img_path, output_dir, root=None):
+        """保存合成结果到输出目录，返回输出路径（root见output_filename，需要时创建子文件夹）"""
+        path = output_file_path(output_dir, img_path, self.params.output_format, root)
+        if root is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(processed_img, TiledCard):
+            # 合成与编码交替进行，耗时一起计入
+            with stage('tiled_encode'):
+                save_strips(processed_img.strips(), processed_img.size,
+                            processed_img.template.is_opaque(), path, self.params)
+        else:
+            with stage('encode'):
+                save_image(processed_img, path, self.params)
+        count('images_saved')
+        return path
+
+    def render(self, img_path):
+        """处理单张图片（分块导出时返回TiledCard），没有底图时返回None"""
+        if 'base' not in self.layers:
+            return None
+        return self.compose(self.load(img_path))
+
+    def render_to_dir(self, img_path, output_dir, root=None):
+        """处理单张图片并保存到输出目录，返回输出路径（没有底图时抛出ValueError）"""
+        self.require_base()
+        return self.save(self.render(img_path), img_path, output_dir, root)
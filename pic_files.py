@@ -0,0 +1,189 @@
+"""图片文件的查找与信息读取
+
+选择整个文件夹（可以包括子文件夹）时，用os.scandir逐个目录查找图片，
+查找在后台线程中进行，找到的图片随时可以使用，不需要等全部查找完。
+图片的尺寸和格式只从文件头读取（不解码像素），用到时才读取并缓存少量结果。
+输出目录放在输入文件夹中（或就是输入文件夹）时，查找图片会跳过输出目录和导出的文件，
+不会把之前导出的结果当作新的图片再处理一遍。
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+# 支持的图片扩展名
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# 缓存的图片信息数量
+INFO_CACHE_SIZE = 1024
+
+# 导出文件名的前缀
+OUTPUT_PREFIX = "processed_"
+
+
+def is_image_file(name):
+    """按扩展名判断是否是支持的图片"""
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def is_output_filename(path):
+    """是否是导出的文件名（输出目录就是输入文件夹时，用来跳过导出结果）"""
+    return os.path.basename(path).startswith(OUTPUT_PREFIX)
+
+
+def _is_within(path, directory):
+    """path（realpath）是否就是directory或在其中"""
+    return path == directory or path.startswith(os.path.join(directory, ''))
+
+
+def output_exclusion(directory, output_dir):
+    """在directory中查找图片时，为了跳过导出结果需要排除的内容
+
+    返回 (exclude, skip_outputs)：exclude为不进入的文件夹（输出目录在directory中时），
+    skip_outputs表示还要跳过导出的文件名（输出目录就是directory或在其中时）。
+    """
+    if output_dir is None:
+        return (), False
+    input_real, output_real = os.path.realpath(directory), os.path.realpath(output_dir)
+    if output_real == input_real:
+        return (), True
+    return (output_real,), _is_within(output_real, input_real)
+
+
+def exclude_outputs(paths, directory, output_dir):
+    """从已经找到的图片中去掉输出目录中的文件和导出的文件名（见output_exclusion）"""
+    exclude, skip_outputs = output_exclusion(directory, output_dir)
+    if not skip_outputs:
+        return list(paths)
+    return [path for path in paths if not is_output_filename(path)
+            and not any(_is_within(os.path.realpath(path), folder) for folder in exclude)]
+
+
+def scan_images(directory, recursive=True, exclude=(), output_dir=None):
+    """按名称顺序逐个生成目录中的图片路径（子文件夹排在当前文件夹的图片之后）
+
+    exclude为不进入的子文件夹（os.path.realpath得到的路径）。
+    指定了output_dir时跳过其中的导出结果（见output_exclusion）。
+    """
+    output_exclude, skip_outputs = output_exclusion(directory, output_dir)
+    exclude = set(exclude) | set(output_exclude)
+    pending = [directory]
+    while pending:
+        current = pending.pop()
+        try:
+            with os.scandir(current) as it:
+                entries = sorted(it, key=lambda entry: entry.name.lower())
+        except OSError:
+            continue  # 没有权限或已被删除的目录
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_file() and is_image_file(entry.name):
+                    if not (skip_outputs and is_output_filename(entry.name)):
+                        yield entry.path
+                elif recursive and entry.is_dir(follow_symlinks=False):
+                    if not exclude or os.path.realpath(entry.path) not in exclude:
+                        subdirs.append(entry.path)
+            except OSError:
+                continue
+        # 倒序入栈，保证按名称顺序处理子文件夹
+        pending.extend(reversed(subdirs))
+
+
+class ImageList:
+    """逐步查找得到的图片路径列表（线程安全）
+
+    可以像普通列表一样取长度和按下标访问；从文件夹创建时，查找在后台线程中进行，
+    长度会随着查找逐渐增加，complete为True表示查找已经完成。
+    root为选择的文件夹（导出时保留图片在其中的子文件夹），直接选择图片时为None。
+    """
+
+    def __init__(self, paths=()):
+        self._paths = list(paths)
+        self.root = None
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._thread = None
+        self.complete = True
+
+    @classmethod
+    def from_directory(cls, directory, recursive=True):
+        """在后台线程中查找文件夹中的图片"""
+        image_list = cls()
+        image_list.root = directory
+        image_list.complete = False
+        image_list._thread = threading.Thread(target=image_list._scan, args=(directory, recursive))
+        image_list._thread.daemon = True
+        image_list._thread.start()
+        return image_list
+
+    def _scan(self, directory, recursive):
+        batch = []
+        try:
+            for path in scan_images(directory, recursive):
+                if self._cancelled:
+                    return
+                batch.append(path)
+                # 分批加入，减少加锁次数
+                if len(batch) >= 256:
+                    with self._lock:
+                        self._paths.extend(batch)
+                    batch = []
+            with self._lock:
+                self._paths.extend(batch)
+        finally:
+            self.complete = True
+
+    def cancel(self):
+        """停止查找（例如重新选择了图片）"""
+        self._cancelled = True
+
+    def wait(self):
+        """等待查找完成"""
+        if self._thread is not None:
+            self._thread.join()
+
+    def without_outputs(self, output_dir):
+        """导出到output_dir时需要处理的图片（从文件夹查找时去掉输出目录中的导出结果）"""
+        if self.root is None:
+            return list(self)
+        return exclude_outputs(self, self.root, output_dir)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._paths)
+
+    def __getitem__(self, index):
+        with self._lock:
+            return self._paths[index]
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._paths))
+
+
+class ImageInfoCache:
+    """按需读取并缓存图片的尺寸和格式（只读取文件头）"""
+
+    def __init__(self, max_entries=INFO_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """返回 {'format', 'size', 'mode'}，文件无法识别时抛出异常"""
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            info = self._items.get(key)
+            if info is not None:
+                self._items.move_to_end(key)
+                return info
+        with Image.open(path) as img:
+            info = {'format': img.format, 'size': img.size, 'mode': img.mode}
+        with self._lock:
+            self._items[key] = info
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+        return info
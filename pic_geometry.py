@@ -0,0 +1,135 @@
+"""用户图片的几何变换规划
+
+旧的处理流程对每张图片做两次LANCZOS重采样：先缩放到底图宽度，裁剪上方、底部、右侧后，
+再按放大比例缩放，最后按偏移量放到画布上（超出画布的部分被丢弃）。
+
+GeometryPlan把这一系列变换合并为一次：从画布上最终可见的矩形反推出源图片中对应的区域，
+只对这个区域做一次重采样，直接得到最终尺寸。被裁掉或落在画布以外的像素不参与计算，
+也避免了两次LANCZOS叠加造成的模糊。这里只做坐标计算，不依赖PIL。
+"""
+
+
+def fitted_size(size, base_width):
+    """等比例缩放到底图宽度后的尺寸"""
+    width, height = size
+    width_percent = base_width / float(width)
+    return base_width, int(float(height) * float(width_percent))
+
+
+def edge_crop_box(size, params):
+    """裁剪上方、底部、右侧后保留的区域 (left, top, right, bottom)
+
+    与依次裁剪上方、底部、右侧的结果相同（后一步按前一步裁剪后的尺寸计算）。
+    """
+    width, height = size
+    top = 0
+    crop_top_percent = params.crop_top_percent / 100.0
+    if 0 < crop_top_percent < 1:
+        top = int(height * crop_top_percent)
+
+    bottom = height
+    crop_percent = params.crop_bottom_percent / 100.0
+    if 0 < crop_percent < 1:
+        bottom = top + int((height - top) * (1 - crop_percent))
+
+    right = width
+    crop_right_percent = params.crop_right_percent / 100.0
+    if 0 < crop_right_percent < 1:
+        right = int(width * (1 - crop_right_percent))
+
+    return 0, top, right, bottom
+
+
+def corner_square_size(width, params):
+    """右上角裁剪的正方形边长（未启用或为0时返回0）"""
+    if not params.use_corner_crop:
+        return 0
+    corner_size_percent = params.crop_corner_size / 100.0
+    if 0 < corner_size_percent < 1:
+        return int(width * corner_size_percent)
+    return 0
+
+
+class GeometryPlan:
+    """一张源图片从解码到放上画布的完整几何变换
+
+    主要属性：
+        size        缩放并裁剪后的完整尺寸（与两次缩放的流程相同）
+        position    完整图片左上角在画布中的坐标
+        visible     在画布内可见的部分（相对完整图片的坐标），完全不可见时为None
+        corner      可见部分中需要变为透明的右上角矩形（相对可见部分的坐标），没有时为None
+        corner_crop 是否裁剪右上角（旧流程此时把带透明度的图片按自身透明度粘贴到透明图层上，
+                    即使右上角不在可见部分中）
+    """
+
+    def __init__(self, source_size, base_width, params, canvas, scale=1.0):
+        """scale为模板的缩小比例（低分辨率预览时偏移量按比例换算）"""
+        self.source_size = source_size
+        fit_w, fit_h = fitted_size(source_size, base_width)
+        left, top, right, bottom = edge_crop_box((fit_w, fit_h), params)
+        crop_w, crop_h = right - left, bottom - top
+
+        # 用户定义的缩放
+        scale_percent = params.scale_factor / 100.0
+        if scale_percent != 1.0:
+            width, height = int(crop_w * scale_percent), int(crop_h * scale_percent)
+        else:
+            width, height = crop_w, crop_h
+        self.size = (width, height)
+
+        # 位置（居中 + 偏移）
+        x_offset, y_offset = params.x_offset, params.y_offset
+        if scale != 1.0:
+            x_offset = round(x_offset * scale)
+            y_offset = round(y_offset * scale)
+        x = (canvas[0] - width) // 2 + x_offset
+        y = (canvas[1] - height) // 2 + y_offset
+        self.position = (x, y)
+
+        # 最终坐标 -> 源图片坐标的比例
+        self._sx = crop_w / width * source_size[0] / fit_w if width else 0.0
+        self._sy = crop_h / height * source_size[1] / fit_h if height else 0.0
+        self._origin = (left * source_size[0] / fit_w, top * source_size[1] / fit_h)
+
+        vx0, vy0 = max(0, -x), max(0, -y)
+        vx1, vy1 = min(width, canvas[0] - x), min(height, canvas[1] - y)
+        self.visible = (vx0, vy0, vx1, vy1) if vx1 > vx0 and vy1 > vy0 else None
+
+        # 右上角裁剪：旧流程在裁剪后的图片上画出 [(w - s, 0), (w, s)] 的矩形（包含边界）
+        self.corner = None
+        square = corner_square_size(crop_w, params)
+        self.corner_crop = square > 0
+        if square > 0 and self.visible is not None:
+            corner_left = round((crop_w - square) * width / crop_w)
+            corner_bottom = min(height, round((square + 1) * height / crop_h))
+            cx0, cy1 = max(corner_left, vx0) - vx0, min(corner_bottom, vy1) - vy0
+            if cx0 < vx1 - vx0 and cy1 > 0:
+                self.corner = (cx0, 0, vx1 - vx0, cy1)
+
+    @property
+    def visible_position(self):
+        """可见部分左上角在画布中的坐标"""
+        return self.position[0] + self.visible[0], self.position[1] + self.visible[1]
+
+    @property
+    def output_size(self):
+        """可见部分的尺寸"""
+        vx0, vy0, vx1, vy1 = self.visible
+        return vx1 - vx0, vy1 - vy0
+
+    def source_box(self, decoded_size=None):
+        """可见部分对应的源图片区域（浮点坐标）
+
+        decoded_size为解码时已经缩小的图片尺寸（例如JPEG按比例解码），坐标按比例换算。
+        """
+        rx = decoded_size[0] / self.source_size[0] if decoded_size else 1.0
+        ry = decoded_size[1] / self.source_size[1] if decoded_size else 1.0
+        vx0, vy0, vx1, vy1 = self.visible
+        ox, oy = self._origin
+        return ((ox + vx0 * self._sx) * rx, (oy + vy0 * self._sy) * ry,
+                (ox + vx1 * self._sx) * rx, (oy + vy1 * self._sy) * ry)
+
+    def decode_target(self):
+        """整张源图片按最终比例缩放后的尺寸（用于解码时缩小）"""
+        return (max(1, round(self.source_size[0] / self._sx)) if self._sx else 1,
+                max(1, round(self.source_size[1] / self._sy)) if self._sy else 1)
@@ -0,0 +1,153 @@
+"""增量导出清单
+
+输出目录中的清单文件记录每张导出图片对应的：
+    - 源文件的内容哈希（以及大小和修改时间，没有变化时不需要重新计算哈希）
+    - 合成设置的指纹：模板图层（底图/标题/覆盖图/顶层）的像素哈希 + 全部合成参数
+再次导出到同一目录时，源文件和设置都没有变化、且输出文件仍然存在的图片直接跳过。
+"""
+import hashlib
+import json
+import os
+import threading
+
+from pic_engine import LAYER_NAMES, output_filename
+
+# 清单文件名（位于输出目录中）
+MANIFEST_NAME = ".pic_manifest.json"
+MANIFEST_VERSION = 1
+
+# 计算哈希时每次读取的字节数
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# 每完成这么多张图片保存一次清单，中途退出时已完成的图片不会丢失
+SAVE_INTERVAL = 50
+
+
+def file_hash(path):
+    """文件内容的SHA-256"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def layer_hash(img):
+    """模板图层的像素哈希（与图层文件的路径和编码方式无关）"""
+    h = hashlib.sha256()
+    h.update(f"{img.mode} {img.size}".encode())
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+
+def settings_fingerprint(params, layers):
+    """影响导出结果的全部设置的指纹
+
+    图层路径不计入（由图层的像素哈希代替），图层换了位置但内容相同时仍然可以跳过。
+    底图即使未启用也决定画布大小和图片宽度，总是计入。
+    """
+    config = params.to_config()
+    for name in LAYER_NAMES:
+        config.pop(f'{name}_img_path', None)
+    config['layers'] = {
+        name: layer_hash(layers[name]) if name in layers and (name == 'base' or params.layer_enabled(name)) else None
+        for name in LAYER_NAMES
+    }
+    text = json.dumps(config, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ExportManifest:
+    """输出目录的导出清单（线程安全）"""
+
+    def __init__(self, output_dir, settings, output_format='', root=None):
+        """root为选择的文件夹，清单按相对于它的导出文件名记录（见output_filename）"""
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.root = root
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.settings = settings
+        self.entries = self._load()  # 输出文件名（包括子文件夹，用/分隔） -> 记录
+        self._pending = {}  # 图片路径 -> 待导出图片的新记录
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """读取已有的清单，不存在或无法解析时返回空清单"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get('version') != MANIFEST_VERSION:
+            return {}
+        return data.get('entries', {})
+
+    def _record(self, img_path, entry):
+        """生成源文件的记录（大小和修改时间没有变化时沿用清单中的哈希）"""
+        source = os.path.abspath(img_path)
+        st = os.stat(img_path)
+        if (entry and entry.get('source') == source and entry.get('size') == st.st_size
+                and entry.get('mtime_ns') == st.st_mtime_ns):
+            digest = entry['sha256']
+        else:
+            digest = file_hash(img_path)
+        return {
+            'source': source,
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'sha256': digest,
+            'settings': self.settings,
+        }
+
+    def is_current(self, name, entry, record):
+        """清单中的记录与源文件和设置一致，并且输出文件仍然存在"""
+        if not entry:
+            return False
+        same = all(entry.get(key) == record[key] for key in ('source', 'sha256', 'settings'))
+        return same and os.path.exists(os.path.join(self.output_dir, name))
+
+    def plan(self, img_paths):
+        """把图片分为需要导出的和可以跳过的，返回 (需要导出的列表, 跳过的列表)"""
+        to_render = []
+        skipped = []
+        for img_path in img_paths:
+            name = output_filename(img_path, self.output_format, self.root)
+            entry = self.entries.get(name)
+            try:
+                record = self._record(img_path, entry)
+            except OSError:
+                # 无法读取的文件交给导出过程报告错误
+                to_render.append(img_path)
+                continue
+            if self.is_current(name, entry, record):
+                skipped.append(img_path)
+                # 大小或修改时间变了但内容没变时更新记录，下次不必重新计算哈希
+                if entry != record:
+                    self.entries[name] = record
+            else:
+                to_render.append(img_path)
+                self._pending[img_path] = record
+        return to_render, skipped
+
+    def mark_done(self, img_path):
+        """记录导出成功的图片"""
+        with self._lock:
+            record = self._pending.pop(img_path, None)
+            if record is None:
+                return
+            self.entries[output_filename(img_path, self.output_format, self.root)] = record
+            self._unsaved += 1
+            save = self._unsaved >= SAVE_INTERVAL
+        if save:
+            self.save()
+
+    def save(self):
+        """写入清单文件（先写临时文件再替换，中途出错不会损坏原有清单）"""
+        with self._lock:
+            data = {'version': MANIFEST_VERSION, 'entries': dict(self.entries)}
+            self._unsaved = 0
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
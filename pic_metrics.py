@@ -0,0 +1,173 @@
+"""性能统计
+
+处理过程中的各个阶段用 stage(名称) 计时，用 count(名称, 数量) 计数：
+
+    with stage('decode'):
+        ...
+    count('images_rendered')
+
+未启用统计时（默认）stage()返回一个共享的空上下文管理器，count()直接返回，几乎没有开销。
+enable()之后的统计对整个进程有效；多进程导出时每个工作进程各自统计，结果随任务结果传回主进程合并。
+统计结果可以输出为汇总表格，也可以逐条写入JSON Lines文件。
+长时间运行的服务可以用max_samples只保留每个阶段最近的若干次计时。
+"""
+import collections
+import json
+import os
+import statistics
+import threading
+import time
+
+# 当前启用的统计（未启用时为None）
+_active = None
+
+
+class _NullStage:
+    """未启用统计时使用的空上下文管理器"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    """计时上下文管理器"""
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def stage(name):
+    """对代码块计时"""
+    if _active is None:
+        return _NULL_STAGE
+    return _Stage(_active, name)
+
+
+def count(name, n=1):
+    """计数"""
+    if _active is not None:
+        _active.count(name, n)
+
+
+def count_image(img, name='bytes_allocated'):
+    """按图片占用的内存字节数计数"""
+    if _active is not None:
+        _active.count(name, img.width * img.height * len(img.getbands()))
+
+
+def active():
+    """当前启用的统计，未启用时返回None"""
+    return _active
+
+
+def enable(metrics=None):
+    """启用统计，返回Metrics对象"""
+    global _active
+    _active = metrics if metrics is not None else Metrics()
+    return _active
+
+
+def disable():
+    """停止统计，返回之前启用的Metrics对象"""
+    global _active
+    metrics, _active = _active, None
+    return metrics
+
+
+class Metrics:
+    """各阶段的耗时与计数器（线程安全）
+
+    jsonl_path不为空时，每次计时都会作为一行JSON写入该文件，close()时再写入一行汇总。
+    max_samples不为空时每个阶段只保留最近的max_samples次计时（汇总只反映这些计时，计数器不受影响）。
+    """
+
+    def __init__(self, jsonl_path=None, max_samples=None):
+        self.max_samples = max_samples
+        self.timings = {}  # 阶段名 -> [耗时（秒）]
+        self.counters = {}  # 计数器名 -> 数量
+        self._lock = threading.Lock()
+        self._jsonl = open(jsonl_path, 'a', encoding='utf-8') if jsonl_path else None
+
+    def record(self, name, seconds, pid=None):
+        """记录一次阶段耗时"""
+        with self._lock:
+            samples = self.timings.get(name)
+            if samples is None:
+                samples = self.timings[name] = collections.deque(maxlen=self.max_samples)
+            samples.append(seconds)
+            if self._jsonl is not None:
+                line = {'type': 'stage', 'name': name, 'ms': round(seconds * 1000, 3),
+                        'time': round(time.time(), 3), 'pid': pid or os.getpid()}
+                self._jsonl.write(json.dumps(line) + "\n")
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def drain(self):
+        """取出目前为止的统计数据并清空（用于从工作进程传回主进程）"""
+        with self._lock:
+            timings = {name: list(samples) for name, samples in self.timings.items()}
+            data = {'pid': os.getpid(), 'timings': timings, 'counters': self.counters}
+            self.timings = {}
+            self.counters = {}
+        return data
+
+    def merge(self, data):
+        """合并drain()的结果"""
+        for name, samples in data['timings'].items():
+            for seconds in samples:
+                self.record(name, seconds, data['pid'])
+        for name, n in data['counters'].items():
+            self.count(name, n)
+
+    def summary(self):
+        """汇总：每个阶段的次数、总耗时、中位数、平均值、95百分位、最大值（毫秒），以及全部计数器"""
+        with self._lock:
+            stages = {}
+            for name, samples in self.timings.items():
+                ms = sorted(s * 1000 for s in samples)
+                stages[name] = {
+                    'count': len(ms),
+                    'total_ms': round(sum(ms), 3),
+                    'median_ms': round(statistics.median(ms), 3),
+                    'mean_ms': round(statistics.mean(ms), 3),
+                    'p95_ms': round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 3),
+                    'max_ms': round(max(ms), 3),
+                }
+            return {'stages': stages, 'counters': dict(self.counters)}
+
+    def format_table(self):
+        """汇总表格（按总耗时从高到低排列）"""
+        summary = self.summary()
+        lines = [f"{'阶段':<18}{'次数':>8}{'总计(ms)':>12}{'中位数(ms)':>12}{'最大(ms)':>12}"]
+        stages = sorted(summary['stages'].items(), key=lambda item: item[1]['total_ms'], reverse=True)
+        for name, s in stages:
+            lines.append(f"{name:<18}{s['count']:>8}{s['total_ms']:>12.1f}{s['median_ms']:>12.2f}{s['max_ms']:>12.2f}")
+        for name, n in sorted(summary['counters'].items()):
+            lines.append(f"{name:<18}{n:>8}")
+        return "\n".join(lines)
+
+    def close(self):
+        """写入汇总行并关闭JSON Lines文件"""
+        with self._lock:
+            jsonl, self._jsonl = self._jsonl, None
+        if jsonl is not None:
+            line = dict(self.summary(), type='summary', time=round(time.time(), 3))
+            jsonl.write(json.dumps(line, ensure_ascii=False) + "\n")
+            jsonl.close()
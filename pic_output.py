@@ -0,0 +1,262 @@
+"""导出编码
+
+根据参数选择导出格式和编码选项：
+    - 原格式：与输入图片的扩展名相同（旧版本的行为）
+    - PNG：可以选择压缩级别（级别越低编码越快，文件越大）和是否optimize
+    - JPEG / WebP：有损压缩，按质量参数编码，文件比PNG小得多
+合成结果完全不透明时自动转换为RGB再编码（编码更快、文件更小，像素不变）；
+JPEG不支持透明度，有透明区域时先合成到白色背景上。
+
+分块导出时PNG由PNGStreamWriter逐条编码写入文件（与PIL一样按行自适应选择过滤方式，
+安装了NumPy时使用向量化的实现，否则不过滤；像素相同，文件大小可能略有差别），
+其他格式逐条拼接到最终模式的画布上再整体编码，仍需要一张完整的画布。
+"""
+import os
+import struct
+import zlib
+
+from PIL import Image
+
+from pic_blend import load_numpy
+
+
+# 导出格式: (PIL格式名, 扩展名)，空字符串表示与输入图片相同
+OUTPUT_FORMATS = {
+    '': None,
+    'png': ('PNG', '.png'),
+    'jpeg': ('JPEG', '.jpg'),
+    'webp': ('WEBP', '.webp'),
+}
+
+# 导出格式在界面上的名称
+OUTPUT_FORMAT_LABELS = {
+    '': '原格式',
+    'png': 'PNG',
+    'jpeg': 'JPEG',
+    'webp': 'WebP',
+}
+
+# PNG压缩预设: (compress_level, optimize)
+PNG_PRESETS = {
+    '快速': (1, False),
+    '默认': (6, False),
+    '最小': (9, True),
+}
+
+# JPEG的透明区域合成到这个背景色上
+JPEG_BACKGROUND = (255, 255, 255)
+
+# PNG文件头
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# 每个IDAT数据块的大小上限（字节）
+IDAT_BYTES = 256 * 1024
+
+# 选择过滤方式时每次处理的数据量（字节），临时数组留在CPU缓存中
+FILTER_CHUNK_BYTES = 256 * 1024
+
+
+def normalize_format(value):
+    """统一导出格式的写法（不区分大小写，jpg等同于jpeg），不支持的格式抛出ValueError"""
+    fmt = str(value or '').strip().lower().lstrip('.')
+    if fmt == 'jpg':
+        fmt = 'jpeg'
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {value}（可选: png、jpeg、webp，留空表示与原图相同）")
+    return fmt
+
+
+def png_preset_name(compress_level, optimize):
+    """找到与PNG参数对应的预设名称（没有完全一致的预设时按压缩级别取最接近的）"""
+    for name, preset in PNG_PRESETS.items():
+        if preset == (compress_level, optimize):
+            return name
+    return min(PNG_PRESETS, key=lambda name: abs(PNG_PRESETS[name][0] - compress_level))
+
+
+def output_extension(img_path, output_format):
+    """导出文件的扩展名"""
+    if output_format:
+        return OUTPUT_FORMATS[output_format][1]
+    return os.path.splitext(img_path)[1]
+
+
+def pil_format(output_path, output_format):
+    """PIL的格式名（原格式时按扩展名判断）"""
+    if output_format:
+        return OUTPUT_FORMATS[output_format][0]
+    ext = os.path.splitext(output_path)[1].lower()
+    fmt = Image.registered_extensions().get(ext)
+    if fmt is None:
+        raise ValueError(f"无法识别的图片格式: {ext or output_path}")
+    return fmt
+
+
+def is_opaque(img):
+    """图像是否完全不透明"""
+    if img.mode != 'RGBA':
+        return 'A' not in img.getbands()
+    return img.getchannel('A').getextrema() == (255, 255)
+
+
+def prepare_for_format(img, fmt, flatten_opaque=True):
+    """按导出格式转换图像模式"""
+    if img.mode != 'RGBA':
+        return img
+    if fmt == 'JPEG':
+        if is_opaque(img):
+            return img.convert('RGB')
+        background = Image.new('RGB', img.size, JPEG_BACKGROUND)
+        background.paste(img, mask=img.getchannel('A'))
+        return background
+    if flatten_opaque and is_opaque(img):
+        return img.convert('RGB')
+    return img
+
+
+def encoder_options(fmt, params):
+    """编码选项"""
+    if fmt == 'PNG':
+        return {'compress_level': params.png_compress_level, 'optimize': params.png_optimize}
+    if fmt in ('JPEG', 'WEBP'):
+        return {'quality': params.output_quality}
+    return {}
+
+
+def save_image(img, output_path, params):
+    """按参数中的导出设置保存图像"""
+    fmt = pil_format(output_path, params.output_format)
+    img = prepare_for_format(img, fmt, params.flatten_opaque)
+    img.save(output_path, fmt, **encoder_options(fmt, params))
+
+
+def _png_chunk(f, tag, data):
+    f.write(struct.pack('>I', len(data)))
+    f.write(tag)
+    f.write(data)
+    f.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(tag))))
+
+
+def _filter_rows(rows, prev, bpp):
+    """对uint8的 (行数, 每行字节数) 数组逐行选择过滤方式
+
+    与libpng/PIL相同：分别计算五种过滤结果，选择按有符号字节计算的绝对值之和最小的一种。
+    prev为上一行（第一行之前为全0），返回每行前面加上过滤类型的字节串。
+    """
+    np = load_numpy()
+    raw = rows.astype(np.int16)
+    up = np.empty_like(raw)
+    up[0] = prev
+    up[1:] = raw[:-1]
+    left = np.zeros_like(raw)
+    left[:, bpp:] = raw[:, :-bpp]
+    upleft = np.zeros_like(raw)
+    upleft[:, bpp:] = up[:, :-bpp]
+
+    # Paeth预测：选择a+b-c最接近的一个（相同时依次优先左、上、左上）
+    pa = np.abs(up - upleft)
+    pb = np.abs(left - upleft)
+    pc = np.abs(left + up - 2 * upleft)
+    paeth = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, upleft))
+
+    candidates = np.stack([raw, raw - left, raw - up, raw - ((left + up) >> 1), raw - paeth]).astype(np.uint8)
+    scores = np.abs(candidates.view(np.int8).astype(np.int32)).sum(axis=2)
+    best = scores.argmin(axis=0)
+    out = np.empty((rows.shape[0], rows.shape[1] + 1), np.uint8)
+    out[:, 0] = best
+    out[:, 1:] = candidates[best, np.arange(rows.shape[0])]
+    return out.tobytes()
+
+
+class PNGStreamWriter:
+    """按横条从上到下写入的PNG编码器（RGB或RGBA，每通道8位）"""
+
+    def __init__(self, f, size, mode, compress_level=6, optimize=False):
+        self.f = f
+        self.width, self.height = size
+        self.mode = mode
+        self.bpp = 4 if mode == 'RGBA' else 3
+        self.rows_written = 0
+        self._prev = None  # 上一行的原始数据
+        self._pending = bytearray()
+        # 与PIL的压缩设置相同（optimize使用最高压缩级别）。像素与整张保存时完全一致，
+        # 但每行的过滤方式不一定与PIL选得相同，文件大小可能略有差别
+        level = 9 if optimize else compress_level
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 15, 9, zlib.Z_FILTERED)
+
+        color_type = 6 if mode == 'RGBA' else 2
+        f.write(PNG_SIGNATURE)
+        _png_chunk(f, b'IHDR', struct.pack('>IIBBBBB', self.width, self.height, 8, color_type, 0, 0, 0))
+
+    def write(self, strip):
+        """写入一个横条（宽度与图片相同，转换为图片的模式）"""
+        if strip.mode != self.mode:
+            strip = strip.convert(self.mode)
+        row_bytes = self.width * self.bpp
+        np = load_numpy()
+        if np is not None:
+            data = np.asarray(strip).reshape(strip.height, row_bytes)
+            if self._prev is None:
+                self._prev = np.zeros(row_bytes, np.uint8)
+            step = max(1, FILTER_CHUNK_BYTES // row_bytes)
+            for start in range(0, strip.height, step):
+                rows = data[start:start + step]
+                self._compress(_filter_rows(rows, self._prev, self.bpp))
+                self._prev = rows[-1]
+        else:
+            data = strip.tobytes()
+            for start in range(0, len(data), row_bytes):
+                self._compress(b'\x00' + data[start:start + row_bytes])
+        self.rows_written += strip.height
+
+    def _compress(self, data):
+        self._pending += self._compressor.compress(data)
+        if len(self._pending) >= IDAT_BYTES:
+            _png_chunk(self.f, b'IDAT', bytes(self._pending))
+            self._pending.clear()
+
+    def close(self):
+        """写入剩余数据和文件尾"""
+        if self.rows_written != self.height:
+            raise ValueError(f"PNG行数不完整: {self.rows_written}/{self.height}")
+        self._pending += self._compressor.flush()
+        _png_chunk(self.f, b'IDAT', bytes(self._pending))
+        self._pending.clear()
+        _png_chunk(self.f, b'IEND', b'')
+
+
+def save_strips(strips, size, opaque, output_path, params):
+    """按参数中的导出设置保存逐条生成的图像（RGBA横条，从上到下）
+
+    opaque表示整张图片一定完全不透明；不能预先确定时PNG按RGBA保存（像素相同）。
+    """
+    fmt = pil_format(output_path, params.output_format)
+    flatten = opaque and params.flatten_opaque
+    if fmt == 'PNG':
+        try:
+            with open(output_path, 'wb') as f:
+                writer = PNGStreamWriter(f, size, 'RGB' if flatten else 'RGBA',
+                                         params.png_compress_level, params.png_optimize)
+                for strip in strips:
+                    writer.write(strip)
+                writer.close()
+        except BaseException:
+            # 不留下写了一半的文件
+            try:
+                os.remove(output_path)
+            except OSError:
+                pass
+            raise
+        return
+
+    # 其他格式不能逐条编码，逐条拼接到最终模式的画布上
+    # （JPEG的透明区域合成到背景色上是逐像素的运算，可以分条进行）
+    rgb = flatten or fmt == 'JPEG'
+    canvas = Image.new('RGB' if rgb else 'RGBA', size)
+    top = 0
+    for strip in strips:
+        if rgb:
+            strip = prepare_for_format(strip, 'JPEG')
+        canvas.paste(strip, (0, top))
+        top += strip.height
+    save_image(canvas, output_path, params)
@@ -0,0 +1,177 @@
+"""预览调度
+
+界面上的每次参数修改都会提交一个预览请求。所有请求由同一个后台线程处理：
+    - 只处理最新的请求（之前还没开始处理的请求直接丢弃）
+    - 请求提交后等待一段防抖时间，期间又有新请求则重新计时
+    - 每个请求带有递增的代号，处理完成时如果已经有更新的请求，结果直接丢弃
+
+空闲时（没有等待处理的请求，且距离上次操作已经超过防抖时间），后台线程按顺序预先处理
+prefetch()提交的请求（例如前后几张图片），结果放入有数量上限的缓存，切换图片时可以直接显示。
+缓存与一个代表当前参数的标记（token）关联，参数变化后缓存和预处理队列全部清空。
+
+后台线程只接收参数快照，不访问任何Tk对象；结果放入队列，由界面线程通过poll()取出。
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# 默认防抖时间（毫秒）
+DEFAULT_DEBOUNCE_MS = 80
+
+# 默认缓存的预览结果数量
+DEFAULT_CACHE_SIZE = 16
+
+
+class PreviewScheduler:
+    """单个后台线程的预览调度器"""
+
+    def __init__(self, render_func, debounce_ms=DEFAULT_DEBOUNCE_MS, cache_size=DEFAULT_CACHE_SIZE):
+        """render_func(request) 在后台线程中调用，返回预览结果或抛出异常"""
+        self.render_func = render_func
+        self.debounce = debounce_ms / 1000.0
+        self.cache_size = cache_size
+        self.generation = 0  # 最新请求的代号
+        self._request = None  # 等待处理的最新请求
+        self._request_time = 0.0
+        self._request_debounce = self.debounce  # 最新请求的防抖时间
+        self._result = None  # (代号, 结果, 错误信息)
+        self._busy = False  # 是否正在处理请求
+        self._closed = False
+        self._token = None  # 当前参数的标记
+        self._cache = OrderedDict()  # 键 -> 结果
+        self._prefetch = []  # 等待预先处理的 (键, 请求)
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def set_token(self, token):
+        """设置当前参数的标记，与之前不同时清空缓存和预处理队列"""
+        with self._cond:
+            if token != self._token:
+                self._token = token
+                self._cache.clear()
+                self._prefetch = []
+
+    def lookup(self, key):
+        """查找缓存的结果；找到时同时作废尚未完成的请求，没有时返回None"""
+        with self._cond:
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+                self.generation += 1
+                self._request = None
+                self._request_time = time.monotonic()
+            return result
+
+    def submit(self, request, key=None, debounce_ms=None):
+        """提交请求（替换掉尚未开始处理的请求），返回请求的代号
+
+        提供了key时，处理结果同时放入缓存。debounce_ms可以单独指定这个请求的防抖时间
+        （例如方向键微调位置时为0，立即处理）。
+        """
+        with self._cond:
+            self.generation += 1
+            self._request = (self.generation, request, key, self._token)
+            self._request_time = time.monotonic()
+            self._request_debounce = self.debounce if debounce_ms is None else debounce_ms / 1000.0
+            self._cond.notify()
+            return self.generation
+
+    def prefetch(self, items):
+        """替换预处理队列，items为按优先级排列的 [(键, 请求)]，已经缓存的会被跳过"""
+        with self._cond:
+            self._prefetch = [(key, request) for key, request in items if key not in self._cache]
+            self._cond.notify()
+
+    def poll(self):
+        """取出最新请求的处理结果 (代号, 结果, 错误信息)，没有新结果时返回None"""
+        with self._cond:
+            result, self._result = self._result, None
+            return result
+
+    def is_idle(self):
+        """没有等待处理或正在处理的请求（不包括预处理）"""
+        with self._cond:
+            return self._request is None and not self._busy
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def _store(self, key, token, result):
+        """把结果放入缓存（调用方持有锁），参数已经变化时丢弃"""
+        if key is None or result is None or token != self._token:
+            return
+        self._cache[key] = result
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _next_request(self):
+        """等待防抖时间结束后取出最新请求，空闲时取出预处理请求
+
+        返回 (是否预处理, 请求信息)，关闭时返回None。
+        """
+        with self._cond:
+            while True:
+                if self._closed:
+                    return None
+                if self._request is None and not self._prefetch:
+                    self._cond.wait()
+                    continue
+                debounce = self._request_debounce if self._request is not None else self.debounce
+                remaining = self._request_time + debounce - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                if self._request is not None:
+                    request, self._request = self._request, None
+                    self._busy = True
+                    return False, request
+                key, request = self._prefetch.pop(0)
+                if key in self._cache:
+                    continue
+                return True, (key, request, self._token)
+
+    def _run(self):
+        while True:
+            item = self._next_request()
+            if item is None:
+                return
+            is_prefetch, info = item
+
+            if is_prefetch:
+                key, request, token = info
+                try:
+                    result = self.render_func(request)
+                except Exception:
+                    # 预处理出错时不缓存，真正显示这张图片时会重新处理并报告错误
+                    continue
+                with self._cond:
+                    self._store(key, token, result)
+                continue
+
+            generation, request, key, token = info
+            result, error = None, None
+            # 开始之前已经过时的请求不再处理
+            if generation == self.generation:
+                with self._cond:
+                    cached = self._cache.get(key) if key is not None and token == self._token else None
+                if cached is not None:
+                    # 预处理刚好完成了同一个请求
+                    result = cached
+                else:
+                    try:
+                        result = self.render_func(request)
+                    except Exception as e:
+                        error = str(e)
+
+            with self._cond:
+                self._busy = False
+                if error is None:
+                    self._store(key, token, result)
+                # 处理期间又有了新请求，结果作废
+                if generation == self.generation:
+                    self._result = (generation, result, error)
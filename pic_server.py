@@ -0,0 +1,346 @@
+"""本地合成服务
+
+长时间运行的HTTP服务，供其他工具（例如单词卡片生成脚本）直接请求合成结果，不需要打开图形界面。
+模板图层只加载一次，构建好的模板和调整宽度后的源图片都保留在内存中；
+并发的请求放入同一个线程池处理（解码、缩放、混合、编码时PIL和NumPy都会释放GIL）。
+
+接口（默认只监听127.0.0.1）：
+    GET  /health    服务状态
+    GET  /metrics   排队数量、处理中的数量、各阶段耗时（中位数、95百分位等）与计数
+    POST /render    合成一张图片
+        - Content-Type为application/json时，请求体为
+          {"path": 源图片路径, "params": {参数覆盖}, "output_dir": 输出目录（可选）}，
+          指定了output_dir时保存到该目录并返回 {"output": 输出路径, ...}，否则直接返回编码后的图片
+        - 其他Content-Type时，请求体为上传的图片文件，参数覆盖放在查询字符串中
+          （如 /render?x_offset=20&output_format=jpeg），直接返回编码后的图片
+    返回图片时，响应头X-Queue-Ms和X-Render-Ms为排队和处理的耗时（毫秒）。
+"""
+import io
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from PIL import UnidentifiedImageError
+
+from pic_cache import SourceImageCache, DEFAULT_CACHE_MB
+from pic_engine import (
+    LAYER_LABELS, LAYER_NAMES, RenderParams, Renderer, Template, load_layers, output_filename, parse_bool,
+    render_card,
+)
+from pic_metrics import Metrics
+from pic_output import encoder_options, pil_format, prepare_for_format
+
+logger = logging.getLogger(__name__)
+
+# 默认监听地址
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# 等待处理的请求数量上限，超过时直接返回503
+DEFAULT_MAX_QUEUE = 64
+
+# 上传图片的大小上限（字节）
+MAX_UPLOAD_BYTES = 256 * 1024 * 1024
+
+# 每个阶段保留的计时数量
+METRICS_SAMPLES = 2048
+
+# 缓存的模板和模板图层数量（参数覆盖中修改了图层路径或模板参数时使用）
+TEMPLATE_CACHE_SIZE = 8
+LAYER_CACHE_SIZE = 4
+
+# 返回图片时的Content-Type
+CONTENT_TYPES = {
+    'PNG': 'image/png',
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+}
+
+# 上传的图片没有文件名，按这个文件名决定"原格式"导出时的格式
+UPLOAD_NAME = 'upload.png'
+
+
+class ServiceBusy(Exception):
+    """等待处理的请求太多"""
+
+
+def parse_query_params(query):
+    """把查询字符串中的参数覆盖转换为配置字典（布尔值按pic_engine.parse_bool解析）"""
+    overrides = {}
+    for name, value in query.items():
+        default = RenderParams.DEFAULTS.get(name)
+        if default is None:
+            raise ValueError(f"未知的参数: {name}")
+        if isinstance(default, bool):
+            try:
+                value = parse_bool(value)
+            except ValueError:
+                raise ValueError(f"无效的布尔值: {name}={value}") from None
+        overrides[name] = value
+    return overrides
+
+
+def encode_image(img, name, params):
+    """按导出设置把图像编码为字节串，返回 (数据, PIL格式名)"""
+    fmt = pil_format(name, params.output_format)
+    img = prepare_for_format(img, fmt, params.flatten_opaque)
+    buffer = io.BytesIO()
+    img.save(buffer, fmt, **encoder_options(fmt, params))
+    return buffer.getvalue(), fmt
+
+
+class RenderService:
+    """保持模板和源图片缓存的合成服务（线程安全）"""
+
+    def __init__(self, params, workers=None, max_queue=DEFAULT_MAX_QUEUE, cache_mb=DEFAULT_CACHE_MB, metrics=None):
+        self.params = params
+        self.layers = load_layers(params)
+        if 'base' not in self.layers:
+            raise ValueError(f"{LAYER_LABELS['base']}不存在: {params.base_img_path}")
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.metrics = metrics if metrics is not None else Metrics(max_samples=METRICS_SAMPLES)
+        self.source_cache = SourceImageCache(int(cache_mb * 1024 * 1024))
+        self._layer_cache = OrderedDict()  # 图层路径 -> 模板图层
+        self._templates = OrderedDict()  # (图层, 模板参数) -> 模板
+        self._lock = threading.Lock()
+        self._queued = 0  # 等待处理的请求数
+        self._active = 0  # 正在处理的请求数
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='render')
+        self._layer_key = self._paths_key(params)
+        self._template(params, self.layers)  # 预先构建默认参数的模板
+        logger.info("合成服务已就绪（%d 个线程）", self.workers)
+
+    @staticmethod
+    def _paths_key(params):
+        return tuple((params.layer_path(name), params.layer_enabled(name)) for name in LAYER_NAMES)
+
+    def params_for(self, overrides):
+        """在服务的默认参数上应用参数覆盖（参数无效时抛出ValueError）"""
+        if not overrides:
+            return self.params
+        unknown = set(overrides) - set(RenderParams.DEFAULTS)
+        if unknown:
+            raise ValueError(f"未知的参数: {', '.join(sorted(unknown))}")
+        return self.params.replace(**overrides)
+
+    def _layers(self, params):
+        """参数对应的模板图层（图层路径与默认参数相同时直接使用已加载的图层）"""
+        key = self._paths_key(params)
+        if key == self._layer_key:
+            return self.layers
+        with self._lock:
+            layers = self._layer_cache.get(key)
+            if layers is not None:
+                self._layer_cache.move_to_end(key)
+                return layers
+        layers = load_layers(params)
+        if 'base' not in layers:
+            raise ValueError(f"{LAYER_LABELS['base']}不存在: {params.base_img_path}")
+        with self._lock:
+            self._layer_cache[key] = layers
+            while len(self._layer_cache) > LAYER_CACHE_SIZE:
+                self._layer_cache.popitem(last=False)
+        return layers
+
+    def _template(self, params, layers):
+        """参数对应的模板（构建后缓存）"""
+        key = (id(layers), Template.make_key(params))
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None and template.layers is layers:
+                self._templates.move_to_end(key)
+                return template
+        template = Template(layers, params)
+        with self._lock:
+            self._templates[key] = template
+            while len(self._templates) > TEMPLATE_CACHE_SIZE:
+                self._templates.popitem(last=False)
+        return template
+
+    def _render(self, params, path, data, output_dir):
+        """在工作线程中处理一个请求"""
+        layers = self._layers(params)
+        renderer = Renderer(params, layers)
+        renderer.template = self._template(params, layers)
+        base_width = layers['base'].width
+
+        if data is not None:
+            user_img = renderer.load(io.BytesIO(data))
+        elif params.fused_resample:
+            user_img = renderer.load(path)
+        else:
+            user_img = self.source_cache.get(path, base_width, params)
+
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+            return {'output': renderer.save(renderer.compose(user_img), path, output_dir)}
+        img = render_card(user_img, renderer.template, params)
+        name = output_filename(path if path is not None else UPLOAD_NAME, params.output_format)
+        body, fmt = encode_image(img, name, params)
+        return {'data': body, 'format': fmt}
+
+    def submit(self, params, path=None, data=None, output_dir=None):
+        """提交请求，返回Future，结果为字典：
+        保存到目录时为 {'output': 输出路径}，否则为 {'data': 编码后的图片, 'format': PIL格式名}，
+        另外包括 'queue_ms' 和 'render_ms'。等待的请求太多时抛出ServiceBusy。
+        """
+        if (path is None) == (data is None):
+            raise ValueError("需要提供源图片路径或上传图片（只能选择一种）")
+        if data is not None and output_dir is not None:
+            raise ValueError("上传的图片不能保存到输出目录")
+        with self._lock:
+            if self._queued >= self.max_queue:
+                self.metrics.count('requests_rejected')
+                raise ServiceBusy(f"等待处理的请求过多（{self._queued}）")
+            self._queued += 1
+        submitted = time.perf_counter()
+
+        def task():
+            started = time.perf_counter()
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+            try:
+                result = self._render(params, path, data, output_dir)
+            except Exception:
+                self.metrics.count('requests_failed')
+                raise
+            finally:
+                with self._lock:
+                    self._active -= 1
+            finished = time.perf_counter()
+            self.metrics.record('queue_wait', started - submitted)
+            self.metrics.record('render', finished - started)
+            self.metrics.count('requests_ok')
+            result['queue_ms'] = round((started - submitted) * 1000, 3)
+            result['render_ms'] = round((finished - started) * 1000, 3)
+            return result
+
+        try:
+            return self._executor.submit(task)
+        except RuntimeError:  # 服务已经关闭
+            with self._lock:
+                self._queued -= 1
+            raise ServiceBusy("服务正在关闭") from None
+
+    def render(self, params, path=None, data=None, output_dir=None):
+        """提交请求并等待结果"""
+        return self.submit(params, path, data, output_dir).result()
+
+    def stats(self):
+        """服务状态：排队与处理中的数量、各阶段耗时与计数器、缓存使用情况"""
+        with self._lock:
+            queued, active = self._queued, self._active
+        return {
+            'queue_depth': queued,
+            'active': active,
+            'workers': self.workers,
+            'max_queue': self.max_queue,
+            'metrics': self.metrics.summary(),
+            'source_cache': self.source_cache.stats(),
+        }
+
+    def close(self):
+        """等待已经提交的请求处理完成后关闭"""
+        self._executor.shutdown(wait=True)
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    """HTTP请求处理（每个连接一个线程，实际合成在服务的线程池中进行）"""
+
+    server_version = "PicRender/1.0"
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+    def _send_json(self, status, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        elif path == '/metrics':
+            self._send_json(200, self.server.service.stats())
+        else:
+            self._send_json(404, {'error': f"未知的地址: {path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/render':
+            self._send_json(404, {'error': f"未知的地址: {url.path}"})
+            return
+        service = self.server.service
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            if length > MAX_UPLOAD_BYTES:
+                self._send_json(413, {'error': "上传的图片过大"})
+                return
+            body = self.rfile.read(length)
+
+            content_type = (self.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+            output_dir = None
+            if content_type == 'application/json':
+                request = json.loads(body.decode('utf-8') or '{}')
+                if not isinstance(request, dict):
+                    raise ValueError("请求体必须是JSON对象")
+                path, data = request.get('path'), None
+                output_dir = request.get('output_dir')
+                overrides = request.get('params') or {}
+                if path is not None and not os.path.isfile(path):
+                    raise FileNotFoundError(f"源图片不存在: {path}")
+            else:
+                path, data = None, body
+                query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+                overrides = parse_query_params(query)
+            result = service.render(service.params_for(overrides), path, data, output_dir)
+        except ServiceBusy as e:
+            self._send_json(503, {'error': str(e)})
+            return
+        except FileNotFoundError as e:
+            self._send_json(404, {'error': str(e)})
+            return
+        except (ValueError, TypeError, UnidentifiedImageError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            logger.warning("处理请求失败: %s", e, exc_info=True)
+            self._send_json(500, {'error': str(e)})
+            return
+        finally:
+            service.metrics.record('request', time.perf_counter() - start)
+
+        if 'output' in result:
+            self._send_json(200, result)
+            return
+        data = result['data']
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPES.get(result['format'], 'application/octet-stream'))
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('X-Queue-Ms', str(result['queue_ms']))
+        self.send_header('X-Render-Ms', str(result['render_ms']))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class RenderServer(ThreadingHTTPServer):
+    """持有RenderService的HTTP服务器"""
+
+    daemon_threads = True
+
+    def __init__(self, service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.service = service
+        super().__init__((host, port), RenderRequestHandler)
@@ -0,0 +1,103 @@
+"""在进程之间共享模板图层和构建好的模板数据
+
+主进程把解码后的模板图层（以及模板中画布大小的图层和混合数据）依次写入一个原始临时文件
+（SharedLayers），工作进程只接收文件路径和各项数据的位置，用mmap映射文件后通过Image.frombuffer
+或numpy.frombuffer直接引用，不复制数据：所有进程读取的是操作系统页缓存中的同一份内存。
+RGB图像（不透明的底图）按RGBX写入，与Pillow内部的存储方式相同；Pillow不能直接映射RGB，
+映射得到的图像模式为RGBX（数据相同），模板复制画布时再转换为RGB（Template.new_canvas）。
+
+映射得到的图像和数组是只读的，Pillow在原地修改之前会自动复制，合成流程中也只会读取这些数据。
+"""
+import logging
+import mmap
+import os
+import tempfile
+
+from PIL import Image
+
+from pic_blend import load_numpy
+
+logger = logging.getLogger(__name__)
+
+# 写入文件时使用的原始数据模式（Pillow的RGB图像每个像素占4字节，按RGBX写入才能直接映射，映射后为RGBX）
+RAW_MODES = {'RGB': 'RGBX'}
+
+# 每项数据在文件中的起始位置按这个字节数对齐（映射得到的NumPy数组按元素类型对齐）
+ALIGNMENT = 64
+
+
+class SharedLayers:
+    """写入临时文件的模板图层和模板数据（用作上下文管理器，退出时删除文件）"""
+
+    def __init__(self, layers, directory=None):
+        """layers为 {名称: 图像或NumPy数组}，同一个对象以多个名称出现时只写入一次"""
+        # 名称 -> ('image', 模式, 尺寸, 原始数据模式, 偏移, 字节数) 或 ('array', 元素类型, 形状, 偏移, 字节数)
+        self.index = {}
+        written = {}  # id(对象) -> 索引项
+        fd, self.path = tempfile.mkstemp(prefix='pic_layers_', suffix='.raw', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                offset = 0
+                for name, obj in layers.items():
+                    entry = written.get(id(obj))
+                    if entry is None:
+                        padding = -offset % ALIGNMENT
+                        f.write(b'\0' * padding)
+                        offset += padding
+                        if isinstance(obj, Image.Image):
+                            rawmode = RAW_MODES.get(obj.mode, obj.mode)
+                            data = obj.tobytes('raw', rawmode)
+                            entry = ('image', obj.mode, obj.size, rawmode, offset, len(data))
+                        else:
+                            # 数组直接按内存写入，不复制
+                            data = memoryview(obj).cast('B')
+                            entry = ('array', obj.dtype.str, obj.shape, offset, len(data))
+                        f.write(data)
+                        offset += len(data)
+                        del data
+                        written[id(obj)] = entry
+                    self.index[name] = entry
+        except BaseException:
+            self.close()
+            raise
+        logger.debug("模板图层已写入共享文件 %s（%d 字节）", self.path, offset)
+
+    def handle(self):
+        """传给工作进程的句柄（只包含路径和索引，可以直接pickle）"""
+        return self.path, dict(self.index)
+
+    def close(self):
+        """删除临时文件（已经映射的进程仍然可以继续使用，Windows上需在工作进程退出后调用）"""
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            logger.warning("无法删除共享图层文件 %s: %s", self.path, e)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def attach_layers(handle):
+    """按句柄映射共享文件，返回 ({名称: 只读图像或只读数组}, mmap对象)
+
+    返回的mmap对象需要在图像使用期间一直保留。
+    """
+    path, index = handle
+    if not index:
+        return {}, None
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    layers = {}
+    for name, entry in index.items():
+        if entry[0] == 'image':
+            _, mode, size, rawmode, offset, length = entry
+            layers[name] = Image.frombuffer(mode, size, view[offset:offset + length], 'raw', rawmode, 0, 1)
+        else:
+            _, dtype, shape, offset, length = entry
+            layers[name] = load_numpy().frombuffer(view[offset:offset + length], dtype).reshape(shape)
+    return layers, mapped
@@ -0,0 +1,139 @@
+"""监视文件夹，自动处理新加入或被修改的图片
+
+定时扫描输入文件夹（不依赖任何第三方库）。一个文件的大小和修改时间在两次扫描之间
+保持不变、且至少经过settle秒后才认为已经写完，避免处理复制到一半的文件。
+已经写完的图片用同一个Renderer处理（模板图层只加载一次），并记录在输出目录的导出清单中，
+重新启动监视时不会重复处理没有变化的图片。配置文件被修改后自动重新加载参数。
+输出目录放在输入文件夹中（或就是输入文件夹）时，跳过输出目录和导出的文件，不会把结果再处理一遍。
+"""
+import logging
+import os
+import time
+
+from pic_engine import Renderer, LAYER_LABELS
+from pic_files import scan_images
+from pic_manifest import ExportManifest, settings_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# 默认扫描间隔与文件稳定时间（秒）
+DEFAULT_INTERVAL = 0.2
+DEFAULT_SETTLE = 0.3
+
+
+def file_signature(path):
+    """文件的大小和修改时间，文件不存在时返回None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+class FolderWatcher:
+    """监视输入文件夹并处理新图片
+
+    每处理完一张调用 on_result(图片路径, 输出路径, 错误信息)，跳过没有变化的图片时输出路径为None。
+    """
+
+    def __init__(self, input_dir, output_dir, load_params, recursive=True,
+                 interval=DEFAULT_INTERVAL, settle=DEFAULT_SETTLE, config_path=None, on_result=None):
+        """load_params() 返回当前的RenderParams，配置文件（config_path）变化时重新调用"""
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.load_params = load_params
+        self.recursive = recursive
+        self.interval = interval
+        self.settle = settle
+        self.config_path = config_path
+        self.on_result = on_result
+        self._pending = {}  # 图片路径 -> (文件签名, 首次看到该签名的时间)
+        self._done = {}  # 图片路径 -> 已经处理过的文件签名
+        self._config_signature = None
+        self.renderer = None
+        self.manifest = None
+        os.makedirs(output_dir, exist_ok=True)
+        self.reload()
+
+    def reload(self):
+        """加载参数和模板图层（配置变化后所有图片重新检查一遍）"""
+        self._config_signature = file_signature(self.config_path) if self.config_path else None
+        params = self.load_params()
+        renderer = Renderer(params)
+        if 'base' not in renderer.layers:
+            raise ValueError(f"{LAYER_LABELS['base']}不存在: {params.base_img_path}")
+        renderer.get_template()
+        settings = settings_fingerprint(params, renderer.layers)
+        self.renderer = renderer
+        self.manifest = ExportManifest(self.output_dir, settings, params.output_format, self.input_dir)
+        self._done.clear()
+        logger.info("已加载配置，开始监视 %s", self.input_dir)
+
+    def _config_changed(self):
+        return self.config_path is not None and file_signature(self.config_path) != self._config_signature
+
+    def scan(self):
+        """扫描一次，返回已经写完、需要检查的图片"""
+        now = time.monotonic()
+        ready = []
+        present = set()
+        for path in scan_images(self.input_dir, self.recursive, output_dir=self.output_dir):
+            present.add(path)
+            signature = file_signature(path)
+            if signature is None or self._done.get(path) == signature:
+                continue
+            pending = self._pending.get(path)
+            if pending is None or pending[0] != signature:
+                # 新文件或仍在写入，等下一次扫描再确认
+                self._pending[path] = (signature, now)
+            elif now - pending[1] >= self.settle:
+                ready.append(path)
+
+        # 已经删除的文件不再记录
+        for records in (self._pending, self._done):
+            for path in [p for p in records if p not in present]:
+                del records[path]
+        return ready
+
+    def process(self, paths):
+        """处理已经写完的图片（内容和设置都没有变化的直接跳过）"""
+        to_render, skipped = self.manifest.plan(paths)
+        for path in skipped:
+            self._finish(path, None, None)
+        for path in to_render:
+            start = time.perf_counter()
+            try:
+                output_path = self.renderer.render_to_dir(path, self.output_dir, self.input_dir)
+            except Exception as e:
+                logger.warning("处理失败: %s: %s", path, e)
+                self._finish(path, None, str(e))
+                continue
+            self.manifest.mark_done(path)
+            logger.info("已处理 %s（%.2f 秒）", path, time.perf_counter() - start)
+            self._finish(path, output_path, None)
+        if to_render:
+            self.manifest.save()
+
+    def _finish(self, path, output_path, error):
+        """记录已处理的文件签名（处理失败的文件在下次修改后重试）"""
+        pending = self._pending.pop(path, None)
+        if pending is not None:
+            self._done[path] = pending[0]
+        if self.on_result is not None:
+            self.on_result(path, output_path, error)
+
+    def run(self, stop_event=None):
+        """持续监视，直到stop_event被设置（或按Ctrl+C）"""
+        while stop_event is None or not stop_event.is_set():
+            start = time.monotonic()
+            if self._config_changed():
+                try:
+                    self.reload()
+                except (OSError, ValueError) as e:
+                    logger.error("重新加载配置失败，继续使用之前的配置: %s", e)
+                    self._config_signature = file_signature(self.config_path)
+            ready = self.scan()
+            if ready:
+                self.process(ready)
+            elapsed = time.monotonic() - start
+            time.sleep(max(0.0, self.interval - elapsed))
@@ -0,0 +1,54 @@
+"""测试的公共设置：各模块位于仓库根目录；小尺寸的模板图层和源图片"""
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+# 仓库根目录
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from pic_engine import RenderParams  # noqa: E402
+
+# 底图与背景覆盖图的尺寸（标题和顶层图片更小，只覆盖左上角）
+CANVAS_SIZE = (96, 72)
+
+
+def make_source(path, size=(120, 90), shade=0):
+    """渐变的RGB源图片（shade不同时内容不同）"""
+    vertical = Image.linear_gradient('L').resize(size)
+    horizontal = Image.linear_gradient('L').rotate(90).resize(size)
+    Image.merge('RGB', (vertical, horizontal, Image.new('L', size, shade))).save(path)
+    return str(path)
+
+
+@pytest.fixture
+def layer_paths(tmp_path):
+    """模板图层文件：不透明底图、半透明的标题/背景覆盖图/顶层图片，返回 {配置字段: 路径}"""
+    paths = {}
+    for name, color in (('base', (200, 180, 160, 255)), ('title', (20, 40, 60, 200)),
+                        ('overlay', (90, 30, 150, 120)), ('top', (250, 250, 0, 180))):
+        size = CANVAS_SIZE if name in ('base', 'overlay') else (40, 16)
+        path = str(tmp_path / f'{name}.png')
+        Image.new('RGBA', size, color).save(path)
+        paths[f'{name}_img_path'] = path
+    return paths
+
+
+def make_params(layer_paths, **kwargs):
+    """使用测试图层的参数，默认导出为PNG，kwargs覆盖其他字段"""
+    return RenderParams(**{'output_format': 'png', **layer_paths, **kwargs})
+
+
+@pytest.fixture
+def params(layer_paths):
+    return make_params(layer_paths)
+
+
+@pytest.fixture
+def source_images(tmp_path):
+    """四张内容不同的源图片"""
+    folder = tmp_path / 'src'
+    folder.mkdir()
+    return [make_source(folder / f'src{i}.png', shade=60 * i) for i in range(4)]
@@ -0,0 +1,118 @@
+import os
+import threading
+
+from PIL import Image
+
+from conftest import make_params, make_source
+from pic_batch import run_parallel, run_pipeline
+from pic_engine import Renderer, load_layers
+
+
+def test_pipeline_renders_like_renderer(params, source_images, tmp_path):
+    """流水线的结果与逐张渲染相同，每张图片报告一次进度，损坏的图片报告为失败"""
+    bad = tmp_path / 'src' / 'bad.png'
+    bad.write_bytes(b'not an image')
+    img_paths = source_images + [str(bad)]
+    output_dir = str(tmp_path / 'out')
+    os.makedirs(output_dir)
+    reports = []
+    succeeded, failed, cancelled = run_pipeline(
+        params, load_layers(params), img_paths, output_dir,
+        on_result=lambda *args: reports.append(args), prefetch=1, writers=2)
+
+    assert (succeeded, cancelled) == (4, False)
+    assert [path for path, _ in failed] == [str(bad)]
+    assert sorted(finished for finished, *_ in reports) == [1, 2, 3, 4, 5]
+    assert {total for _, total, *_ in reports} == {5}
+
+    renderer = Renderer(params)
+    for img_path in source_images:
+        output_path = os.path.join(output_dir, 'processed_' + os.path.basename(img_path))
+        assert os.path.exists(output_path)
+        expected = renderer.render(img_path)
+        with Image.open(output_path) as img:
+            assert img.mode == expected.mode and img.tobytes() == expected.tobytes()
+
+
+def test_pipeline_cancel(params, tmp_path):
+    """取消后不再读取新的图片，已经开始的图片处理完后返回"""
+    folder = tmp_path / 'many'
+    folder.mkdir()
+    img_paths = [make_source(folder / f'{i:02d}.png', shade=i * 10) for i in range(20)]
+    output_dir = str(tmp_path / 'out')
+    os.makedirs(output_dir)
+    cancel = threading.Event()
+    reports = []
+
+    def on_result(finished, total, img_path, output_path, error):
+        reports.append(output_path)
+        cancel.set()
+
+    succeeded, failed, cancelled = run_pipeline(params, load_layers(params), img_paths, output_dir,
+                                                on_result=on_result, cancel_event=cancel, prefetch=1, writers=1)
+    assert cancelled and failed == []
+    assert 1 <= succeeded == len(reports) < len(img_paths)
+    assert sorted(os.listdir(output_dir)) == sorted(os.path.basename(path) for path in reports)
+
+
+def test_parallel_matches_pipeline(params, source_images, tmp_path):
+    """多进程导出的结果与流水线相同，损坏的图片报告为失败，不影响其他图片"""
+    bad = tmp_path / 'src' / 'bad.png'
+    bad.write_bytes(b'not an image')
+    img_paths = source_images + [str(bad)]
+    layers = load_layers(params)
+    outputs = {}
+    for name, run in (('pipeline', run_pipeline), ('parallel', run_parallel)):
+        output_dir = str(tmp_path / name)
+        os.makedirs(output_dir)
+        reports = []
+        kwargs = {'workers': 2} if run is run_parallel else {}
+        succeeded, failed, cancelled = run(params, layers, img_paths, output_dir,
+                                           on_result=lambda *args: reports.append(args), **kwargs)
+        assert (succeeded, cancelled) == (4, False)
+        assert [path for path, _ in failed] == [str(bad)]
+        assert [finished for finished, *_ in reports] == [1, 2, 3, 4, 5]
+        outputs[name] = {}
+        for filename in os.listdir(output_dir):
+            with Image.open(os.path.join(output_dir, filename)) as img:
+                outputs[name][filename] = img.tobytes()
+    assert len(outputs['parallel']) == 4
+    assert outputs['parallel'] == outputs['pipeline']
+
+
+def test_parallel_cancel(params, tmp_path):
+    """取消后不再提交新的任务，在途的任务完成后返回"""
+    folder = tmp_path / 'many'
+    folder.mkdir()
+    img_paths = [make_source(folder / f'{i:02d}.png', shade=i * 5) for i in range(40)]
+    output_dir = str(tmp_path / 'out')
+    os.makedirs(output_dir)
+    cancel = threading.Event()
+
+    def on_result(finished, total, img_path, output_path, error):
+        cancel.set()
+
+    succeeded, failed, cancelled = run_parallel(params, load_layers(params), img_paths, output_dir, workers=2,
+                                                on_result=on_result, cancel_event=cancel)
+    assert cancelled and failed == []
+    # 最多还有每个进程两个在途的任务
+    assert 1 <= succeeded <= 4
+    assert len(os.listdir(output_dir)) == succeeded
+
+
+def test_missing_base_fails_in_both_modes(layer_paths, source_images, tmp_path):
+    """底图不存在时两种方式都把每张图片报告为失败，不产生输出文件"""
+    params = make_params(layer_paths, base_img_path=str(tmp_path / 'missing.png'))
+    layers = load_layers(params)
+    assert 'base' not in layers
+    results = {}
+    for name, run in (('pipeline', run_pipeline), ('parallel', run_parallel)):
+        output_dir = str(tmp_path / name)
+        os.makedirs(output_dir)
+        kwargs = {'workers': 2} if run is run_parallel else {}
+        succeeded, failed, cancelled = run(params, layers, source_images, output_dir, **kwargs)
+        assert os.listdir(output_dir) == []
+        results[name] = (succeeded, sorted(failed), cancelled)
+    assert results['pipeline'] == results['parallel']
+    assert results['parallel'][0] == 0
+    assert [path for path, _ in results['parallel'][1]] == sorted(source_images)
@@ -0,0 +1,31 @@
+import json
+
+from pic_bench import main, photo_like
+
+
+def test_bench_times_engine_stages_and_both_batch_modes(tmp_path, capsys):
+    """阶段耗时来自引擎的性能统计；-j与--pipeline同时指定时两种批量导出都测试"""
+    output = str(tmp_path / 'bench.json')
+    assert main(['--count', '2', '--repeat', '1', '--size', '200x150', '--canvas', '160x90',
+                 '-j', '2', '--pipeline', '-o', output]) == 0
+    with open(output, encoding='utf-8') as f:
+        results = json.load(f)
+    assert {'decode', 'fit_resize', 'scale_resize', 'composite_user', 'encode'} <= set(results['stages'])
+    assert results['stages']['decode']['count'] == 2
+    assert [(run['mode'], run['workers']) for run in results['throughput']['batch']] == [
+        ('pipeline', 1), ('parallel', 2)]
+    assert "单进程流水线" in capsys.readouterr().out
+
+    # 一次重采样时计时的是fused_resample，不再有两次缩放
+    assert main(['--count', '1', '--repeat', '1', '--size', '200x150', '--canvas', '160x90',
+                 '--fused-resample', '-o', output]) == 0
+    with open(output, encoding='utf-8') as f:
+        stages = json.load(f)['stages']
+    assert 'fused_resample' in stages and 'fit_resize' not in stages
+
+
+def test_photo_like_is_reproducible():
+    """相同的种子生成完全相同的输入图片，不同的种子结果不同"""
+    first = photo_like((120, 80), 3)
+    assert first.tobytes() == photo_like((120, 80), 3).tobytes()
+    assert first.tobytes() != photo_like((120, 80), 4).tobytes()
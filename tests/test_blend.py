@@ -0,0 +1,113 @@
+import os
+
+import pytest
+from PIL import Image, ImageChops
+
+from pic_blend import OverlayBlend, load_numpy
+
+np = load_numpy()
+needs_numpy = pytest.mark.skipif(np is None, reason="需要NumPy")
+use_numpy_modes = pytest.mark.parametrize('use_numpy', [pytest.param(True, marks=needs_numpy), False])
+
+
+def random_image(rng, size, mode='RGBA'):
+    data = rng.integers(0, 256, (size[1], size[0], 4), dtype=np.uint8)
+    return Image.fromarray(data, 'RGBA').convert(mode)
+
+
+def noise_image(size):
+    """内容随机的RGBA图片（不需要NumPy）"""
+    return Image.frombytes('RGBA', size, os.urandom(size[0] * size[1] * 4))
+
+
+def legacy_overlay(result, overlay, position):
+    """旧版本的背景覆盖图处理：按自身透明度粘贴到透明图层上，逐通道正片叠底后以0.7混合"""
+    overlay_layer = Image.new("RGBA", result.size, (0, 0, 0, 0))
+    overlay_layer.paste(overlay, position, overlay)
+    r, g, b, a = overlay_layer.split()
+    r2, g2, b2, a2 = result.split()
+    r3 = ImageChops.multiply(r, r2)
+    g3 = ImageChops.multiply(g, g2)
+    b3 = ImageChops.multiply(b, b2)
+    r_final = Image.blend(r2, r3, 0.7)
+    g_final = Image.blend(g2, g3, 0.7)
+    b_final = Image.blend(b2, b3, 0.7)
+    return Image.merge("RGBA", (r_final, g_final, b_final, a2))
+
+
+def compat_layer(size, overlay, position):
+    """兼容模式的覆盖图层（与模板构建时相同）"""
+    layer = Image.new("RGBA", size, (0, 0, 0, 0))
+    layer.paste(overlay, position, overlay)
+    return layer
+
+
+@use_numpy_modes
+@pytest.mark.parametrize('mode', ['RGBA', 'RGB'])
+def test_compat_mode_matches_legacy(use_numpy, mode):
+    """兼容模式与旧版本的split/multiply/blend/merge流程逐像素相同（覆盖图以外的区域同样被压暗）"""
+    canvas = noise_image((150, 100))
+    if mode == 'RGB':
+        canvas.putalpha(255)
+    overlay = noise_image((90, 60))
+    position = (37, 21)
+    expected = legacy_overlay(canvas, overlay, position).convert(mode)
+
+    result = canvas.convert(mode)
+    OverlayBlend(compat_layer(canvas.size, overlay, position), False,
+                 use_numpy=use_numpy, mode=mode).apply_inplace(result)
+    assert result.tobytes() == expected.tobytes()
+
+
+@use_numpy_modes
+def test_alpha_mode_respects_transparency(use_numpy):
+    """透明度模式下覆盖图透明的像素保持不变，完全不透明的像素与旧版本的混合相同"""
+    canvas = noise_image((80, 60))
+    overlay = noise_image((80, 60))
+    alpha = Image.new('L', (80, 60), 0)
+    alpha.paste(255, (40, 0, 80, 60))
+    overlay.putalpha(alpha)
+
+    result = canvas.copy()
+    OverlayBlend(overlay, True, use_numpy=use_numpy).apply_inplace(result)
+
+    left, right = (0, 0, 40, 60), (40, 0, 80, 60)
+    assert result.crop(left).tobytes() == canvas.crop(left).tobytes()
+    assert result.crop(right).tobytes() == legacy_overlay(canvas, overlay, (0, 0)).crop(right).tobytes()
+
+
+@needs_numpy
+@pytest.mark.parametrize('alpha_mode', [False, True])
+@pytest.mark.parametrize('mode', ['RGBA', 'RGB'])
+def test_numpy_matches_pil(alpha_mode, mode):
+    """NumPy与PIL两种实现的结果逐像素相同（与是否安装NumPy无关）"""
+    rng = np.random.default_rng(5)
+    canvas = random_image(rng, (300, 200), mode)
+    overlay = random_image(rng, (300, 200))
+
+    with_numpy = canvas.copy()
+    OverlayBlend(overlay, alpha_mode, use_numpy=True, mode=mode).apply_inplace(with_numpy)
+    with_pil = canvas.copy()
+    OverlayBlend(overlay, alpha_mode, use_numpy=False, mode=mode).apply_inplace(with_pil)
+
+    assert np.array_equal(np.asarray(with_numpy), np.asarray(with_pil))
+
+
+@needs_numpy
+def test_every_alpha_value():
+    """透明度模式下每个透明度、原值、覆盖值的组合都与PIL一致"""
+    values = np.arange(256, dtype=np.uint8)
+    base, over = np.meshgrid(values, values)
+    for alpha in range(0, 256, 5):
+        canvas = np.zeros((256, 256, 4), np.uint8)
+        canvas[..., 0], canvas[..., 3] = base, 255
+        overlay = np.zeros((256, 256, 4), np.uint8)
+        overlay[..., 0], overlay[..., 3] = over, alpha
+        canvas, overlay = Image.fromarray(canvas, 'RGBA'), Image.fromarray(overlay, 'RGBA')
+
+        results = []
+        for use_numpy in (True, False):
+            result = canvas.copy()
+            OverlayBlend(overlay, True, use_numpy=use_numpy).apply_inplace(result)
+            results.append(np.asarray(result))
+        assert np.array_equal(*results), alpha
@@ -0,0 +1,161 @@
+import os
+
+import pytest
+from PIL import Image
+
+import pic_cache
+from conftest import make_source
+from pic_cache import DiskImageCache, LRUCache, SourceImageCache
+from pic_engine import RenderParams
+
+
+@pytest.fixture
+def decode_calls(monkeypatch):
+    """记录实际解码的图片路径"""
+    calls = []
+    decode_and_fit = pic_cache.decode_and_fit
+
+    def counting(img_path, *args):
+        calls.append(img_path)
+        return decode_and_fit(img_path, *args)
+
+    monkeypatch.setattr(pic_cache, 'decode_and_fit', counting)
+    return calls
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(100)
+    cache.put('a', 'A', 40)
+    cache.put('b', 'B', 40)
+    assert cache.get('a') == 'A'  # a变为最近使用
+    cache.put('c', 'C', 40)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == ('A', 'C')
+    assert cache.stats()['evictions'] == 1 and cache.current_bytes == 80
+
+    # 替换已有的项时重新计算大小；超过整个容量的项不缓存
+    cache.put('a', 'A2', 10)
+    assert cache.current_bytes == 50
+    cache.put('huge', 'H', 101)
+    assert cache.get('huge') is None and len(cache) == 2
+
+
+def test_crop_change_reuses_fitted_image(tmp_path, decode_calls):
+    """只修改裁剪参数时不重新解码"""
+    path = make_source(tmp_path / 'a.png')
+    cache = SourceImageCache()
+    params = RenderParams()
+    first = cache.get(path, 60, params)
+    assert cache.get(path, 60, params) is first
+
+    cropped = cache.get(path, 60, params.replace(crop_top_percent=30))
+    assert cropped.height < first.height
+    assert decode_calls == [path]
+
+    # 底图宽度不同时重新解码
+    assert cache.get_fitted(path, 40).width == 40
+    assert decode_calls == [path, path]
+
+
+@pytest.mark.parametrize('crops, misses', [
+    (dict(crop_top_percent=0, crop_bottom_percent=0, crop_right_percent=0), 1),
+    (dict(crop_top_percent=100, crop_bottom_percent=0, crop_right_percent=0, use_corner_crop=True,
+          crop_corner_size=0), 1),
+    ({}, 2),
+])
+def test_hits_and_misses(tmp_path, decode_calls, crops, misses):
+    """没有裁剪时只查找调整宽度后的图片，再次获取时只记一次命中"""
+    path = make_source(tmp_path / 'a.png')
+    cache = SourceImageCache()
+    params = RenderParams(**crops)
+    first = cache.get(path, 60, params)
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (0, misses)
+    for _ in range(3):
+        assert cache.get(path, 60, params) is first
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (3, misses)
+    assert decode_calls == [path]
+    if misses == 1:
+        assert first is cache.get_fitted(path, 60, params.fast_decode)
+
+
+@pytest.mark.parametrize('change', ['mtime', 'size'])
+def test_modified_file_invalidates_cache(tmp_path, decode_calls, change):
+    path = make_source(tmp_path / 'a.png')
+    cache = SourceImageCache()
+    params = RenderParams(crop_top_percent=0, crop_bottom_percent=0, crop_right_percent=0)
+    before = cache.get(path, 60, params)
+
+    st = os.stat(path)
+    if change == 'mtime':
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    else:
+        make_source(path, (90, 90), shade=200)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    after = cache.get(path, 60, params)
+    assert after is not before
+    assert decode_calls == [path, path]
+    if change == 'size':
+        assert after.size == (60, 60)
+
+
+def test_memory_limit_evicts_old_images(tmp_path, decode_calls):
+    paths = [make_source(tmp_path / f'{i}.png') for i in range(3)]
+    params = RenderParams(crop_top_percent=0, crop_bottom_percent=0, crop_right_percent=0)
+    # 60x45的RGB图片每张约8KB，只放得下两张
+    cache = SourceImageCache(max_bytes=60 * 45 * 3 * 2)
+    for path in paths:
+        cache.get(path, 60, params)
+    cache.get(paths[0], 60, params)
+    assert decode_calls == paths + [paths[0]]
+    assert cache.stats()['entries'] == 2
+
+
+def test_disk_cache_survives_restart(tmp_path, decode_calls):
+    """调整宽度后的图片保存到磁盘，重新创建缓存（相当于重新启动程序）后不需要重新解码"""
+    path = make_source(tmp_path / 'a.png')
+    directory = str(tmp_path / 'cache')
+    params = RenderParams()
+    first = SourceImageCache(disk_cache=DiskImageCache(directory)).get(path, 60, params)
+
+    restarted = SourceImageCache(disk_cache=DiskImageCache(directory))
+    assert restarted.get(path, 60, params).tobytes() == first.tobytes()
+    assert decode_calls == [path]
+
+    # 源文件被修改后磁盘上的结果不再使用
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    SourceImageCache(disk_cache=DiskImageCache(directory)).get(path, 60, params)
+    assert decode_calls == [path, path]
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    image = Image.new('RGB', (20, 10), (1, 2, 3))
+    # 每个文件约600字节，只放得下两个
+    cache = DiskImageCache(str(tmp_path), max_bytes=1400)
+    cache.put('a', image)
+    cache.put('b', image)
+    # 文件系统的时间精度可能较粗，把最近使用时间设为明确的过去时间后重新打开
+    for age, key in ((200, 'a'), (100, 'b')):
+        path = tmp_path / DiskImageCache.filename(key)
+        os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns - age * 10 ** 9))
+    cache = DiskImageCache(str(tmp_path), max_bytes=1400)
+    assert cache.get('a').tobytes() == image.tobytes()  # a变为最近使用
+    cache.put('c', image)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert sorted(os.listdir(tmp_path)) == sorted(DiskImageCache.filename(k) for k in ('a', 'c'))
+    assert cache.stats()['bytes'] <= 1400
+
+
+def test_disk_cache_drops_damaged_and_temporary_files(tmp_path):
+    cache = DiskImageCache(str(tmp_path))
+    cache.put('a', Image.new('RGB', (20, 10)))
+    with open(tmp_path / DiskImageCache.filename('a'), 'wb') as f:
+        f.write(b'not a cache file')
+    assert cache.get('a') is None
+    assert cache.stats()['entries'] == 0
+
+    # 上次中断时留下的临时文件在启动时清理
+    (tmp_path / 'left.over.tmp').write_bytes(b'x')
+    DiskImageCache(str(tmp_path))
+    assert os.listdir(tmp_path) == []
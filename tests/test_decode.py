@@ -0,0 +1,61 @@
+import pytest
+from PIL import Image
+
+from conftest import make_source
+from pic_engine import REDUCING_GAP, decode_and_fit, reduce_on_load
+
+# 目标尺寸（约为源图片的1/8）
+TARGET = (200, 150)
+GAP_SIZE = (int(TARGET[0] * REDUCING_GAP), int(TARGET[1] * REDUCING_GAP))
+
+
+@pytest.fixture
+def large_jpeg(tmp_path):
+    path = tmp_path / 'large.jpg'
+    with Image.open(make_source(tmp_path / 'large.png', size=(1600, 1200))) as img:
+        img.save(path, quality=95)
+    return str(path)
+
+
+def test_jpeg_draft_keeps_gap(large_jpeg):
+    with Image.open(large_jpeg) as img:
+        reduced = reduce_on_load(img, TARGET)
+        assert reduced.size[0] < 1600
+        assert reduced.size[0] >= GAP_SIZE[0] and reduced.size[1] >= GAP_SIZE[1]
+
+
+def test_png_reduce_keeps_gap(tmp_path):
+    path = make_source(tmp_path / 'large.png', size=(1600, 1200))
+    with Image.open(path) as img:
+        reduced = reduce_on_load(img, TARGET)
+        assert reduced.size[0] < 1600
+        assert reduced.size[0] >= GAP_SIZE[0] and reduced.size[1] >= GAP_SIZE[1]
+
+
+def test_palette_and_small_images_decode_normally(tmp_path):
+    """不支持reduce的模式和不够大的图片按原尺寸解码"""
+    palette = str(tmp_path / 'palette.png')
+    with Image.open(make_source(tmp_path / 'rgb.png', size=(1600, 1200))) as img:
+        img.convert('P').save(palette)
+    with Image.open(palette) as img:
+        assert reduce_on_load(img, TARGET).size == (1600, 1200)
+
+    small = make_source(tmp_path / 'small.png', size=(250, 180))
+    with Image.open(small) as img:
+        assert reduce_on_load(img, TARGET).size == (250, 180)
+
+
+@pytest.mark.parametrize('name', ['large.jpg', 'large.png'])
+def test_disabled_fast_decode_matches_legacy(large_jpeg, tmp_path, name):
+    """关闭快速解码时与旧版本（转换为RGBA后整张缩放到底图宽度）逐像素相同"""
+    path = str(tmp_path / name)
+    with Image.open(path) as img:
+        legacy = img.convert('RGBA')
+    legacy = legacy.resize((TARGET[0], int(legacy.height * (TARGET[0] / float(legacy.width)))), Image.LANCZOS)
+
+    result = decode_and_fit(path, TARGET[0], fast_decode=False)
+    assert result.size == legacy.size
+    assert result.convert('RGBA').tobytes() == legacy.tobytes()
+
+    # 快速解码的尺寸相同，只有重采样误差
+    assert decode_and_fit(path, TARGET[0], fast_decode=True).size == legacy.size
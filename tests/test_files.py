@@ -0,0 +1,100 @@
+import os
+import threading
+
+from PIL import Image
+
+import pic_files
+from conftest import make_source
+from pic_files import ImageInfoCache, ImageList, exclude_outputs, scan_images
+
+
+def make_tree(tmp_path):
+    """包含子文件夹、非图片文件和大小写不同的扩展名的文件夹"""
+    root = tmp_path / 'deck'
+    for folder in ('', 'b_unit', 'A_unit', 'A_unit/inner', 'out'):
+        (root / folder).mkdir(parents=True, exist_ok=True)
+    for name in ('b.png', 'a.JPG', 'c.jpeg', 'notes.txt', 'd.gif',
+                 'b_unit/01.png', 'A_unit/02.png', 'A_unit/inner/03.jpg', 'out/processed_b.png'):
+        (root / name).write_bytes(b'')
+    return root
+
+
+def test_scan_order_and_extensions(tmp_path):
+    """当前文件夹的图片在前，子文件夹按名称（不区分大小写）顺序，只包括支持的扩展名"""
+    root = make_tree(tmp_path)
+    expected = ['a.JPG', 'b.png', 'c.jpeg', 'A_unit/02.png', 'A_unit/inner/03.jpg',
+                'b_unit/01.png', 'out/processed_b.png']
+    assert list(scan_images(str(root))) == [os.path.join(str(root), *name.split('/')) for name in expected]
+    assert list(scan_images(str(root), recursive=False)) == [
+        os.path.join(str(root), name) for name in ('a.JPG', 'b.png', 'c.jpeg')]
+
+
+def test_scan_excludes_output_dir(tmp_path):
+    root = make_tree(tmp_path)
+    paths = list(scan_images(str(root), exclude={os.path.realpath(str(root / 'out'))}))
+    assert len(paths) == 6
+    assert not any('processed_' in path for path in paths)
+
+
+def test_scan_skips_outputs(tmp_path):
+    """输出目录在输入文件夹中时不进入输出目录；输出目录就是输入文件夹时跳过导出的文件名"""
+    root = make_tree(tmp_path)
+    (root / 'processed_a.png').write_bytes(b'')
+    all_paths = list(scan_images(str(root)))
+    nested = list(scan_images(str(root), output_dir=str(root / 'out')))
+    assert nested == [path for path in all_paths if 'processed_' not in path]
+    assert exclude_outputs(all_paths, str(root), str(root / 'out')) == nested
+    assert list(scan_images(str(root), recursive=False, output_dir=str(root))) == [
+        os.path.join(str(root), name) for name in ('a.JPG', 'b.png', 'c.jpeg')]
+    # 输出目录在别处时不跳过任何图片
+    assert list(scan_images(str(root), output_dir=str(tmp_path / 'elsewhere'))) == all_paths
+
+    images = ImageList.from_directory(str(root))
+    images.wait()
+    assert images.without_outputs(str(root / 'out')) == nested
+
+
+def test_background_scan_completes(tmp_path):
+    root = make_tree(tmp_path)
+    images = ImageList.from_directory(str(root))
+    images.wait()
+    assert images.complete
+    assert images.root == str(root)
+    assert list(images) == list(scan_images(str(root)))
+    assert images[0] == os.path.join(str(root), 'a.JPG')
+    assert len(images) == 7
+
+
+def test_cancel_stops_scan(tmp_path, monkeypatch):
+    """取消后不再加入新的图片，查找线程结束"""
+    release = threading.Event()
+
+    def slow_scan(directory, recursive=True, exclude=()):
+        yield 'first.png'
+        release.wait()
+        for i in range(1000):
+            yield f'{i}.png'
+
+    monkeypatch.setattr(pic_files, 'scan_images', slow_scan)
+    images = ImageList.from_directory(str(tmp_path))
+    assert not images.complete
+    images.cancel()
+    release.set()
+    images.wait()
+    assert images.complete
+    assert len(images) == 0
+
+
+def test_info_cache_evicts_least_recent(tmp_path):
+    paths = [make_source(tmp_path / f'{i}.png', size=(10 + i, 8)) for i in range(3)]
+    cache = ImageInfoCache(max_entries=2)
+    assert cache.get(paths[0]) == {'format': 'PNG', 'size': (10, 8), 'mode': 'RGB'}
+    cache.get(paths[1])
+    cache.get(paths[0])  # 最近使用过，保留
+    cache.get(paths[2])
+    assert [key[0] for key in cache._items] == [paths[0], paths[2]]
+
+    # 文件变化后重新读取
+    Image.new('L', (30, 20)).save(paths[0])
+    assert cache.get(paths[0])['size'] == (30, 20)
+    assert len(cache._items) == 2
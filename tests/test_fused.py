@@ -0,0 +1,59 @@
+import random
+
+import pytest
+from PIL import Image, ImageChops, ImageStat
+
+from pic_engine import RenderParams, Renderer
+
+
+@pytest.fixture
+def translucent_source(tmp_path):
+    """平滑渐变的半透明RGBA源图片（透明度从左到右逐渐增加）"""
+    source = Image.new('RGBA', (400, 300))
+    source.putdata([(x * 255 // 400, y * 255 // 300, (x + y) * 255 // 700, 60 + x * 150 // 400)
+                    for y in range(300) for x in range(400)])
+    source_path = str(tmp_path / 'src.png')
+    source.save(source_path)
+    base_path = str(tmp_path / 'base.png')
+    Image.new('RGBA', (500, 400), (230, 220, 210, 255)).save(base_path)
+    return source_path, base_path
+
+
+@pytest.mark.parametrize('scale_factor, max_mean', [(100, 0.01), (140, 0.1), (60, 0.1)])
+def test_fused_corner_crop_matches_legacy(translucent_source, scale_factor, max_mean):
+    """裁剪右上角时，半透明的源图片与旧流程一样按自身透明度再乘一次"""
+    source_path, base_path = translucent_source
+    config = dict(base_img_path=base_path, use_title_img=False, use_overlay_img=False, use_top_img=False,
+                  use_corner_crop=True, scale_factor=scale_factor)
+    legacy = Renderer(RenderParams(**config)).render(source_path)
+    fused = Renderer(RenderParams(fused_resample=True, **config)).render(source_path)
+
+    diff = ImageChops.difference(legacy, fused)
+    assert max(ImageStat.Stat(diff).mean) < max_mean
+    if scale_factor == 100:
+        # 不需要第二次缩放时只有取整误差
+        assert max(high for _, high in diff.getextrema()) <= 1
+
+
+@pytest.mark.parametrize('scale_factor, max_mean', [(100, 0.05), (60, 1.0), (300, 6.0)])
+def test_fused_deviation_is_bounded(tmp_path, scale_factor, max_mean):
+    """细节最多的源图片（逐像素随机的RGBA）放在半透明底图上时，两种流程的差异仍在预期范围内
+
+    一次重采样没有中间结果的取整和两次LANCZOS的叠加，放大时差异最大（见RenderParams.DEFAULTS）。
+    """
+    rng = random.Random(7)
+    source_path = str(tmp_path / 'noise.png')
+    Image.frombytes('RGBA', (400, 300), rng.getrandbits(400 * 300 * 32).to_bytes(400 * 300 * 4, 'little')).save(
+        source_path)
+    base_path = str(tmp_path / 'base.png')
+    Image.new('RGBA', (500, 400), (230, 220, 210, 128)).save(base_path)
+    config = dict(base_img_path=base_path, use_title_img=False, use_overlay_img=False, use_top_img=False,
+                  scale_factor=scale_factor)
+    legacy = Renderer(RenderParams(**config)).render(source_path)
+    fused = Renderer(RenderParams(fused_resample=True, **config)).render(source_path)
+
+    assert legacy.size == fused.size and legacy.mode == fused.mode == 'RGBA'
+    diff = ImageChops.difference(legacy, fused)
+    assert max(ImageStat.Stat(diff).mean) < max_mean
+    if scale_factor == 100:
+        assert max(high for _, high in diff.getextrema()) <= 3
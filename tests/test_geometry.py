@@ -0,0 +1,68 @@
+import pytest
+
+from pic_engine import RenderParams
+from pic_geometry import GeometryPlan
+
+# 源图片400x300，缩放到底图宽度200后为200x150（比例为1/2）
+SOURCE = (400, 300)
+CANVAS = (200, 150)
+NO_CROP = dict(crop_top_percent=0.0, crop_bottom_percent=0.0, crop_right_percent=0.0)
+
+
+def make_plan(**kwargs):
+    return GeometryPlan(SOURCE, CANVAS[0], RenderParams(**{**NO_CROP, **kwargs}), CANVAS)
+
+
+@pytest.mark.parametrize('kwargs, position, visible, source_box, decode_target', [
+    # 100%，正好铺满画布
+    ({}, (0, 0), (0, 0, 200, 150), (0, 0, 400, 300), (200, 150)),
+    # 负偏移：左上部分在画布外
+    (dict(x_offset=-50, y_offset=-30), (-50, -30), (50, 30, 200, 150), (100, 60, 400, 300), (200, 150)),
+    # 缩小到50%，居中后整张可见
+    (dict(scale_factor=50.0), (50, 37), (0, 0, 100, 75), (0, 0, 400, 300), (100, 75)),
+    # 放大到200%，只有中间部分可见
+    (dict(scale_factor=200.0), (-100, -75), (100, 75, 300, 225), (100, 75, 300, 225), (400, 300)),
+    # 放大并向右下偏移
+    (dict(scale_factor=200.0, x_offset=120, y_offset=100), (20, 25), (0, 0, 180, 125), (0, 0, 180, 125),
+     (400, 300)),
+])
+def test_plan_coordinates(kwargs, position, visible, source_box, decode_target):
+    plan = make_plan(**kwargs)
+    assert plan.position == position
+    assert plan.visible == visible
+    assert plan.source_box() == pytest.approx(source_box)
+    assert plan.decode_target() == decode_target
+    # 解码时已经缩小一半，坐标按比例换算
+    assert plan.source_box((200, 150)) == pytest.approx([v / 2 for v in source_box])
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(x_offset=200), dict(x_offset=-200), dict(y_offset=150), dict(y_offset=-150),
+    dict(scale_factor=50.0, x_offset=-150), dict(scale_factor=300.0, y_offset=400),
+])
+def test_plan_off_canvas(kwargs):
+    """完全落在画布以外时visible为None，但仍能得到完整尺寸和位置"""
+    plan = make_plan(**kwargs)
+    assert plan.visible is None
+    assert plan.corner is None
+    assert plan.size == make_plan(scale_factor=kwargs.get('scale_factor', 100.0)).size
+
+
+def test_plan_edge_crops():
+    """裁剪后的区域与依次裁剪上方、底部、右侧相同，源图片区域从裁剪后的左上角开始"""
+    plan = make_plan(crop_top_percent=10.0, crop_bottom_percent=10.0, crop_right_percent=10.0)
+    # 200x150 -> 上方裁剪15，底部裁剪剩余135的10%（保留121），右侧保留180
+    assert plan.size == (180, 121)
+    assert plan.position == (10, 14)
+    assert plan.visible == (0, 0, 180, 121)
+    assert plan.source_box() == pytest.approx((0, 30, 360, 272))
+
+
+def test_plan_corner_crop():
+    plan = make_plan(use_corner_crop=True, crop_corner_size=20.0, x_offset=-20)
+    assert plan.corner_crop
+    # 正方形边长为40，旧流程画出的矩形包含右下边界
+    assert plan.corner == (140, 0, 180, 41)
+    # 右上角不在可见部分中时不需要画，但仍按自身透明度处理
+    hidden = make_plan(use_corner_crop=True, crop_corner_size=20.0, x_offset=180)
+    assert hidden.corner is None and hidden.corner_crop
@@ -0,0 +1,70 @@
+import random
+
+import pytest
+from PIL import ImageChops
+
+from pic_engine import IncrementalRenderer, RenderParams, Renderer, render_card
+
+
+@pytest.fixture(params=[False, True], ids=['multiply', 'alpha_blend'])
+def setup(request, layer_paths, source_images):
+    """(参数, 模板, 已调整宽度的用户图片)"""
+    params = RenderParams(overlay_alpha_blend=request.param, **layer_paths)
+    renderer = Renderer(params)
+    return params, renderer.get_template(), renderer.load(source_images[1])
+
+
+def test_dirty_rect_matches_full_render(setup):
+    """随机修改偏移量和放大比例，增量合成的结果与完整合成完全相同，且只有dirty区域变化"""
+    params, template, user_img = setup
+    incremental = IncrementalRenderer()
+    rng = random.Random(7)
+    previous = None
+    for _ in range(30):
+        step = params.replace(x_offset=rng.randint(-120, 120), y_offset=rng.randint(-120, 120),
+                              scale_factor=rng.choice([100, 100, 80, 150]))
+        frame = incremental.render('card', user_img, template, step)
+        full = render_card(user_img, template, step)
+        assert frame.image.mode == full.mode and frame.image.tobytes() == full.tobytes()
+
+        if previous is None:
+            assert frame.base is None
+        else:
+            assert frame.base is previous
+            changed = ImageChops.difference(previous.convert('RGB'), frame.image.convert('RGB')).getbbox()
+            if frame.dirty is None:
+                assert changed is None
+            elif changed is not None:
+                left, top, right, bottom = frame.dirty
+                assert left <= changed[0] and top <= changed[1]
+                assert changed[2] <= right and changed[3] <= bottom
+        previous = frame.image
+
+
+def test_small_move_only_redraws_user_area(setup):
+    params, template, user_img = setup
+    incremental = IncrementalRenderer()
+    small = params.replace(scale_factor=40)
+    first = incremental.render('card', user_img, template, small)
+    frame = incremental.render('card', user_img, template, small.replace(x_offset=small.x_offset + 3))
+    left, top, right, bottom = frame.dirty
+    assert (right - left) * (bottom - top) < template.size[0] * template.size[1] / 2
+    # 结果是新的图片，上一次的结果没有被修改
+    assert frame.image is not first.image and frame.base is first.image
+
+    # 参数没有变化时直接沿用上一次的结果
+    same = incremental.render('card', user_img, template, small.replace(x_offset=small.x_offset + 3))
+    assert same.image is frame.image and same.dirty is None
+
+
+def test_new_source_or_template_renders_full_frame(setup):
+    params, template, user_img = setup
+    incremental = IncrementalRenderer(max_entries=1)
+    incremental.render('card', user_img, template, params)
+    assert incremental.render('card', user_img.copy(), template, params).base is None
+    assert incremental.render('card', user_img, Renderer(params).get_template(), params).base is None
+    # 超过数量上限的图片不再保留
+    incremental.render('card', user_img, template, params)
+    assert incremental.render('card', user_img, template, params).base is not None
+    incremental.render('other', user_img, template, params)
+    assert incremental.render('card', user_img, template, params).base is None
@@ -0,0 +1,75 @@
+import os
+import shutil
+
+import pytest
+from PIL import Image
+
+from conftest import make_source
+from pic_batch import run_batch
+from pic_engine import load_layers
+
+
+@pytest.fixture
+def output_dir(tmp_path):
+    path = str(tmp_path / 'out')
+    os.makedirs(path)
+    return path
+
+
+@pytest.fixture
+def export(source_images, output_dir):
+    """增量导出source_images到output_dir，返回 (重新导出的图片, 跳过的图片)"""
+    def run(params):
+        rendered = []
+        succeeded, failed, _, skipped = run_batch(
+            params, load_layers(params), source_images, output_dir, workers=1,
+            on_result=lambda finished, total, img_path, output_path, error: rendered.append(img_path),
+            incremental=True)
+        assert failed == [] and succeeded == len(rendered)
+        return sorted(rendered), skipped
+    return run
+
+
+def test_unchanged_images_are_skipped(export, params, source_images):
+    assert export(params) == (source_images, [])
+    assert export(params) == ([], source_images)
+
+    # 只有修改时间变化、内容不变时仍然跳过
+    st = os.stat(source_images[0])
+    os.utime(source_images[0], ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert export(params) == ([], source_images)
+
+
+def test_changed_source_or_missing_output_is_rendered(export, params, source_images, output_dir):
+    export(params)
+    make_source(source_images[1], shade=255)
+    os.remove(os.path.join(output_dir, 'processed_src2.png'))
+    rendered, skipped = export(params)
+    assert rendered == [source_images[1], source_images[2]]
+    assert skipped == [source_images[0], source_images[3]]
+
+
+def test_changed_settings_render_everything(export, params, source_images):
+    export(params)
+    assert export(params.replace(scale_factor=90))[0] == source_images
+    assert export(params.replace(scale_factor=90, use_top_img=False))[0] == source_images
+
+
+def test_layer_content_not_path_is_fingerprinted(export, params, layer_paths, source_images, tmp_path):
+    export(params)
+    # 内容相同的图层换了位置仍然跳过
+    moved = str(tmp_path / 'moved_title.png')
+    shutil.copy(layer_paths['title_img_path'], moved)
+    assert export(params.replace(title_img_path=moved)) == ([], source_images)
+
+    # 图层内容变化后全部重新导出
+    Image.new('RGBA', (40, 16), (20, 40, 61, 200)).save(moved)
+    assert export(params.replace(title_img_path=moved))[0] == source_images
+
+
+def test_disabled_base_is_fingerprinted(export, params, layer_paths, source_images):
+    """底图未启用时仍决定画布大小，换了底图后全部重新导出"""
+    params = params.replace(use_base_img=False)
+    export(params)
+    Image.new('RGBA', (120, 80), (200, 180, 160, 255)).save(layer_paths['base_img_path'])
+    assert export(params)[0] == source_images
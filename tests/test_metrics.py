@@ -0,0 +1,110 @@
+import json
+
+import pytest
+from PIL import Image
+
+import pic_metrics
+from pic_metrics import Metrics
+
+
+@pytest.fixture
+def enabled():
+    """在测试期间启用全局统计"""
+    metrics = pic_metrics.enable()
+    yield metrics
+    pic_metrics.disable()
+
+
+def test_disabled_does_nothing():
+    assert pic_metrics.active() is None
+    with pic_metrics.stage('decode') as first, pic_metrics.stage('encode') as second:
+        pass
+    # 未启用时共享同一个空上下文管理器
+    assert first is second
+    pic_metrics.count('images_rendered')
+    pic_metrics.count_image(Image.new('RGB', (4, 4)))
+    assert pic_metrics.active() is None
+
+
+def test_enabled_records(enabled):
+    with pic_metrics.stage('decode'):
+        pass
+    with pic_metrics.stage('decode'):
+        pass
+    pic_metrics.count('images_rendered')
+    pic_metrics.count('images_rendered', 2)
+    pic_metrics.count_image(Image.new('RGBA', (4, 3)))
+    assert len(enabled.timings['decode']) == 2
+    assert enabled.counters == {'images_rendered': 3, 'bytes_allocated': 48}
+    assert pic_metrics.disable() is enabled
+    assert pic_metrics.stage('decode') is pic_metrics.stage('encode')
+
+
+def test_summary_and_table():
+    metrics = Metrics()
+    for ms in (5, 1, 3, 100):
+        metrics.record('encode', ms / 1000)
+    metrics.record('decode', 0.002)
+    metrics.count('images_saved', 4)
+
+    summary = metrics.summary()
+    encode = summary['stages']['encode']
+    assert encode['count'] == 4
+    assert encode['median_ms'] == 4
+    assert encode['total_ms'] == 109
+    assert encode['max_ms'] == 100
+    assert summary['stages']['decode']['median_ms'] == 2
+    assert summary['counters'] == {'images_saved': 4}
+
+    lines = metrics.format_table().splitlines()
+    # 按总耗时从高到低排列，计数器在最后
+    assert [line.split()[0] for line in lines[1:]] == ['encode', 'decode', 'images_saved']
+    assert lines[1].split()[1:] == ['4', '109.0', '4.00', '100.00']
+
+
+def test_max_samples_keeps_recent():
+    metrics = Metrics(max_samples=2)
+    for seconds in (0.1, 0.2, 0.3):
+        metrics.record('render', seconds)
+    assert list(metrics.timings['render']) == [0.2, 0.3]
+
+
+def test_jsonl_lines(tmp_path):
+    path = tmp_path / 'metrics.jsonl'
+    metrics = Metrics(str(path))
+    pic_metrics.enable(metrics)
+    try:
+        with pic_metrics.stage('decode'):
+            pass
+        with pic_metrics.stage('encode'):
+            pass
+        pic_metrics.count('images_saved')
+    finally:
+        pic_metrics.disable()
+    metrics.close()
+    metrics.close()  # 重复关闭不会再写入
+
+    lines = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    assert [(line['type'], line.get('name')) for line in lines] == [
+        ('stage', 'decode'), ('stage', 'encode'), ('summary', None)]
+    assert lines[-1]['counters'] == {'images_saved': 1}
+    assert set(lines[-1]['stages']) == {'decode', 'encode'}
+
+
+def test_drain_and_merge():
+    """工作进程的统计取出后清空，合并到主进程的统计中"""
+    worker = Metrics()
+    worker.record('decode', 0.01)
+    worker.record('decode', 0.03)
+    worker.count('images_rendered')
+    data = worker.drain()
+    assert worker.timings == {} and worker.counters == {}
+    assert data['timings'] == {'decode': [0.01, 0.03]}
+
+    main = Metrics()
+    main.record('decode', 0.02)
+    main.count('images_rendered', 2)
+    main.merge(data)
+    main.merge(worker.drain())  # 没有新数据时不影响结果
+    assert sorted(main.timings['decode']) == [0.01, 0.02, 0.03]
+    assert main.counters == {'images_rendered': 3}
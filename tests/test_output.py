@@ -0,0 +1,70 @@
+import os
+
+import pytest
+from PIL import Image
+
+from pic_engine import RenderParams
+from pic_output import JPEG_BACKGROUND, normalize_format, prepare_for_format, save_image
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('jpg', 'jpeg'), ('JPG', 'jpeg'), ('.jpeg', 'jpeg'), (' PNG ', 'png'), ('WebP', 'webp'), ('', ''), (None, ''),
+])
+def test_normalize_format(value, expected):
+    assert normalize_format(value) == expected
+
+
+def test_normalize_format_rejects_unknown():
+    with pytest.raises(ValueError):
+        normalize_format('gif')
+    assert RenderParams(output_format='JPG').output_format == 'jpeg'
+
+
+def gradient(mode='RGBA', alpha=255):
+    img = Image.linear_gradient('L').resize((64, 48))
+    bands = (img, img.rotate(90), Image.new('L', img.size, 80))
+    if mode == 'RGBA':
+        bands += (Image.new('L', img.size, alpha),)
+    return Image.merge(mode, bands)
+
+
+@pytest.mark.parametrize('output_format', ['jpeg', 'webp'])
+def test_quality_controls_lossy_size(tmp_path, output_format):
+    img = gradient()
+    sizes = []
+    for quality in (20, 95):
+        path = str(tmp_path / f'{quality}.{output_format}')
+        save_image(img, path, RenderParams(output_format=output_format, output_quality=quality))
+        with Image.open(path) as saved:
+            assert saved.format == output_format.upper()
+        sizes.append(os.path.getsize(path))
+    assert sizes[0] < sizes[1]
+
+
+@pytest.mark.parametrize('flatten_opaque, mode', [(True, 'RGB'), (False, 'RGBA')])
+def test_opaque_rgba_is_flattened(tmp_path, flatten_opaque, mode):
+    """完全不透明的RGBA按设置保存为RGB，像素不变"""
+    img = gradient()
+    path = str(tmp_path / 'out.png')
+    save_image(img, path, RenderParams(output_format='png', flatten_opaque=flatten_opaque))
+    with Image.open(path) as saved:
+        assert saved.mode == mode
+        assert saved.convert('RGBA').tobytes() == img.tobytes()
+
+
+def test_translucent_png_keeps_alpha():
+    img = gradient(alpha=128)
+    assert prepare_for_format(img, 'PNG') is img
+
+
+def test_jpeg_fills_transparency_with_background():
+    img = Image.new('RGBA', (4, 2), (10, 20, 30, 255))
+    img.putpixel((0, 0), (200, 0, 0, 0))
+    img.putpixel((1, 0), (0, 0, 0, 128))
+    result = prepare_for_format(img, 'JPEG')
+    assert result.mode == 'RGB'
+    assert result.getpixel((0, 0)) == JPEG_BACKGROUND
+    assert result.getpixel((1, 0)) == tuple(round(c * 127 / 255) for c in JPEG_BACKGROUND)
+    assert result.getpixel((3, 1)) == (10, 20, 30)
+    # 完全不透明时直接转换
+    assert prepare_for_format(gradient(), 'JPEG').tobytes() == gradient().convert('RGB').tobytes()
@@ -0,0 +1,95 @@
+import json
+import os
+
+import pytest
+from PIL import Image
+
+from pic_batch import run_batch
+from pic_cli import expand_inputs, main
+from pic_engine import RenderParams, check_output_names, load_layers, output_filename
+from pic_manifest import MANIFEST_NAME
+
+
+def make_deck(tmp_path):
+    """两个子文件夹中各有一张同名图片（内容不同）"""
+    paths = []
+    for i, unit in enumerate(('unit1', 'unit2')):
+        folder = tmp_path / 'deck' / unit
+        folder.mkdir(parents=True)
+        path = folder / '01.png'
+        Image.new('RGB', (50, 40), (100 * i, 50, 200 - 100 * i)).save(path)
+        paths.append(str(path))
+    return str(tmp_path / 'deck'), paths
+
+
+def test_output_filename_keeps_subfolders(tmp_path):
+    root, paths = make_deck(tmp_path)
+    assert [output_filename(path, root=root) for path in paths] == [
+        'unit1/processed_01.png', 'unit2/processed_01.png']
+    # 不指定文件夹时与之前相同，只取文件名
+    assert output_filename(paths[0]) == 'processed_01.png'
+    with pytest.raises(ValueError):
+        check_output_names(paths)
+    check_output_names(paths, root=root)
+
+
+def test_conflicting_formats_fail_before_export(tmp_path):
+    """指定导出格式后同名的a.png和a.jpg会导出为同一个文件"""
+    paths = [str(tmp_path / 'a.png'), str(tmp_path / 'a.jpg')]
+    check_output_names(paths)
+    with pytest.raises(ValueError):
+        check_output_names(paths, 'png', str(tmp_path))
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_duplicate_basenames_do_not_overwrite(tmp_path, workers):
+    root, paths = make_deck(tmp_path)
+    base = str(tmp_path / 'base.png')
+    Image.new('RGBA', (60, 50), (255, 255, 255, 255)).save(base)
+    params = RenderParams(base_img_path=base, use_title_img=False, use_overlay_img=False,
+                          use_top_img=False, output_format='png')
+    layers = load_layers(params)
+    output_dir = str(tmp_path / 'out')
+    os.makedirs(output_dir)
+
+    inputs, input_root = expand_inputs([root])
+    assert inputs == paths and input_root == os.path.abspath(root)
+    succeeded, failed, _, skipped = run_batch(params, layers, inputs, output_dir, workers,
+                                              incremental=True, root=input_root)
+    assert (succeeded, failed, skipped) == (2, [], [])
+    outputs = [os.path.join(output_dir, unit, 'processed_01.png') for unit in ('unit1', 'unit2')]
+    with Image.open(outputs[0]) as a, Image.open(outputs[1]) as b:
+        assert a.tobytes() != b.tobytes()
+    with open(os.path.join(output_dir, MANIFEST_NAME), encoding='utf-8') as f:
+        assert sorted(json.load(f)['entries']) == ['unit1/processed_01.png', 'unit2/processed_01.png']
+
+    # 再次导出时两张都跳过
+    assert run_batch(params, layers, inputs, output_dir, workers, incremental=True, root=input_root)[3] == paths
+
+    # 不保留子文件夹时不导出任何图片
+    with pytest.raises(ValueError):
+        run_batch(params, layers, inputs, str(tmp_path / 'flat'), workers)
+
+
+@pytest.mark.parametrize('workers', ['1', '2'])
+def test_cli_skips_outputs_inside_input_folder(tmp_path, source_images, layer_paths, capsys, workers):
+    """输出目录在输入文件夹中时，第二次导出不会把之前的结果当作新图片再处理"""
+    folder = os.path.dirname(source_images[0])
+    output_dir = os.path.join(folder, 'out')
+    layer_args = [arg for name, path in layer_paths.items() for arg in ('--' + name.replace('_', '-'), path)]
+    argv = ['render', folder, '-o', output_dir, '-j', workers, '-c', str(tmp_path / 'missing.json'),
+            '--output-format', 'png'] + layer_args
+
+    assert main(argv) == 0
+    outputs = sorted(os.listdir(output_dir))
+    assert outputs == sorted([MANIFEST_NAME] + ['processed_' + os.path.basename(p) for p in source_images])
+    capsys.readouterr()
+
+    assert main(argv) == 0
+    out = capsys.readouterr().out
+    assert '已处理 0/0' in out and f'跳过 {len(source_images)} 张' in out
+    assert sorted(os.listdir(output_dir)) == outputs
+
+    # 通配符同样跳过输出目录
+    inputs, _ = expand_inputs([os.path.join(folder, '**', '*.png')], output_dir)
+    assert sorted(inputs) == sorted(source_images)
@@ -0,0 +1,24 @@
+import pytest
+
+from pic_engine import RenderParams, parse_bool
+
+
+@pytest.mark.parametrize('value, expected', [
+    (True, True), (False, False), (1, True), (0, False),
+    ('true', True), ('False', False), ('yes', True), ('no', False),
+    ('on', True), (' off ', False), ('1', True), ('0', False),
+])
+def test_parse_bool(value, expected):
+    assert parse_bool(value) is expected
+
+
+def test_string_false_in_config():
+    params = RenderParams.from_config({'use_overlay_img': 'false', 'use_corner_crop': 'true'})
+    assert params.use_overlay_img is False
+    assert params.use_corner_crop is True
+
+
+@pytest.mark.parametrize('value', ['maybe', '', 2, None])
+def test_invalid_bool_raises(value):
+    with pytest.raises(ValueError):
+        RenderParams.from_config({'use_title_img': value})
@@ -0,0 +1,173 @@
+import threading
+import time
+
+import pytest
+from PIL import Image, ImageChops, ImageStat
+
+from conftest import make_source
+from pic_engine import (
+    PREVIEW_SIZE, RenderParams, Template, load_source_image, make_proxy_layers, proxy_scale, render_card,
+)
+from pic_preview import PreviewScheduler
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.005)
+
+
+class BlockingRender:
+    """记录处理过的请求；block中的请求开始处理后等待release"""
+
+    def __init__(self, block=()):
+        self.calls = []
+        self.block = set(block)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, request):
+        self.calls.append(request)
+        if request in self.block:
+            self.started.set()
+            self.release.wait(10)
+        if request == 'bad':
+            raise ValueError("无法处理")
+        return request.upper()
+
+
+@pytest.fixture
+def make_scheduler():
+    schedulers = []
+
+    def make(render, **kwargs):
+        scheduler = PreviewScheduler(render, **kwargs)
+        schedulers.append(scheduler)
+        return scheduler
+    yield make
+    for scheduler in schedulers:
+        scheduler.close()
+
+
+def test_latest_request_wins(make_scheduler):
+    """处理期间提交的请求只处理最新的一个，过时请求的结果被丢弃"""
+    render = BlockingRender(block={'a'})
+    scheduler = make_scheduler(render, debounce_ms=0)
+    scheduler.submit('a')
+    assert render.started.wait(10)
+    scheduler.submit('b')
+    latest = scheduler.submit('c')
+    render.release.set()
+
+    wait_until(scheduler.is_idle)
+    assert render.calls == ['a', 'c']
+    assert scheduler.poll() == (latest, 'C', None)
+    assert scheduler.poll() is None
+
+
+def test_debounce_coalesces_requests(make_scheduler):
+    render = BlockingRender()
+    scheduler = make_scheduler(render, debounce_ms=200)
+    for request in ('a', 'b', 'c'):
+        latest = scheduler.submit(request)
+    assert not scheduler.is_idle()
+    wait_until(scheduler.is_idle)
+    assert render.calls == ['c']
+    assert scheduler.poll() == (latest, 'C', None)
+
+    # 单独指定不等待的请求立即处理
+    latest = scheduler.submit('d', debounce_ms=0)
+    wait_until(scheduler.is_idle)
+    assert scheduler.poll() == (latest, 'D', None)
+
+
+def test_error_is_reported(make_scheduler):
+    scheduler = make_scheduler(BlockingRender(), debounce_ms=0)
+    generation = scheduler.submit('bad')
+    wait_until(scheduler.is_idle)
+    assert scheduler.poll() == (generation, None, "无法处理")
+
+
+def test_prefetch_fills_cache_while_idle(make_scheduler):
+    render = BlockingRender()
+    scheduler = make_scheduler(render, debounce_ms=0)
+    scheduler.set_token('params-1')
+    scheduler.prefetch([('next', 'n'), ('prev', 'p')])
+    wait_until(lambda: len(render.calls) == 2)
+    wait_until(lambda: scheduler.lookup('prev') is not None)
+    assert render.calls == ['n', 'p']
+    assert scheduler.lookup('next') == 'N'
+
+    # 已经缓存的不再预处理；提交已缓存的请求时直接使用缓存的结果
+    scheduler.prefetch([('next', 'n'), ('other', 'o')])
+    wait_until(lambda: scheduler.lookup('other') is not None)
+    generation = scheduler.submit('n', key='next')
+    wait_until(scheduler.is_idle)
+    assert scheduler.poll() == (generation, 'N', None)
+    assert render.calls == ['n', 'p', 'o']
+
+
+def test_lookup_cancels_pending_request(make_scheduler):
+    """切换到已缓存的图片时，之前等待防抖的请求作废"""
+    render = BlockingRender()
+    scheduler = make_scheduler(render, debounce_ms=0)
+    scheduler.prefetch([('next', 'n')])
+    wait_until(lambda: scheduler.lookup('next') is not None)
+    scheduler.submit('slow', debounce_ms=10000)
+    assert scheduler.lookup('next') == 'N'
+    assert scheduler.is_idle() and scheduler.poll() is None
+    assert render.calls == ['n']
+
+
+def test_token_change_discards_cache(make_scheduler):
+    """参数变化后缓存清空，旧参数下正在处理的结果不放入缓存"""
+    render = BlockingRender(block={'old'})
+    scheduler = make_scheduler(render, debounce_ms=0, cache_size=2)
+    scheduler.set_token('params-1')
+    scheduler.prefetch([('a', 'a'), ('b', 'b'), ('c', 'c')])
+    wait_until(lambda: scheduler.lookup('c') is not None)
+    # 缓存数量有上限，最早的结果被淘汰
+    assert scheduler.lookup('a') is None and scheduler.lookup('b') == 'B'
+
+    scheduler.prefetch([('old', 'old')])
+    assert render.started.wait(10)
+    scheduler.set_token('params-2')
+    assert scheduler.lookup('b') is None
+    render.release.set()
+    # 同一个后台线程按顺序处理，new完成时old的结果已经被丢弃
+    scheduler.prefetch([('new', 'new')])
+    wait_until(lambda: scheduler.lookup('new') is not None)
+    assert scheduler.lookup('old') is None
+
+
+def test_slider_drag_renders_final_proxy_preview(make_scheduler, tmp_path):
+    """拖动滑块时连续提交的预览只处理最后一个，按缩小后的图层以预览分辨率合成，偏移量按比例换算"""
+    layers = {'base': Image.new('RGB', (1400, 1050), (200, 180, 160)),
+              'title': Image.new('RGBA', (600, 200), (20, 40, 60, 200))}
+    img_path = make_source(tmp_path / 'src.png', size=(1800, 1200))
+    scale = proxy_scale(layers)
+    proxies = make_proxy_layers(layers, scale)
+    assert scale == 0.5 and proxies['base'].size == (700, 525)
+
+    rendered = []
+
+    def render_preview(params):
+        rendered.append(params.x_offset)
+        user_img = load_source_image(img_path, proxies['base'].width, params)
+        return render_card(user_img, Template(proxies, params, scale), params)
+
+    scheduler = make_scheduler(render_preview, debounce_ms=150)
+    for x_offset in range(0, 120, 20):
+        latest = scheduler.submit(RenderParams(scale_factor=80, x_offset=x_offset, y_offset=-40))
+    wait_until(scheduler.is_idle)
+    generation, preview, error = scheduler.poll()
+    assert (generation, error) == (latest, None)
+    assert rendered == [100]
+    assert preview.size[0] <= PREVIEW_SIZE[0] and preview.size[1] <= PREVIEW_SIZE[1]
+
+    # 与原始分辨率合成后缩小的结果只有重采样误差
+    params = RenderParams(scale_factor=80, x_offset=100, y_offset=-40)
+    full = render_card(load_source_image(img_path, 1400, params), Template(layers, params), params)
+    diff = ImageChops.difference(full.resize(preview.size, Image.LANCZOS), preview)
+    assert max(ImageStat.Stat(diff).mean) < 3
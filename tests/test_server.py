@@ -0,0 +1,135 @@
+import io
+import json
+import socket
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+from PIL import Image
+
+import pic_metrics
+from conftest import CANVAS_SIZE, make_params
+from pic_cli import main
+from pic_server import RenderServer, RenderService, ServiceBusy, parse_query_params
+
+
+@pytest.fixture
+def server(layer_paths):
+    """在127.0.0.1的空闲端口上启动的合成服务，返回 (服务, 地址)"""
+    service = RenderService(make_params(layer_paths), workers=1, max_queue=1)
+    httpd = RenderServer(service, '127.0.0.1', 0)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield service, f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+    service.close()
+
+
+def request(url, body=None, content_type=None):
+    """发送请求，返回 (状态码, 响应头, 响应体)，错误状态码不抛出异常"""
+    req = urllib.request.Request(url, data=body)
+    if content_type is not None:
+        req.add_header('Content-Type', content_type)
+    try:
+        with urllib.request.urlopen(req, timeout=30) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        with e:
+            return e.code, e.headers, e.read()
+
+
+def test_render_json_path_and_upload(server, source_images, tmp_path):
+    service, url = server
+    body = json.dumps({'path': source_images[0]}).encode('utf-8')
+    status, headers, data = request(url + '/render', body, 'application/json')
+    assert status == 200 and headers['Content-Type'] == 'image/png'
+    with Image.open(io.BytesIO(data)) as img:
+        assert img.size == CANVAS_SIZE
+        by_path = img.tobytes()
+
+    # 上传同一张图片，结果相同；查询字符串中的布尔值与命令行的写法相同
+    with open(source_images[0], 'rb') as f:
+        status, _, data = request(url + '/render?use_corner_crop=off', f.read(), 'image/png')
+    assert status == 200
+    with Image.open(io.BytesIO(data)) as img:
+        assert img.tobytes() == by_path
+
+    # 指定输出目录时保存文件并返回路径
+    body = json.dumps({'path': source_images[1], 'output_dir': str(tmp_path / 'out')}).encode('utf-8')
+    status, _, data = request(url + '/render', body, 'application/json')
+    assert status == 200
+    assert json.loads(data)['output'].endswith('processed_src1.png')
+
+
+def test_health_and_metrics(server, source_images):
+    _, url = server
+    status, _, data = request(url + '/health')
+    assert status == 200 and json.loads(data) == {'status': 'ok'}
+
+    request(url + '/render', json.dumps({'path': source_images[0]}).encode('utf-8'), 'application/json')
+    status, _, data = request(url + '/metrics')
+    stats = json.loads(data)
+    assert status == 200
+    assert stats['queue_depth'] == 0 and stats['max_queue'] == 1
+    assert stats['metrics']['counters']['requests_ok'] == 1
+
+
+@pytest.mark.parametrize('query', ['unknown_param=1', 'use_corner_crop=maybe', 'scale_factor=abc'])
+def test_invalid_query_params(server, source_images, query):
+    _, url = server
+    with open(source_images[0], 'rb') as f:
+        status, _, data = request(f'{url}/render?{query}', f.read(), 'image/png')
+    assert status == 400
+    assert json.loads(data)['error']
+
+
+def test_parse_query_params_uses_engine_booleans():
+    assert parse_query_params({'use_corner_crop': 'Yes', 'fast_decode': '0'}) == {
+        'use_corner_crop': True, 'fast_decode': False}
+
+
+def test_busy_service_returns_503(server, source_images, monkeypatch):
+    """唯一的工作线程被占用、等待队列已满时，新的请求直接返回503"""
+    service, url = server
+    release = threading.Event()
+    started = threading.Event()
+    render = service._render
+
+    def blocked_render(*args):
+        started.set()
+        release.wait(30)
+        return render(*args)
+
+    monkeypatch.setattr(service, '_render', blocked_render)
+    running = service.submit(service.params, source_images[0])
+    assert started.wait(30)
+    queued = service.submit(service.params, source_images[1])
+    with pytest.raises(ServiceBusy):
+        service.submit(service.params, source_images[2])
+
+    status, _, data = request(url + '/render', json.dumps({'path': source_images[3]}).encode('utf-8'),
+                              'application/json')
+    assert status == 503
+    assert json.loads(data)['error']
+
+    release.set()
+    assert 'data' in running.result(30) and 'data' in queued.result(30)
+    assert service.stats()['metrics']['counters']['requests_rejected'] == 2
+
+
+def test_serve_startup_failure_leaves_metrics_disabled(layer_paths, tmp_path):
+    """参数无效或端口被占用时返回2，不留下启用的全局统计"""
+    config = str(tmp_path / 'missing.json')
+    assert main(['serve', '-c', config, '--scale-factor', '-5']) == 2
+    assert pic_metrics.active() is None
+
+    with socket.socket() as busy:
+        busy.bind(('127.0.0.1', 0))
+        busy.listen(1)
+        port = busy.getsockname()[1]
+        layer_args = [arg for name, path in layer_paths.items() for arg in ('--' + name.replace('_', '-'), path)]
+        assert main(['serve', '-c', config, '--port', str(port), '-j', '1'] + layer_args) == 2
+    assert pic_metrics.active() is None
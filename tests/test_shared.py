@@ -0,0 +1,44 @@
+import os
+
+import pytest
+from PIL import Image
+
+from conftest import make_params
+from pic_batch import run_parallel, run_pipeline
+from pic_engine import load_layers
+from pic_shared import SharedLayers, attach_layers
+
+
+@pytest.mark.parametrize('alpha_blend', [False, True])
+def test_parallel_matches_pipeline(tmp_path, layer_paths, source_images, alpha_blend):
+    """工作进程使用主进程构建的共享模板，输出与单进程完全相同"""
+    params = make_params(layer_paths, overlay_alpha_blend=alpha_blend)
+    layers = load_layers(params)
+    img_paths = source_images
+
+    serial_dir, parallel_dir = str(tmp_path / 'serial'), str(tmp_path / 'parallel')
+    os.makedirs(serial_dir)
+    os.makedirs(parallel_dir)
+    assert run_pipeline(params, layers, img_paths, serial_dir)[0] == 4
+    assert run_parallel(params, layers, img_paths, parallel_dir, workers=2)[0] == 4
+
+    for name in os.listdir(serial_dir):
+        with Image.open(os.path.join(serial_dir, name)) as a, Image.open(os.path.join(parallel_dir, name)) as b:
+            assert a.tobytes() == b.tobytes()
+
+
+def test_attached_arrays_are_readonly():
+    np = pytest.importorskip('numpy')
+    image = Image.new('RGB', (8, 4), (1, 2, 3))
+    array = np.arange(8 * 4 * 3, dtype=np.uint16).reshape(4, 8, 3)
+    with SharedLayers({'image': image, 'array': array, 'same': image}) as shared:
+        attached, mapping = attach_layers(shared.handle())
+        # RGB图像映射为数据相同的RGBX
+        assert attached['image'].mode == 'RGBX'
+        assert attached['image'].convert('RGB').tobytes() == image.tobytes()
+        assert attached['same'].readonly
+        assert attached['array'].dtype == array.dtype
+        assert (attached['array'] == array).all()
+        assert not attached['array'].flags.writeable
+        del attached
+        mapping.close()
@@ -0,0 +1,21 @@
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT_DIR
+
+# 启动时不应导入的模块（第一次用到时才导入）
+DEFERRED_MODULES = ('numpy', 'concurrent.futures.process')
+
+
+@pytest.mark.parametrize('module', ['pic_engine', 'english_pic_processor'])
+def test_import_defers_heavy_modules(module):
+    """导入引擎和界面模块时不加载NumPy和进程池（在新的解释器中检查）"""
+    if module == 'english_pic_processor':
+        pytest.importorskip('tkinter')
+    code = (f"import sys, {module}\n"
+            f"print(','.join(name for name in {DEFERRED_MODULES!r} if name in sys.modules))")
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT_DIR, capture_output=True,
+                            text=True, check=True).stdout
+    assert output.strip() == ''
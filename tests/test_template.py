@@ -0,0 +1,132 @@
+import pytest
+from PIL import Image, ImageChops, ImageDraw
+
+from conftest import CANVAS_SIZE, make_params, make_source
+from pic_engine import RenderParams, Template, load_layer, load_layers, load_source_image, render_card
+from pic_manifest import layer_hash
+
+
+def test_opaque_base_loaded_once_as_rgb(tmp_path):
+    """不透明的底图加载为RGB，模板直接使用同一份数据"""
+    path = str(tmp_path / 'base.png')
+    Image.new('RGBA', (64, 40), (10, 20, 30, 255)).save(path)
+
+    base = load_layer(path, rgb_if_opaque=True)
+    assert base.mode == 'RGB'
+    assert layer_hash(base) == layer_hash(load_layer(path, rgb_if_opaque=True))
+
+    params = RenderParams(use_title_img=False, use_overlay_img=False, use_top_img=False)
+    template = Template({'base': base}, params)
+    assert template.mode == 'RGB'
+    assert template.base is base
+
+    # 关闭flatten_opaque时仍按RGBA合成
+    assert Template({'base': base}, params.replace(flatten_opaque=False)).base.mode == 'RGBA'
+
+
+def test_translucent_base_stays_rgba(tmp_path):
+    path = str(tmp_path / 'base.png')
+    Image.new('RGBA', (64, 40), (10, 20, 30, 128)).save(path)
+    assert load_layer(path, rgb_if_opaque=True).mode == 'RGBA'
+
+
+@pytest.mark.parametrize('change', [
+    lambda layers, params, scale: ({**layers, 'title': layers['title'].copy()}, params, scale),
+    lambda layers, params, scale: (layers, params.replace(title_img_path=params.overlay_img_path), scale),
+    lambda layers, params, scale: (layers, params.replace(use_title_img=False), scale),
+    lambda layers, params, scale: (layers, params.replace(use_base_img=False), scale),
+    lambda layers, params, scale: (layers, params.replace(use_overlay_img=False), scale),
+    lambda layers, params, scale: (layers, params.replace(use_top_img=False), scale),
+    lambda layers, params, scale: (layers, params.replace(overlay_scale_factor=80.0), scale),
+    lambda layers, params, scale: (layers, params.replace(overlay_alpha_blend=True), scale),
+    lambda layers, params, scale: (layers, params, 0.5),
+], ids=['layer_image', 'layer_path', 'title', 'base', 'overlay', 'top', 'overlay_scale', 'overlay_alpha', 'proxy_scale'])
+def test_template_invalidated(params, change):
+    """图层、图层启用状态、覆盖图缩放比例或预览的缩小比例变化时需要重新构建模板"""
+    layers = load_layers(params)
+    template = Template(layers, params)
+    assert template.matches(layers, params)
+    # 只影响用户图片的参数不需要重建
+    assert template.matches(layers, params.replace(scale_factor=150.0, x_offset=9, crop_top_percent=0.0))
+
+    new_layers, new_params, scale = change(layers, params, 1.0)
+    assert not template.matches(new_layers, new_params, scale)
+    assert Template(new_layers, new_params, scale).matches(new_layers, new_params, scale)
+
+
+def gradient_layer(size, alpha, angle=0):
+    """内容不均匀的RGBA图层，alpha为None时透明度也是渐变"""
+    g = Image.linear_gradient('L').rotate(angle).resize(size)
+    a = g.rotate(180) if alpha is None else Image.new('L', size, alpha)
+    return Image.merge('RGBA', (g, g.transpose(Image.FLIP_LEFT_RIGHT), Image.new('L', size, 90), a))
+
+
+def baseline_process_image(layers, img_path, params):
+    """旧版本process_image的精简实现（图层都转换为RGBA，用画布大小的临时图层逐层合成）"""
+    layers = {name: Image.open(path).convert('RGBA') for name, path in layers.items()}
+    base = layers['base']
+    result = base.copy() if params.use_base_img else Image.new('RGBA', base.size, (0, 0, 0, 0))
+
+    img = Image.open(img_path).convert('RGBA')
+    img = img.resize((base.width, int(img.height * (base.width / float(img.width)))), Image.LANCZOS)
+    img = img.crop((0, int(img.height * params.crop_top_percent / 100.0), img.width, img.height))
+    img = img.crop((0, 0, img.width, int(img.height * (1 - params.crop_bottom_percent / 100.0))))
+    img = img.crop((0, 0, int(img.width * (1 - params.crop_right_percent / 100.0)), img.height))
+    if params.use_corner_crop:
+        square = int(img.width * params.crop_corner_size / 100.0)
+        corner = Image.new('RGBA', img.size, (0, 0, 0, 0))
+        corner.paste(img, (0, 0), img)
+        ImageDraw.Draw(corner).rectangle([(img.width - square, 0), (img.width, square)], fill=(0, 0, 0, 0))
+        img = corner
+    scale = params.scale_factor / 100.0
+    img = img.resize((int(img.width * scale), int(img.height * scale)), Image.LANCZOS)
+
+    def paste_layer(img, position):
+        layer = Image.new('RGBA', result.size, (0, 0, 0, 0))
+        layer.paste(img, position, img)
+        return layer
+
+    x = (result.width - img.width) // 2 + params.x_offset
+    y = (result.height - img.height) // 2 + params.y_offset
+    result = Image.alpha_composite(result, paste_layer(img, (x, y)))
+    if params.use_title_img:
+        result = Image.alpha_composite(result, paste_layer(layers['title'], (0, 0)))
+    if params.use_overlay_img:
+        overlay = layers['overlay']
+        size = (int(overlay.width * params.overlay_scale_factor / 100.0),
+                int(overlay.height * params.overlay_scale_factor / 100.0))
+        overlay = overlay.resize(size, Image.LANCZOS)
+        overlay_layer = paste_layer(overlay, ((result.width - size[0]) // 2, (result.height - size[1]) // 2))
+        r, g, b, _ = overlay_layer.split()
+        r2, g2, b2, a2 = result.split()
+        result = Image.merge('RGBA', (Image.blend(r2, ImageChops.multiply(r, r2), 0.7),
+                                      Image.blend(g2, ImageChops.multiply(g, g2), 0.7),
+                                      Image.blend(b2, ImageChops.multiply(b, b2), 0.7), a2))
+    if params.use_top_img:
+        result = Image.alpha_composite(result, paste_layer(layers['top'], (0, 0)))
+    return result
+
+
+@pytest.mark.parametrize('base_alpha', [255, None], ids=['opaque', 'translucent'])
+@pytest.mark.parametrize('use_title_img, use_overlay_img, use_top_img', [
+    (True, True, True), (False, True, False), (True, False, True), (False, False, False)])
+@pytest.mark.parametrize('use_corner_crop', [False, True])
+def test_render_card_matches_baseline(tmp_path, base_alpha, use_title_img, use_overlay_img, use_top_img,
+                                      use_corner_crop):
+    """预先构建的模板与旧版本逐层合成的结果逐像素相同"""
+    paths = {}
+    for name, size, alpha, angle in (('base', CANVAS_SIZE, base_alpha, 0), ('title', (60, 20), None, 90),
+                                     ('overlay', (80, 60), None, 45), ('top', (30, 30), 180, 270)):
+        paths[name] = str(tmp_path / f'{name}.png')
+        gradient_layer(size, alpha, angle).save(paths[name])
+    source = make_source(tmp_path / 'src.png', size=(150, 110), shade=70)
+    params = make_params({f'{name}_img_path': path for name, path in paths.items()},
+                         scale_factor=120.0, x_offset=7, y_offset=-5, overlay_scale_factor=110.0,
+                         use_corner_crop=use_corner_crop, crop_corner_size=25.0, fast_decode=False,
+                         use_title_img=use_title_img, use_overlay_img=use_overlay_img, use_top_img=use_top_img)
+
+    layers = load_layers(params)
+    template = Template(layers, params)
+    result = render_card(load_source_image(source, template.size[0], params), template, params)
+    assert result.mode == ('RGB' if base_alpha == 255 else 'RGBA')
+    assert result.convert('RGBA').tobytes() == baseline_process_image(paths, source, params).tobytes()
@@ -0,0 +1,95 @@
+import io
+import os
+
+import pytest
+from PIL import Image
+
+import pic_output
+from conftest import make_params
+from pic_engine import Renderer, render_card, render_strips
+from pic_output import PNGStreamWriter, save_strips
+
+
+@pytest.fixture(params=[True, False], ids=['numpy', 'no-numpy'])
+def use_numpy(request, monkeypatch):
+    """分别使用NumPy的过滤实现和不过滤的纯Python实现"""
+    if request.param:
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(pic_output, 'load_numpy', lambda: None)
+    return request.param
+
+
+def noise_image(mode, size):
+    """内容随机的图片（各种过滤方式都会被选中）"""
+    return Image.frombytes(mode, size, os.urandom(size[0] * size[1] * len(mode)))
+
+
+def stream_png(img, rows, **kwargs):
+    """用PNGStreamWriter按每条rows行写入img，返回解码后的图片"""
+    f = io.BytesIO()
+    writer = PNGStreamWriter(f, img.size, img.mode, **kwargs)
+    for top in range(0, img.height, rows):
+        writer.write(img.crop((0, top, img.width, min(top + rows, img.height))))
+    writer.close()
+    f.seek(0)
+    decoded = Image.open(f)
+    decoded.load()
+    return decoded
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA'])
+@pytest.mark.parametrize('rows', [1, 7, 64])
+def test_stream_writer_roundtrip(use_numpy, mode, rows):
+    img = noise_image(mode, (37, 50))
+    decoded = stream_png(img, rows)
+    assert decoded.mode == mode
+    assert decoded.tobytes() == img.tobytes()
+
+
+def test_stream_writer_compression_options(use_numpy):
+    img = Image.linear_gradient('L').resize((64, 48)).convert('RGB')
+    for options in ({'compress_level': 1}, {'compress_level': 9}, {'optimize': True}):
+        assert stream_png(img, 10, **options).tobytes() == img.tobytes()
+
+
+def test_stream_writer_rejects_missing_rows():
+    writer = PNGStreamWriter(io.BytesIO(), (8, 8), 'RGB')
+    writer.write(Image.new('RGB', (8, 5)))
+    with pytest.raises(ValueError):
+        writer.close()
+
+
+@pytest.mark.parametrize('flatten_opaque, mode', [(True, 'RGB'), (False, 'RGBA')])
+def test_strips_match_render_card(use_numpy, layer_paths, source_images, tmp_path, flatten_opaque, mode):
+    """逐条写入的PNG与整张合成的结果逐像素一致（行数不是横条高度的整数倍）"""
+    params = make_params(layer_paths, flatten_opaque=flatten_opaque, scale_factor=130, y_offset=-7)
+    renderer = Renderer(params)
+    template = renderer.get_template()
+    user_img = renderer.load(source_images[1])
+    expected = render_card(user_img, template, params)
+
+    strips = list(render_strips(user_img, template, params, rows=10))
+    assert [strip.height for strip in strips] == [10] * 7 + [2]
+    assert b''.join(strip.tobytes() for strip in strips) == expected.tobytes()
+
+    output_path = str(tmp_path / 'tiled.png')
+    save_strips(render_strips(user_img, template, params, rows=10), template.size,
+                template.is_opaque(), output_path, params)
+    with Image.open(output_path) as img:
+        assert img.mode == mode
+        assert img.tobytes() == expected.convert(mode).tobytes()
+
+
+@pytest.mark.parametrize('output_format', ['png', 'jpeg', 'webp'])
+def test_tiled_render_matches_normal_export(layer_paths, source_images, tmp_path, output_format):
+    """分块导出与普通导出的文件内容相同（JPEG/WebP拼接为整张画布后按普通方式保存）"""
+    outputs = {}
+    for tiled in (False, True):
+        params = make_params(layer_paths, output_format=output_format, tiled_render=tiled)
+        output_dir = str(tmp_path / str(tiled))
+        os.makedirs(output_dir)
+        output_path = Renderer(params).render_to_dir(source_images[0], output_dir)
+        with Image.open(output_path) as img:
+            outputs[tiled] = (img.format, img.mode, img.tobytes())
+    assert outputs[True] == outputs[False]
@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+from conftest import make_params, make_source
+from pic_engine import RenderParams
+from pic_watch import FolderWatcher
+
+
+def run_scans(watcher, times=3):
+    """连续扫描并处理几次（settle为0时，文件在第二次扫描时才处理）"""
+    processed = []
+    for _ in range(times):
+        ready = watcher.scan()
+        processed.extend(ready)
+        if ready:
+            watcher.process(ready)
+    return processed
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize('nested', [True, False])
+def test_output_inside_input_is_not_reprocessed(tmp_path, nested):
+    """输出目录在输入文件夹中（或就是输入文件夹）时，导出的结果不会被再次处理"""
+    base = str(tmp_path / 'base.png')
+    Image.new('RGBA', (40, 30), (200, 100, 50, 255)).save(base)
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    output_dir = input_dir / 'out' if nested else input_dir
+    Image.new('RGB', (50, 40), (10, 20, 30)).save(input_dir / 'a.png')
+
+    watcher = FolderWatcher(str(input_dir), str(output_dir),
+                            lambda: RenderParams(base_img_path=base, use_title_img=False,
+                                                 use_overlay_img=False, use_top_img=False),
+                            settle=0)
+    assert run_scans(watcher) == [str(input_dir / 'a.png')]
+    assert os.path.exists(output_dir / 'processed_a.png')
+
+    # 导出的文件已经写完，之后的扫描不会再处理
+    assert run_scans(watcher) == []
+    assert not any(name.startswith('processed_processed_') for _, _, names in os.walk(input_dir) for name in names)
+
+
+@pytest.fixture
+def watch_dirs(tmp_path):
+    input_dir, output_dir = tmp_path / 'in', tmp_path / 'out'
+    input_dir.mkdir()
+    return input_dir, output_dir
+
+
+def make_watcher(layer_paths, watch_dirs, results, load_params=None, **kwargs):
+    input_dir, output_dir = watch_dirs
+    if load_params is None:
+        def load_params():
+            return make_params(layer_paths)
+    return FolderWatcher(str(input_dir), str(output_dir), load_params,
+                         on_result=lambda *args: results.append(args), **kwargs)
+
+
+def test_modified_image_is_rendered_again(layer_paths, watch_dirs):
+    input_dir, output_dir = watch_dirs
+    a, b = make_source(input_dir / 'a.png'), make_source(input_dir / 'b.png', shade=100)
+    results = []
+    watcher = make_watcher(layer_paths, watch_dirs, results, settle=0)
+    assert sorted(run_scans(watcher)) == [a, b]
+    with Image.open(output_dir / 'processed_a.png') as img:
+        before = img.tobytes()
+
+    st = os.stat(a)
+    make_source(a, shade=250)
+    os.utime(a, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert run_scans(watcher) == [a]
+    with Image.open(output_dir / 'processed_a.png') as img:
+        assert img.tobytes() != before
+
+    # 重新启动后没有变化的图片直接跳过，不再导出
+    results.clear()
+    restarted = make_watcher(layer_paths, watch_dirs, results, settle=0)
+    assert sorted(run_scans(restarted)) == [a, b]
+    assert [output_path for _, output_path, _ in results] == [None, None]
+
+
+def test_image_is_processed_after_it_settles(layer_paths, watch_dirs):
+    """文件在两次扫描之间仍在变化，或者没有经过settle秒时不处理"""
+    input_dir, _ = watch_dirs
+    path = input_dir / 'a.png'
+    results = []
+    watcher = make_watcher(layer_paths, watch_dirs, results, settle=0)
+    path.write_bytes(b'half')
+    assert watcher.scan() == []
+    make_source(path)
+    assert watcher.scan() == []
+    assert watcher.scan() == [str(path)]
+
+    slow = make_watcher(layer_paths, watch_dirs, [], settle=60)
+    assert run_scans(slow, times=5) == []
+
+
+def test_config_change_reloads_params(layer_paths, watch_dirs, tmp_path):
+    input_dir, output_dir = watch_dirs
+    path = make_source(input_dir / 'a.png')
+    config_path = tmp_path / 'config.json'
+    config_path.write_text(json.dumps({'scale_factor': 100}), encoding='utf-8')
+
+    def load_params():
+        with open(config_path, encoding='utf-8') as f:
+            return make_params(layer_paths, **json.load(f))
+
+    results = []
+    watcher = make_watcher(layer_paths, watch_dirs, results, load_params, interval=0.01, settle=0,
+                           config_path=str(config_path))
+    stop = threading.Event()
+    thread = threading.Thread(target=watcher.run, args=(stop,))
+    thread.start()
+    try:
+        wait_for(lambda: len(results) == 1)
+        with Image.open(output_dir / 'processed_a.png') as img:
+            before = img.tobytes()
+
+        # 修改时间的精度可能较粗，同时改变文件大小
+        config_path.write_text(json.dumps({'scale_factor': 150}, indent=2), encoding='utf-8')
+        wait_for(lambda: len(results) == 2)
+    finally:
+        stop.set()
+        thread.join()
+    assert [(img_path, error) for img_path, _, error in results] == [(path, None), (path, None)]
+    assert watcher.renderer.params.scale_factor == 150
+    with Image.open(output_dir / 'processed_a.png') as img:
+        assert img.tobytes() != before